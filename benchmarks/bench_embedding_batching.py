@@ -0,0 +1,64 @@
+"""
+Embedding throughput (chunks/s) of arrival-order vs length-bucketed batches,
+on chunks of 20-2000 characters (log-normal lengths, like chunker output).
+Needs sentence-transformers and downloads the model on first use.
+
+    python -m benchmarks.bench_embedding_batching --chunks 2000 --batch 64
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+from src.agents.workflow.embedding import EmbeddingAgent
+
+WORDS = ("retrieval augmented generation index vector sparse dense query chunk document graph entity "
+         "relation community answer context model embedding score rank fusion latency cache shard").split()
+
+def make_chunks(n: int, rng: np.random.Generator):
+    lengths = np.clip(rng.lognormal(mean=6.0, sigma=0.9, size=n), 20, 2000).astype(int)
+    chunks = []
+    for length in lengths:
+        text = " ".join(rng.choice(WORDS, size=length // 6 + 1))
+        chunks.append(text[:length])
+    return chunks, lengths
+
+async def run(agent: EmbeddingAgent, chunks, batch: int) -> float:
+    # Requests of `batch` chunks each, as the ingestion pipeline sends them
+    start = time.perf_counter()
+    for i in range(0, len(chunks), batch):
+        await agent.execute({"texts": chunks[i:i + batch]})
+    return len(chunks) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--token-budget", type=int, nargs="+", default=[4096, 16384])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    chunks, lengths = make_chunks(args.chunks, np.random.default_rng(args.seed))
+    print(f"{args.chunks} chunks, {lengths.min()}-{lengths.max()} chars (median {int(np.median(lengths))}), "
+          f"requests of {args.batch}")
+
+    configs = [("arrival order", False, 0)] + [(f"bucketed {b}", True, b) for b in args.token_budget]
+    print(f"{'mode':<18}{'chunks/s':>10}{'speedup':>9}")
+    baseline = None
+    agents = []
+    for name, bucketing, budget in configs:
+        # Agents share the loaded model through the model registry
+        agent = EmbeddingAgent("bench", model_name=args.model, max_batch=args.batch,
+                               length_bucketing=bucketing, token_budget=budget)
+        agents.append(agent)
+        if agent.model is None:
+            raise SystemExit("sentence-transformers is required for this benchmark")
+        asyncio.run(run(agent, chunks[:args.batch], args.batch))  # warm-up
+        throughput = asyncio.run(run(agent, chunks, args.batch))
+        baseline = baseline or throughput
+        print(f"{name:<18}{throughput:>10.1f}{throughput / baseline:>8.2f}x")
+    for agent in agents:
+        agent.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare result fusion implementations: the former dict-based RRF, the
+vectorized fuse (RRF, CombSUM, CombMNZ) and the early-terminating threshold merge.
+
+    python -m benchmarks.bench_fusion --retrievers 5 --candidates 1000 --top-k 10
+"""
+import argparse
+import time
+from collections import defaultdict
+import numpy as np
+from src.agents.retrieval.fusion import HybridFusionAgent, threshold_fuse
+
+def legacy_rrf(results_map, rrf_k: int = 60):
+    # The dict-based implementation fusion.py replaced
+    scores = defaultdict(float)
+    metadata_map = {}
+    for items in results_map.values():
+        for rank, item in enumerate(items):
+            scores[item['id']] += 1.0 / (rrf_k + rank + 1)
+            if item['id'] not in metadata_map:
+                metadata_map[item['id']] = item
+    fused = []
+    for doc_id in sorted(scores, key=lambda x: scores[x], reverse=True):
+        result = metadata_map[doc_id].copy()
+        result['score'] = scores[doc_id]
+        result['fusion_rank'] = len(fused) + 1
+        fused.append(result)
+    return fused
+
+def make_results(retrievers: int, candidates: int, pool: int, noise: float, seed: int):
+    # Retrievers agree up to noise: each ranks a pool of ids around a shared relevance order
+    rng = np.random.default_rng(seed)
+    results = {}
+    for r in range(retrievers):
+        ranked = np.argsort(np.arange(pool) + rng.normal(0, noise * pool, size=pool))[:candidates]
+        scores = np.sort(rng.random(candidates))[::-1]
+        results[f"retriever{r}"] = [{'id': f"doc{i}", 'score': float(s), 'text': f"text of doc {i}"}
+                                    for i, s in zip(ranked, scores)]
+    return results
+
+def time_ms(fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--retrievers", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=1000)
+    parser.add_argument("--pool", type=int, default=3000)
+    parser.add_argument("--noise", type=float, default=0.1, help="rank noise as a fraction of the pool")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = make_results(args.retrievers, args.candidates, args.pool, args.noise, args.seed)
+    agent = HybridFusionAgent("fusion")
+    expected = [d['id'] for d in legacy_rrf(results)[:args.top_k]]
+    runs = {
+        "legacy rrf": lambda: legacy_rrf(results)[:args.top_k],
+        "rrf": lambda: agent.reciprocal_rank_fusion(results, args.top_k),
+        "combsum": lambda: agent.reciprocal_rank_fusion(results, args.top_k, "combsum"),
+        "combmnz": lambda: agent.reciprocal_rank_fusion(results, args.top_k, "combmnz"),
+        "threshold rrf": lambda: [{'id': doc_id} for doc_id, _ in threshold_fuse(
+            [((d['id'], d['score']) for d in items) for items in results.values()], args.top_k)[0]],
+    }
+
+    print(f"{args.retrievers} retrievers x {args.candidates} candidates, top-{args.top_k}")
+    print(f"{'method':<16}{'ms':>9}{'same top-k as legacy':>22}")
+    for name, fn in runs.items():
+        ms = time_ms(fn, args.repeat)
+        same = [d['id'] for d in fn()] == expected if "rrf" in name else "-"
+        print(f"{name:<16}{ms:>9.3f}{str(same):>22}")
+
+if __name__ == "__main__":
+    main()
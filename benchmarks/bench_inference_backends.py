@@ -0,0 +1,122 @@
+"""
+Quality and latency of the ONNX and int8 inference backends against PyTorch fp32.
+
+Embedding models: cosine similarity to the fp32 embeddings and recall@k of
+nearest-neighbour search. Cross-encoders: Spearman correlation of the scores
+and top-k agreement of the reranked lists. Latency is per batch on this CPU.
+Needs sentence-transformers with the onnx extra; exports are cached under
+settings.ONNX_CACHE_DIR.
+
+    python -m benchmarks.bench_inference_backends --texts 1000 --queries 50
+    python -m benchmarks.bench_inference_backends --corpus chunks.txt
+"""
+import argparse
+import time
+import numpy as np
+from src.agents.inference import INFERENCE_BACKENDS
+from src.agents.models import model_registry
+
+WORDS = ("retrieval augmented generation index vector sparse dense query chunk document graph entity "
+         "relation community answer context model embedding score rank fusion latency cache shard "
+         "the a of to and in is for on with how what why does").split()
+
+def synthetic_texts(n: int, rng: np.random.Generator):
+    lengths = np.clip(rng.lognormal(mean=3.5, sigma=0.6, size=n), 4, 200).astype(int)
+    return [" ".join(rng.choice(WORDS, size=length)) for length in lengths]
+
+def timed(fn, batches, repeats: int):
+    """Outputs of ``fn`` over ``batches`` and the median latency per batch (ms)."""
+    outputs = [fn(batch) for batch in batches]  # warm-up, and the outputs compared
+    times = []
+    for _ in range(repeats):
+        for batch in batches:
+            start = time.perf_counter()
+            fn(batch)
+            times.append(time.perf_counter() - start)
+    return np.concatenate([np.asarray(o, dtype=np.float32) for o in outputs]), float(np.median(times)) * 1000
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    ranks_a = np.argsort(np.argsort(a))
+    ranks_b = np.argsort(np.argsort(b))
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+def compare_embeddings(model_name, texts, queries, backends, batch, top_k, repeats):
+    from sentence_transformers import SentenceTransformer
+    print(f"\n{model_name}: {len(texts)} texts, {len(queries)} queries, batch {batch}")
+    print(f"{'backend':<12}{'ms/batch':>10}{'speedup':>9}{'cos mean':>10}{'cos min':>9}{'recall@' + str(top_k):>11}")
+    batches = [texts[i:i + batch] for i in range(0, len(texts), batch)]
+    reference = None
+    for backend in backends:
+        model = model_registry.acquire(SentenceTransformer, model_name, backend=backend)
+        embeddings, latency = timed(model.encode, batches, repeats)
+        embeddings = normalize(embeddings)
+        query_vectors = normalize(np.asarray(model.encode(queries), dtype=np.float32))
+        neighbours = np.argsort(-(query_vectors @ embeddings.T), axis=1)[:, :top_k]
+        if reference is None:
+            reference = (embeddings, neighbours, latency)
+        ref_embeddings, ref_neighbours, ref_latency = reference
+        cosine = np.sum(embeddings * ref_embeddings, axis=1)
+        recall = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(neighbours, ref_neighbours)])
+        print(f"{backend:<12}{latency:>10.1f}{ref_latency / latency:>8.2f}x"
+              f"{cosine.mean():>10.4f}{cosine.min():>9.4f}{recall:>11.3f}")
+        model_registry.release(model)
+
+def compare_cross_encoder(model_name, texts, queries, backends, batch, top_k, repeats):
+    from sentence_transformers import CrossEncoder
+    per_query = min(len(texts), 100)
+    pairs = [(query, text) for query in queries for text in texts[:per_query]]
+    print(f"\n{model_name}: {len(queries)} queries x {per_query} passages, batch {batch}")
+    print(f"{'backend':<12}{'ms/batch':>10}{'speedup':>9}{'spearman':>10}{'top' + str(top_k) + ' agree':>12}")
+    batches = [pairs[i:i + batch] for i in range(0, len(pairs), batch)]
+    reference = None
+    for backend in backends:
+        model = model_registry.acquire(CrossEncoder, model_name, backend=backend)
+        scores, latency = timed(model.predict, batches, repeats)
+        # NLI models score several labels per pair: compare the first
+        scores = scores.reshape(len(queries), per_query, -1)[:, :, 0]
+        if reference is None:
+            reference = (scores, latency)
+        ref_scores, ref_latency = reference
+        correlation = np.mean([spearman(a, b) for a, b in zip(scores, ref_scores)])
+        agreement = np.mean([
+            len(set(np.argsort(-a)[:top_k]) & set(np.argsort(-b)[:top_k])) / top_k
+            for a, b in zip(scores, ref_scores)
+        ])
+        print(f"{backend:<12}{latency:>10.1f}{ref_latency / latency:>8.2f}x{correlation:>10.4f}{agreement:>12.3f}")
+        model_registry.release(model)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embedding-model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--cross-encoders", nargs="*",
+                        default=["cross-encoder/ms-marco-MiniLM-L-6-v2", "cross-encoder/nli-deberta-v3-base"])
+    parser.add_argument("--backends", nargs="+", default=list(INFERENCE_BACKENDS), choices=INFERENCE_BACKENDS)
+    parser.add_argument("--corpus", help="text file with one passage per line (default: synthetic)")
+    parser.add_argument("--texts", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.corpus:
+        with open(args.corpus) as f:
+            texts = [line.strip() for line in f if line.strip()][:args.texts]
+    else:
+        texts = synthetic_texts(args.texts, rng)
+    # Queries: short fragments of passages
+    queries = [" ".join(texts[i].split()[:8]) for i in rng.choice(len(texts), size=args.queries, replace=False)]
+    # fp32 first: it is the reference the others are compared with
+    backends = sorted(args.backends, key=INFERENCE_BACKENDS.index)
+
+    compare_embeddings(args.embedding_model, texts, queries, backends, args.batch, args.top_k, args.repeats)
+    for model_name in args.cross_encoders:
+        compare_cross_encoder(model_name, texts, queries, backends, args.batch, args.top_k, args.repeats)
+
+if __name__ == "__main__":
+    main()
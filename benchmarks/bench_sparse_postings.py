@@ -0,0 +1,79 @@
+"""
+Compare plain and compressed BM25 postings: on-disk size and query latency.
+
+    python -m benchmarks.bench_sparse_postings --docs 200000 --queries 500
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from src.agents.retrieval.bm25 import BM25Index
+
+def make_corpus(num_docs: int, vocab_size: int, seed: int):
+    # Zipfian term distribution, like natural text
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(20, 200, size=num_docs)
+    terms = np.minimum(rng.zipf(1.2, size=int(lengths.sum())), vocab_size) - 1
+    words = [f"t{i}" for i in range(vocab_size)]
+    corpus, start = [], 0
+    for length in lengths:
+        corpus.append([words[t] for t in terms[start:start + length]])
+        start += length
+    return corpus, words
+
+def make_queries(words, num_queries: int, seed: int):
+    rng = np.random.default_rng(seed + 1)
+    return [[words[t] for t in rng.integers(0, min(len(words), 5000), size=rng.integers(2, 6))]
+            for _ in range(num_queries)]
+
+def segment_size(path: str, names) -> int:
+    return sum(os.path.getsize(os.path.join(path, f"{name}.npy")) for name in names)
+
+def time_queries(index: BM25Index, queries, k: int, pruned: bool) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        index.top_k(query, k, pruned=pruned)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus, words = make_corpus(args.docs, args.vocab, args.seed)
+    queries = make_queries(words, args.queries, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name in ("plain", "compressed"):
+            index = BM25Index()
+            start = time.perf_counter()
+            index.build(corpus)
+            if name == "compressed":
+                index.compress()
+            path = os.path.join(tmp, name)
+            index.save(path)
+            build_s = time.perf_counter() - start
+            index = BM25Index.open(path)
+            results[name] = {
+                "build_s": build_s,
+                "postings_mb": segment_size(path, index.postings.arrays) / 2**20,
+                "pruned_ms": time_queries(index, queries, args.top_k, pruned=True),
+                "exact_ms": time_queries(index, queries, args.top_k, pruned=False),
+            }
+            # Same ranking either way (tfs above 255 aside)
+            results[name]["top"] = [index.top_k(q, args.top_k) for q in queries[:20]]
+
+    print(f"{args.docs} docs, {args.queries} queries, top-{args.top_k}")
+    print(f"{'layout':<12}{'postings MB':>12}{'build s':>10}{'pruned ms':>11}{'exact ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<12}{r['postings_mb']:>12.1f}{r['build_s']:>10.2f}{r['pruned_ms']:>11.2f}{r['exact_ms']:>10.2f}")
+    ratio = results["plain"]["postings_mb"] / results["compressed"]["postings_mb"]
+    print(f"compression ratio {ratio:.2f}x, rankings identical: {results['plain']['top'] == results['compressed']['top']}")
+
+if __name__ == "__main__":
+    main()
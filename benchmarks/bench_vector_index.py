@@ -0,0 +1,68 @@
+"""
+Recall and latency of the in-process vector index modes, without a Qdrant service.
+
+    python -m benchmarks.bench_vector_index --points 20000 --dim 384 --queries 200
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from src.agents.retrieval.vector_index import LocalVectorIndex
+
+def make_vectors(n: int, dim: int, clusters: int, rng: np.random.Generator, centers: np.ndarray) -> np.ndarray:
+    # Clustered data, closer to sentence embeddings than isotropic noise
+    return (centers[rng.integers(0, clusters, n)] + 0.5 * rng.normal(size=(n, dim))).astype(np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(args.clusters, args.dim))
+    vectors = make_vectors(args.points, args.dim, args.clusters, rng, centers)
+    queries = make_vectors(args.queries, args.dim, args.clusters, rng, centers)
+    ids = list(range(args.points))
+
+    print(f"{args.points} points x {args.dim} dims, {args.queries} queries, top-{args.top_k}")
+    print(f"{'mode':<22}{'build s':>9}{'size MB':>9}{'recall':>8}{'ms/query':>10}")
+    truth = None
+    with tempfile.TemporaryDirectory() as tmp:
+        configs = [("exact", "float32", None), ("exact", "float16", None)]
+        configs += [("hnsw", "float32", ef) for ef in args.ef_search]
+        built = {}
+        for mode, dtype, ef in configs:
+            if (mode, dtype) not in built:
+                start = time.perf_counter()
+                index = LocalVectorIndex(args.dim, mode=mode, dtype=dtype)
+                index.add(ids, vectors)
+                path = os.path.join(tmp, f"{mode}-{dtype}")
+                index.save(path)
+                size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / 2**20
+                built[(mode, dtype)] = (LocalVectorIndex.open(path), time.perf_counter() - start, size)
+            index, build_s, size = built[(mode, dtype)]
+            if ef is not None:
+                index.ef_search = ef
+
+            start = time.perf_counter()
+            if mode == "exact":
+                results = index.search(queries, args.top_k)
+            else:
+                results = [index.search(query, args.top_k)[0] for query in queries]
+            latency = (time.perf_counter() - start) / len(queries) * 1000
+            rows = [{row for row, _ in hits} for hits in results]
+            if truth is None:
+                truth = rows
+            recall = np.mean([len(r & t) / args.top_k for r, t in zip(rows, truth)])
+            name = f"{mode}/{dtype}" + (f" ef={ef}" if ef is not None else "")
+            print(f"{name:<22}{build_s:>9.2f}{size:>9.1f}{recall:>8.3f}{latency:>10.3f}")
+
+if __name__ == "__main__":
+    main()
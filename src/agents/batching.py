@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+Request = Tuple[List[Any], Future]
+
+def length_buckets(lengths: Sequence[int], token_budget: int, max_batch: int) -> List[np.ndarray]:
+    """
+    Split items into batches of similar length, shortest first.
+    A batch is padded to its longest item, so each takes as many items as
+    fit in ``token_budget`` padded tokens (at least one, at most ``max_batch``).
+    Returns the item indices of each batch.
+    """
+    lengths = np.maximum(np.asarray(lengths, dtype=np.int64), 1)
+    order = np.argsort(lengths, kind="stable")
+    buckets = []
+    start = 0
+    while start < len(order):
+        end = start + 1
+        # Sorted ascending: the last item of a batch sets its padded length
+        while end < len(order) and end - start < max_batch and (end - start + 1) * lengths[order[end]] <= token_budget:
+            end += 1
+        buckets.append(order[start:end])
+        start = end
+    return buckets
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls of a batch function (e.g. ``model.encode``).
+
+    Callers submit lists of items and get a future for their slice of the
+    output. A worker thread takes the first pending request, keeps collecting
+    for up to ``max_wait_ms`` or until ``max_batch`` items are queued, runs
+    ``fn`` once on the concatenated items and resolves every caller's future.
+    A single request larger than ``max_batch`` is run on its own.
+    """
+    def __init__(self, fn: Callable[[List[Any]], Sequence[Any]], max_wait_ms: float = 5.0,
+                 max_batch: int = 64, name: str = "batcher"):
+        self.fn = fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max_batch
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue: "queue.Queue[Optional[Request]]" = queue.Queue()
+        self._carry: Optional[Request] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, items: Sequence[Any]) -> Future:
+        """Queue ``items``; the future resolves to ``fn``'s outputs for them."""
+        future: Future = Future()
+        if not items:
+            future.set_result([])
+            return future
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+                self._thread.start()
+            self._queue.put((list(items), future))
+        return future
+
+    async def run(self, items: Sequence[Any]) -> Sequence[Any]:
+        """
+        ``submit`` for coroutines: awaits the batched result, a slice of
+        ``fn``'s output (a view when ``fn`` returns an array).
+        """
+        return await asyncio.wrap_future(self.submit(items))
+
+    def _next(self, timeout: Optional[float]) -> Optional[Request]:
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        if timeout is None:
+            return self._queue.get()
+        if timeout <= 0:
+            return self._queue.get_nowait()
+        return self._queue.get(timeout=timeout)
+
+    def _collect(self) -> Optional[List[Request]]:
+        first = self._next(None)
+        if first is None:
+            return None
+        requests = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            try:
+                request = self._next(deadline - time.monotonic())
+            except queue.Empty:
+                break
+            if request is None:
+                # Stop after this batch
+                self._queue.put(None)
+                break
+            if size + len(request[0]) > self.max_batch:
+                self._carry = request
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            if requests is None:
+                return
+            # Skip callers that were cancelled while queued
+            requests = [(items, future) for items, future in requests if future.set_running_or_notify_cancel()]
+            if not requests:
+                continue
+            batch = [item for items, _ in requests for item in items]
+            try:
+                outputs = self.fn(batch)
+            except Exception as e:
+                logger.error(f"{self.name} batch of {len(batch)} failed: {e}")
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            start = 0
+            for items, future in requests:
+                future.set_result(outputs[start:start + len(items)])
+                start += len(items)
+
+    def close(self):
+        """Finish queued requests and stop the worker thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
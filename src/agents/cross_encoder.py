@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Sequence
+import numpy as np
+from src.agents.batching import MicroBatcher, length_buckets
+from src.agents.passages import PassageWindower
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+Pair = Sequence[str]
+
+class CrossEncoderExecutor:
+    """
+    Batches ``predict`` calls on one CrossEncoder across concurrent requests.
+
+    Pairs submitted within ``max_wait_ms`` of each other (up to ``max_batch``)
+    are merged, sorted by length and run in buckets of at most
+    ``token_budget`` padded tokens in the executor's worker thread; each
+    caller gets the scores of its own pairs back.
+
+    With ``windowing`` and a fast (offset-mapping) tokenizer on the model,
+    passages longer than the model reads are first cut to their most
+    query-relevant window (see PassageWindower), whose token counts drive
+    the bucketing; ``token_cache_size`` offset mappings are cached. Only
+    that offset pass is cached: ``predict`` tokenizes the windowed pairs.
+    Otherwise lengths are estimated from characters (about 4 per token),
+    which is enough to group similar pairs.
+
+    ``pair_ms`` is a moving average of the model's forward time per pair,
+    measured around each bucket (queueing and batching waits excluded).
+    """
+    def __init__(self, model: Any, max_wait_ms: float = 2.0, max_batch: int = 128, token_budget: int = 16384,
+                 windowing: bool = True, token_cache_size: int = 10000):
+        self.model = model
+        self.token_budget = token_budget
+        self.max_length = getattr(model, "max_length", None) or 512
+        self.pair_ms = 2.0
+        tokenizer = getattr(model, "tokenizer", None)
+        self.windower = None
+        if windowing and getattr(tokenizer, "is_fast", False):
+            self.windower = PassageWindower(tokenizer, max_length=self.max_length, cache_size=token_cache_size)
+        self.batcher = MicroBatcher(self._predict, max_wait_ms=max_wait_ms, max_batch=max_batch,
+                                    name="cross-encoder")
+
+    def _predict(self, pairs: List[Pair]) -> np.ndarray:
+        if self.windower is not None:
+            pairs, lengths = self.windower(pairs)
+        else:
+            lengths = [min((len(pair[0]) + len(pair[1])) // 4 + 3, self.max_length) for pair in pairs]
+        scores = None
+        for bucket in length_buckets(lengths, self.token_budget, len(pairs)):
+            started = time.perf_counter()
+            predicted = np.asarray(self.model.predict([pairs[i] for i in bucket], batch_size=len(bucket)))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.pair_ms = 0.8 * self.pair_ms + 0.2 * elapsed_ms / len(bucket)
+            if scores is None:
+                # One score per pair, or one per label for NLI models
+                scores = np.empty((len(pairs),) + predicted.shape[1:], dtype=predicted.dtype)
+            scores[bucket] = predicted
+        return scores
+
+    async def predict(self, pairs: Sequence[Pair]) -> np.ndarray:
+        """Scores of ``pairs``, batched with other concurrent callers."""
+        return np.asarray(await self.batcher.run(list(pairs)))
+
+    def close(self):
+        self.batcher.close()
+
+# One executor per loaded model, shared by every agent using it
+_executors: Dict[int, CrossEncoderExecutor] = {}
+_lock = threading.Lock()
+
+def get_executor(model: Any, **options) -> CrossEncoderExecutor:
+    """
+    The shared executor of ``model``; ``options`` (see CrossEncoderExecutor)
+    apply when it is created.
+    """
+    with _lock:
+        executor = _executors.get(id(model))
+        if executor is None or executor.model is not model:
+            executor = _executors[id(model)] = CrossEncoderExecutor(model, **options)
+        return executor
+
+def close_executor(model: Any):
+    """Stop the executor of a model that is being unloaded."""
+    with _lock:
+        executor = _executors.pop(id(model), None)
+    if executor is not None:
+        executor.close()
@@ -1,6 +1,10 @@
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import numpy as np
 from src.agents.base import BaseAgent
+from src.agents.cross_encoder import CrossEncoderExecutor, close_executor, get_executor
+from src.agents.models import model_registry
+from src.config import settings
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -8,10 +12,17 @@ logger = logging.getLogger(__name__)
 class VerifierAgent(BaseAgent):
     """
     Agent responsible for verifying generated claims against evidence.
+    ``inference_backend``: 'torch', 'onnx' or 'onnx-int8' (default: settings.INFERENCE_BACKEND).
+    Predictions are batched across concurrent requests by the model's shared
+    ``CrossEncoderExecutor`` (``max_wait_ms``, ``max_batch``).
     """
-    def __init__(self, name: str, model_name: str = "cross-encoder/nli-deberta-v3-base"):
+    def __init__(self, name: str, model_name: str = "cross-encoder/nli-deberta-v3-base",
+                 inference_backend: Optional[str] = None, max_wait_ms: float = 2.0, max_batch: int = 128):
         super().__init__(name=name)
         self.model_name = model_name
+        self.inference_backend = inference_backend or settings.INFERENCE_BACKEND
+        self.max_wait_ms = max_wait_ms
+        self.max_batch = max_batch
         self.model = None
         self._load_model()
 
@@ -19,13 +30,17 @@ class VerifierAgent(BaseAgent):
         """Load NLI model."""
         try:
             from sentence_transformers import CrossEncoder
-            self.model = CrossEncoder(self.model_name)
+            self.model = model_registry.acquire(CrossEncoder, self.model_name, backend=self.inference_backend)
             logger.info(f"Loaded NLI model: {self.model_name}")
         except ImportError:
             logger.warning("sentence-transformers not installed. Verification will be skipped.")
         except Exception as e:
             logger.error(f"Failed to load NLI model: {e}")
 
+    @property
+    def executor(self) -> CrossEncoderExecutor:
+        return get_executor(self.model, max_wait_ms=self.max_wait_ms, max_batch=self.max_batch)
+
     async def execute(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """
         Verify response.
@@ -41,15 +56,15 @@ class VerifierAgent(BaseAgent):
             return {"status": "skipped", "reason": "Model not loaded"}
 
         # Split response into sentences/claims (simplified)
-        claims = response.split(". ")
+        claims = [claim for claim in response.split(". ") if len(claim) >= 10]
+        
+        # Check every claim against each evidence chunk in one batched prediction
+        pairs = [(claim, ev) for claim in claims for ev in evidence]
+        all_scores = await self.executor.predict(pairs) if pairs else []
         
         verification_results = []
-        for claim in claims:
-            if len(claim) < 10: continue
-            
-            # Check against each evidence chunk
-            pairs = [[claim, ev] for ev in evidence]
-            scores = self.model.predict(pairs)
+        for n, claim in enumerate(claims):
+            scores = all_scores[n * len(evidence):(n + 1) * len(evidence)]
             
             # Scores are usually [Contradiction, Entailment, Neutral] or similar depending on model
             # Deberta NLI: label_mapping=['contradiction', 'entailment', 'neutral'] usually
@@ -57,7 +72,7 @@ class VerifierAgent(BaseAgent):
             # Let's assume binary or use argmax.
             
             # For simplicity, we just return the max entailment score found
-            max_score = max([s[1] if len(s) > 1 else s for s in scores]) # Assuming index 1 is entailment if multi-class
+            max_score = max([s[1] if np.ndim(s) and len(s) > 1 else s for s in scores]) # Assuming index 1 is entailment if multi-class
             
             verification_results.append({
                 "claim": claim,
@@ -70,5 +85,12 @@ class VerifierAgent(BaseAgent):
             "results": verification_results
         }
 
+    def close(self):
+        """Release the shared model."""
+        if self.model is not None:
+            if model_registry.release(self.model):
+                close_executor(self.model)
+            self.model = None
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,38 @@
+import logging
+import os
+import re
+from typing import Any, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# 'torch': PyTorch weights as published; 'onnx': exported to ONNX Runtime;
+# 'onnx-int8': ONNX with dynamically quantized int8 weights (CPU)
+INFERENCE_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+def onnx_export_dir(model_name: str, cache_dir: str) -> str:
+    """Where the ONNX export of ``model_name`` is cached."""
+    return os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "--", model_name))
+
+def onnx_file_name(quantize: bool, quantization_config: str) -> str:
+    # The names sentence-transformers gives its exports
+    return f"onnx/model_qint8_{quantization_config}.onnx" if quantize else "onnx/model.onnx"
+
+def load_onnx_model(model_class: type, model_name: str, cache_dir: str, quantize: bool = True,
+                    quantization_config: str = "avx512_vnni", device: Optional[str] = None) -> Any:
+    """
+    ``model_class`` (SentenceTransformer or CrossEncoder) on ONNX Runtime.
+    The first call exports the model (and its int8 quantization) under
+    ``cache_dir``; later calls, in any process, load the cached export.
+    """
+    export_dir = onnx_export_dir(model_name, cache_dir)
+    file_name = onnx_file_name(quantize, quantization_config)
+    kwargs = {} if device is None else {"device": device}
+    if not os.path.exists(os.path.join(export_dir, file_name)):
+        logger.info(f"Exporting {model_name} to ONNX in {export_dir}")
+        model = model_class(model_name, backend="onnx", **kwargs)
+        model.save_pretrained(export_dir)
+        if quantize:
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            export_dynamic_quantized_onnx_model(model, quantization_config, export_dir)
+    return model_class(export_dir, backend="onnx", model_kwargs={"file_name": file_name}, **kwargs)
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from src.agents.inference import INFERENCE_BACKENDS, load_onnx_model, onnx_export_dir, onnx_file_name
+from src.config import settings
+from src.monitoring.metrics import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+ModelKey = Tuple[type, str, Optional[str], Optional[str], str]
+
+def model_memory_bytes(model: Any) -> int:
+    """Bytes held by a torch model's parameters and buffers (0 if unknown)."""
+    # SentenceTransformer is an nn.Module; CrossEncoder wraps one as ``.model``
+    for module in (model, getattr(model, "model", None)):
+        if module is not None and hasattr(module, "parameters") and hasattr(module, "buffers"):
+            try:
+                tensors = list(module.parameters()) + list(module.buffers())
+                return sum(t.numel() * t.element_size() for t in tensors)
+            except Exception as e:
+                logger.debug(f"Could not measure model memory: {e}")
+    return 0
+
+class ModelRegistry:
+    """
+    Process-wide pool of loaded models, keyed by (class, name, device, dtype,
+    inference backend).
+    ``acquire`` loads a model on first use and hands the same instance to
+    every later caller; ``release`` drops a reference and unloads the model
+    once no agent holds it.
+    """
+    def __init__(self):
+        self._models: Dict[ModelKey, Any] = {}
+        self._refs: Dict[ModelKey, int] = {}
+        self._bytes: Dict[ModelKey, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _label(key: ModelKey) -> str:
+        model_class, model_name, device, dtype, backend = key
+        label = f"{model_class.__name__}:{model_name}:{device or 'default'}:{dtype or 'default'}"
+        return label if backend == "torch" else f"{label}:{backend}"
+
+    @staticmethod
+    def _load(model_class: type, model_name: str, device: Optional[str], dtype: Optional[str], backend: str) -> Any:
+        if backend != "torch":
+            return load_onnx_model(model_class, model_name, settings.ONNX_CACHE_DIR, quantize=backend == "onnx-int8",
+                                   quantization_config=settings.ONNX_QUANTIZATION, device=device)
+        model = model_class(model_name) if device is None else model_class(model_name, device=device)
+        if dtype is not None:
+            import torch
+            target = model if hasattr(model, "parameters") else model.model
+            target.to(getattr(torch, dtype))
+        return model
+
+    @staticmethod
+    def _memory_bytes(model: Any, key: ModelKey) -> int:
+        model_class, model_name, _, _, backend = key
+        if backend == "torch":
+            return model_memory_bytes(model)
+        # ONNX Runtime holds the weights of the exported file
+        path = os.path.join(onnx_export_dir(model_name, settings.ONNX_CACHE_DIR),
+                            onnx_file_name(backend == "onnx-int8", settings.ONNX_QUANTIZATION))
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def acquire(self, model_class: type, model_name: str, device: Optional[str] = None,
+                dtype: Optional[str] = None, backend: str = "torch") -> Any:
+        """
+        Shared instance of ``model_class(model_name)``, loading it if needed.
+        ``backend`` is one of ``INFERENCE_BACKENDS``; ONNX backends ignore ``dtype``.
+        """
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend: {backend}")
+        key = (model_class, model_name, device, dtype, backend)
+        # Loading under the lock keeps two agents from loading the same weights twice
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._load(model_class, model_name, device, dtype, backend)
+                self._models[key] = model
+                self._refs[key] = 0
+                self._bytes[key] = self._memory_bytes(model, key)
+                metrics.log_model_memory(self._label(key), self._bytes[key])
+                logger.info(f"Loaded {self._label(key)} ({self._bytes[key] / 2**20:.1f} MB)")
+            self._refs[key] += 1
+            return model
+
+    def release(self, model: Any) -> bool:
+        """Drop one reference to ``model``; returns True if it was unloaded."""
+        with self._lock:
+            key = next((k for k, m in self._models.items() if m is model), None)
+            if key is None:
+                return False
+            self._refs[key] -= 1
+            if self._refs[key] > 0:
+                return False
+            del self._models[key], self._refs[key], self._bytes[key]
+            metrics.log_model_memory(self._label(key), None)
+            logger.info(f"Unloaded {self._label(key)}")
+            return True
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Loaded models with their reference counts and memory usage."""
+        with self._lock:
+            return [
+                {
+                    "class": key[0].__name__,
+                    "model": key[1],
+                    "device": key[2],
+                    "dtype": key[3],
+                    "backend": key[4],
+                    "refs": self._refs[key],
+                    "memory_bytes": self._bytes[key],
+                }
+                for key in self._models
+            ]
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return sum(self._bytes.values())
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+model_registry = ModelRegistry()
@@ -0,0 +1,91 @@
+import logging
+from typing import Any, List, Optional, Sequence, Tuple
+import numpy as np
+from src.agents.retrieval.analysis import Analyzer
+from src.agents.retrieval.cache import TTLCache
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+Pair = Sequence[str]
+
+# [CLS] query [SEP] passage [SEP]
+SPECIAL_TOKENS = 3
+
+class PassageWindower:
+    """
+    Cuts the passage of each (query, passage) pair to the tokens a
+    cross-encoder will actually read.
+
+    Finding the window needs the passage's token offsets, so the windower
+    runs its own offset pass; those offsets are cached by text, so a
+    passage that comes back is not run through it again. The model still
+    tokenizes the windowed pair it scores. Pairs too short (in UTF-8 bytes,
+    an upper bound on tokens) to ever need a cut skip the offset pass.
+
+    A passage that does not fit in ``max_length`` next to its query is cut
+    to the window of that many tokens holding the most query terms, or to
+    its start when no query term occurs. Cuts fall on token boundaries, so
+    the model sees the same tokens as in the full text.
+    """
+    def __init__(self, tokenizer: Any, max_length: int = 512, analyzer: Optional[Analyzer] = None,
+                 cache_size: int = 10000):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.analyzer = analyzer or Analyzer.preset("english")
+        self.cache = TTLCache("passage_tokens", max_size=cache_size, ttl=None)
+
+    def _offsets(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """(start, end) character offsets of each text's tokens."""
+        offsets = {text: self.cache.get(text) for text in dict.fromkeys(texts)}
+        missing = [text for text, value in offsets.items() if value is None]
+        if missing:
+            encoded = self.tokenizer(missing, add_special_tokens=False, return_offsets_mapping=True)
+            for text, mapping in zip(missing, encoded["offset_mapping"]):
+                offsets[text] = np.asarray(mapping, dtype=np.int32).reshape(-1, 2)
+                self.cache.put(text, offsets[text])
+        return [offsets[text] for text in texts]
+
+    def _best_start(self, query: str, text: str, offsets: np.ndarray, budget: int) -> int:
+        terms = set(self.analyzer.analyze_query(query))
+        starts = [start for term, start, _ in self.analyzer.analyze_with_offsets(text) if term in terms]
+        if not starts:
+            return 0
+        relevant = np.zeros(len(offsets))
+        tokens = np.searchsorted(offsets[:, 0], starts, side="right") - 1
+        np.add.at(relevant, np.clip(tokens, 0, len(offsets) - 1), 1)
+        counts = np.concatenate([[0], np.cumsum(relevant)])
+        # Query terms in each window of `budget` tokens; the first best one wins
+        return int(np.argmax(counts[budget:] - counts[:-budget]))
+
+    def window(self, query: str, text: str, offsets: np.ndarray, query_tokens: int) -> Tuple[str, int]:
+        """The part of ``text`` to score against ``query``, and its token count."""
+        budget = max(self.max_length - query_tokens - SPECIAL_TOKENS, self.max_length // 4)
+        if len(offsets) <= budget:
+            return text, len(offsets)
+        start = self._best_start(query, text, offsets, budget)
+        end = start + budget - 1
+        return text[offsets[start, 0]:offsets[end, 1]], budget
+
+    def _fits(self, query: str, text: str) -> bool:
+        # A token covers at least one byte
+        return len(query.encode()) + len(text.encode()) + SPECIAL_TOKENS <= self.max_length
+
+    def __call__(self, pairs: Sequence[Pair]) -> Tuple[List[Tuple[str, str]], List[int]]:
+        """
+        Windowed pairs and their total token lengths (special tokens
+        included; estimated from characters for pairs that skip the offset pass).
+        """
+        windowed = [(query, text) for query, text in pairs]
+        lengths = [min((len(query) + len(text)) // 4 + SPECIAL_TOKENS, self.max_length) for query, text in pairs]
+        long = [i for i, (query, text) in enumerate(windowed) if not self._fits(query, text)]
+        if not long:
+            return windowed, lengths
+        offsets = self._offsets([windowed[i][0] for i in long] + [windowed[i][1] for i in long])
+        for i, query_offsets, text_offsets in zip(long, offsets, offsets[len(long):]):
+            query, text = windowed[i]
+            query_tokens = min(len(query_offsets), self.max_length)
+            passage, passage_tokens = self.window(query, text, text_offsets, query_tokens)
+            windowed[i] = (query, passage)
+            lengths[i] = min(query_tokens + passage_tokens + SPECIAL_TOKENS, self.max_length)
+        return windowed, lengths
@@ -0,0 +1,148 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+# Lucene's default English stopword set
+ENGLISH_STOPWORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+    "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+    "they", "this", "to", "was", "will", "with",
+])
+
+PRESETS: Dict[str, Dict[str, Any]] = {
+    # Same tokens as the original text.lower().split()
+    "whitespace": {"pattern": r"\S+", "lowercase": True, "stopwords": None, "stemmer": None, "max_token_length": None},
+    "standard": {"pattern": r"\w+", "lowercase": True, "stopwords": None, "stemmer": None, "max_token_length": 255},
+    "english": {"pattern": r"\w+", "lowercase": True, "stopwords": "english", "stemmer": "s", "max_token_length": 255},
+}
+
+def s_stem(token: str) -> str:
+    """
+    Harman's S-stemmer: conservative plural stripping.
+    ies -> y, es -> e, s -> '' (with the usual exceptions).
+    """
+    if len(token) > 3 and token.endswith("ies") and not token.endswith(("eies", "aies")):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("es") and not token.endswith(("aes", "ees", "oes")):
+        return token[:-1]
+    if len(token) > 2 and token.endswith("s") and not token.endswith(("us", "ss")):
+        return token[:-1]
+    return token
+
+STEMMERS = {"s": s_stem}
+
+# "exact phrase" or "terms near each other"~N
+PHRASE_PATTERN = re.compile(r'"([^"]+)"(?:~(\d+))?')
+
+# Phrase constraint: (term, relative position) pairs and the allowed slop
+Phrase = Tuple[Tuple[Tuple[str, int], ...], int]
+
+class Analyzer:
+    """
+    Text analysis pipeline used at both index and query time:
+    precompiled regex tokenization, lowercasing, stopword removal and
+    stemming. Query analysis is memoised in an LRU cache.
+
+    Token positions count removed stopwords and overlong tokens, as Lucene's
+    position increments do, so a phrase matches the text it was typed from.
+
+    The configuration is serialisable (``config``/``from_config``) and is
+    stored with the index, so every process analyses queries exactly as the
+    documents were analysed.
+    """
+    def __init__(self, pattern: str = r"\w+", lowercase: bool = True,
+                 stopwords: Optional[Union[str, Iterable[str]]] = None, stemmer: Optional[str] = None,
+                 max_token_length: Optional[int] = 255, cache_size: int = 10000):
+        if stemmer is not None and stemmer not in STEMMERS:
+            raise ValueError(f"Unknown stemmer: {stemmer}")
+        if isinstance(stopwords, str) and stopwords != "english":
+            raise ValueError(f"Unknown stopword list: {stopwords}")
+        self.pattern = pattern
+        self.lowercase = lowercase
+        self.stopwords = stopwords if isinstance(stopwords, str) or stopwords is None else sorted(set(stopwords))
+        self.stemmer = stemmer
+        self.max_token_length = max_token_length
+        self._regex = re.compile(pattern)
+        self._stopwords = ENGLISH_STOPWORDS if stopwords == "english" else frozenset(self.stopwords or ())
+        self._stem = STEMMERS.get(stemmer)
+        self.analyze_query = lru_cache(maxsize=cache_size)(self._analyze_query)
+        self.parse_query = lru_cache(maxsize=cache_size)(self._parse_query)
+
+    @classmethod
+    def preset(cls, name: str, **kwargs) -> "Analyzer":
+        if name not in PRESETS:
+            raise ValueError(f"Unknown analyzer preset: {name}")
+        return cls(**{**PRESETS[name], **kwargs})
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "Analyzer":
+        return cls(**config)
+
+    def config(self) -> Dict[str, Any]:
+        return {
+            "pattern": self.pattern,
+            "lowercase": self.lowercase,
+            "stopwords": self.stopwords,
+            "stemmer": self.stemmer,
+            "max_token_length": self.max_token_length,
+        }
+
+    def analyze(self, text: str) -> List[str]:
+        """Analyse a document into index terms."""
+        if self.lowercase:
+            text = text.lower()
+        tokens = self._regex.findall(text)
+        if self.max_token_length:
+            tokens = [t for t in tokens if len(t) <= self.max_token_length]
+        if self._stopwords:
+            tokens = [t for t in tokens if t not in self._stopwords]
+        if self._stem:
+            tokens = [self._stem(t) for t in tokens]
+        return tokens
+
+    def analyze_with_positions(self, text: str) -> List[Tuple[str, int]]:
+        """Analyse a document into (term, position) pairs."""
+        if self.lowercase:
+            text = text.lower()
+        terms = []
+        for position, token in enumerate(self._regex.findall(text)):
+            if self.max_token_length and len(token) > self.max_token_length:
+                continue
+            if token in self._stopwords:
+                continue
+            terms.append((self._stem(token) if self._stem else token, position))
+        return terms
+
+    def analyze_with_offsets(self, text: str) -> List[Tuple[str, int, int]]:
+        """Analyse a document into (term, start, end) character spans."""
+        terms = []
+        for match in self._regex.finditer(text):
+            token = match.group(0).lower() if self.lowercase else match.group(0)
+            if self.max_token_length and len(token) > self.max_token_length:
+                continue
+            if token in self._stopwords:
+                continue
+            terms.append((self._stem(token) if self._stem else token, match.start(), match.end()))
+        return terms
+
+    def _analyze_query(self, query: str) -> Tuple[str, ...]:
+        return tuple(self.analyze(query))
+
+    def _parse_query(self, query: str) -> Tuple[Tuple[str, ...], Tuple[Phrase, ...]]:
+        """
+        Split a query into its bag of terms and its phrase constraints.
+        ``"a b c"`` requires the terms in sequence, ``"a b c"~N`` within a
+        window N positions wider than the phrase, in any order. Phrase terms
+        are also part of the bag, so they still contribute to the score.
+        """
+        phrases = []
+        for match in PHRASE_PATTERN.finditer(query):
+            terms = self.analyze_with_positions(match.group(1))
+            if terms:
+                first = terms[0][1]
+                phrases.append((tuple((term, position - first) for term, position in terms), int(match.group(2) or 0)))
+        bag = PHRASE_PATTERN.sub(lambda match: f" {match.group(1)} ", query)
+        return tuple(self.analyze(bag)), tuple(phrases)
+
+    def __call__(self, text: str) -> List[str]:
+        return self.analyze(text)
@@ -0,0 +1,724 @@
+import bisect
+import json
+import logging
+import os
+import shutil
+from functools import lru_cache
+from typing import Callable, List, Dict, Optional, Sequence, Tuple
+import numpy as np
+from src.agents.retrieval.postings import POSTINGS_FORMATS, CompressedPostings, PlainPostings, expand_ranges
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SEGMENT_FORMAT = "shapeshifter-bm25"
+SEGMENT_VERSION = 4
+SEGMENT_ARRAYS = (
+    "indptr", "doc_lens",
+    "vocab_offsets", "vocab_blob", "id_offsets", "id_blob", "text_offsets", "text_blob",
+)
+# Score upper bounds used by dynamic pruning (added in segment version 2)
+BOUND_ARRAYS = (
+    "term_max_tf", "term_min_dl", "block_indptr", "block_last_doc", "block_max_tf", "block_min_dl",
+)
+BLOCK_SIZE = 128
+# Postings arrays are written by the postings format named in meta.json
+# (added in segment version 3; older segments are plain)
+# Optional token positions of every posting (added in segment version 4)
+POSITION_ARRAYS = ("pos_indptr", "positions")
+
+def bm25_idf(num_docs: int, doc_freqs: np.ndarray) -> np.ndarray:
+    """Okapi IDF as computed by rank_bm25 (before the epsilon floor)."""
+    return np.log(num_docs - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+
+class BM25Stats:
+    """
+    Collection statistics a segment is scored against.
+    Segments of a larger collection score with the collection-wide values so
+    scores do not depend on how documents are split across segments.
+    """
+    def __init__(self, num_docs: int, avgdl: float, idf: Callable[[str], float]):
+        self.num_docs = num_docs
+        self.avgdl = avgdl
+        self.idf = idf
+
+class StringTable:
+    """
+    Read-only sequence of strings stored as one UTF-8 blob plus offsets.
+    Backed either by in-memory arrays or by memory-mapped segment files.
+    """
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def from_strings(cls, strings: Sequence[str]) -> "StringTable":
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(offsets, blob)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string table index out of range")
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def as_fixed_width(self, width: int, chunk: int = 65536) -> np.ndarray:
+        """
+        Strings cut or null-padded to ``width`` bytes as a NumPy ``S`` array.
+        Truncation preserves the (non-strict) sort order of the table.
+        """
+        out = np.zeros((len(self), width), dtype=np.uint8)
+        cols = np.arange(width)
+        blob = np.asarray(self.blob)
+        for start in range(0, len(self), chunk):
+            stop = min(start + chunk, len(self))
+            lengths = np.minimum(self.offsets[start + 1:stop + 1] - self.offsets[start:stop], width)
+            mask = cols[None, :] < lengths[:, None]
+            positions = self.offsets[start:stop, None] + cols[None, :]
+            out[start:stop][mask] = blob[positions[mask]]
+        return out.view(f"S{width}").ravel()
+
+class SortedVocabulary:
+    """
+    Term -> term id lookup by binary search over a sorted string table.
+    Recent lookups are kept in an LRU cache so hot query terms skip the search.
+    """
+    def __init__(self, terms: StringTable, cache_size: int = 65536):
+        self.terms = terms
+        self.get = lru_cache(maxsize=cache_size)(self._find)
+
+    def _find(self, term: str) -> Optional[int]:
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return None
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+def map_vocabulary(source: SortedVocabulary, target: SortedVocabulary, width: int = 64) -> np.ndarray:
+    """
+    Term id in ``target`` for every term of ``source`` (-1 when absent).
+    Terms are matched with a vectorised binary search over fixed-width keys;
+    the rare terms longer than ``width`` bytes are looked up one by one.
+    """
+    src, dst = source.terms, target.terms
+    mapping = np.full(len(src), -1, dtype=np.int64)
+    if not len(src) or not len(dst):
+        return mapping
+    src_keys = src.as_fixed_width(width)
+    dst_keys = dst.as_fixed_width(width)
+    src_lens, dst_lens = src.lengths(), dst.lengths()
+    pos = np.minimum(np.searchsorted(dst_keys, src_keys), len(dst) - 1)
+    found = (dst_keys[pos] == src_keys) & (dst_lens[pos] == src_lens) & (src_lens <= width)
+    mapping[found] = pos[found]
+    for i in np.flatnonzero(src_lens > width):
+        term_id = target.get(src[int(i)])
+        if term_id is not None:
+            mapping[i] = term_id
+    return mapping
+
+class BM25Index:
+    """
+    Inverted-index BM25 (Okapi) engine.
+
+    Postings are stored in CSR layout: the documents containing term id ``t``
+    are entries ``indptr[t]:indptr[t + 1]`` of ``postings``, either plain
+    int32 arrays or block-compressed (``compress``, see ``postings.py``).
+    Only documents sharing at least one term with the query are scored.
+    Scoring follows ``rank_bm25.BM25Okapi`` (same IDF and epsilon floor).
+
+    An index can be written as a versioned segment directory (``save``) and
+    reopened memory-mapped (``open``), so worker processes share its pages
+    through the OS page cache instead of unpickling a private copy.
+
+    For top-k queries every term and every block of ``BLOCK_SIZE`` postings
+    keeps its largest tf and smallest document length. These give score
+    upper bounds whatever the average document length, which
+    ``score_pruned`` uses to skip documents that cannot reach the top k.
+
+    Built with token positions, the index also keeps the positions of every
+    posting (``positions[pos_indptr[p]:pos_indptr[p + 1]]`` for posting
+    ``p``) and evaluates phrase and proximity constraints (``match_phrase``).
+    """
+    block_size = BLOCK_SIZE
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocab = SortedVocabulary(StringTable.from_strings([]))
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.postings = PlainPostings(self.indptr, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
+        self.doc_lens = np.zeros(0, dtype=np.int32)
+        self.idf = np.zeros(0, dtype=np.float64)
+        self.avgdl = 0.0
+        self.chunk_ids = StringTable.from_strings([])
+        self.texts = StringTable.from_strings([])
+        self.term_max_tf = np.zeros(0, dtype=np.int32)
+        self.term_min_dl = np.zeros(0, dtype=np.int32)
+        self.block_indptr = np.zeros(1, dtype=np.int64)
+        self.block_last_doc = np.zeros(0, dtype=np.int32)
+        self.block_max_tf = np.zeros(0, dtype=np.int32)
+        self.block_min_dl = np.zeros(0, dtype=np.int32)
+        self.pos_indptr: Optional[np.ndarray] = None
+        self.positions: Optional[np.ndarray] = None
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lens)
+
+    @property
+    def has_positions(self) -> bool:
+        return self.positions is not None
+
+    def build(self, tokenized_corpus: List[List[str]], chunk_ids: Optional[List[str]] = None,
+              texts: Optional[List[str]] = None, positions: Optional[List[List[int]]] = None):
+        """
+        Build postings from a tokenized corpus.
+        chunk_ids/texts are stored alongside the postings so results can be
+        materialised straight from the index.
+        positions: the position of every token (see ``Analyzer.analyze_with_positions``);
+        when given, positional postings are stored too.
+        """
+        if positions is not None:
+            self._build_positional(tokenized_corpus, positions, chunk_ids, texts)
+            return
+        vocab: Dict[str, int] = {}
+        term_col: List[int] = []
+        doc_col: List[int] = []
+        tf_col: List[int] = []
+        doc_lens = np.zeros(len(tokenized_corpus), dtype=np.int32)
+
+        for doc_id, tokens in enumerate(tokenized_corpus):
+            doc_lens[doc_id] = len(tokens)
+            counts: Dict[int, int] = {}
+            for token in tokens:
+                term_id = vocab.setdefault(token, len(vocab))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            term_col.extend(counts.keys())
+            doc_col.extend([doc_id] * len(counts))
+            tf_col.extend(counts.values())
+
+        # Renumber terms in sorted order so the vocabulary can be binary searched
+        sorted_terms = sorted(vocab)
+        remap = np.zeros(len(vocab), dtype=np.int64)
+        remap[[vocab[t] for t in sorted_terms]] = np.arange(len(vocab))
+        num_docs = len(tokenized_corpus)
+        self.set_postings(
+            sorted_terms,
+            remap[np.asarray(term_col, dtype=np.int64)],
+            np.asarray(doc_col, dtype=np.int32),
+            np.asarray(tf_col, dtype=np.int32),
+            doc_lens,
+            chunk_ids if chunk_ids is not None else [str(i) for i in range(num_docs)],
+            texts if texts is not None else [""] * num_docs,
+        )
+
+    def _build_positional(self, tokenized_corpus: List[List[str]], positions: List[List[int]],
+                          chunk_ids: Optional[List[str]], texts: Optional[List[str]]):
+        vocab: Dict[str, int] = {}
+        occ_terms = np.fromiter((vocab.setdefault(token, len(vocab)) for tokens in tokenized_corpus for token in tokens),
+                                dtype=np.int64)
+        doc_lens = np.array([len(tokens) for tokens in tokenized_corpus], dtype=np.int32)
+        occ_docs = np.repeat(np.arange(len(tokenized_corpus)), doc_lens)
+        occ_pos = np.fromiter((p for doc_positions in positions for p in doc_positions), dtype=np.int64,
+                              count=len(occ_terms))
+        sorted_terms = sorted(vocab)
+        remap = np.zeros(len(vocab), dtype=np.int64)
+        remap[[vocab[t] for t in sorted_terms]] = np.arange(len(vocab))
+        occ_terms = remap[occ_terms]
+
+        # One posting per (term, doc) run of the occurrences sorted by term, doc, position
+        order = np.lexsort((occ_pos, occ_docs, occ_terms))
+        occ_terms, occ_docs, occ_pos = occ_terms[order], occ_docs[order], occ_pos[order]
+        starts = np.flatnonzero(np.diff(occ_terms, prepend=-1) | np.diff(occ_docs, prepend=-1))
+        tfs = np.diff(np.append(starts, len(occ_terms)))
+        num_docs = len(tokenized_corpus)
+        self.set_postings(
+            sorted_terms, occ_terms[starts], occ_docs[starts], tfs, doc_lens,
+            chunk_ids if chunk_ids is not None else [str(i) for i in range(num_docs)],
+            texts if texts is not None else [""] * num_docs,
+            positions=(tfs, occ_pos),
+        )
+
+    def set_postings(self, sorted_terms: Sequence[str], terms: np.ndarray, docs: np.ndarray, tfs: np.ndarray,
+                     doc_lens: np.ndarray, chunk_ids: Sequence[str], texts: Sequence[str],
+                     positions: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+        """
+        Install postings given as parallel (term id, doc id, tf) columns in any order.
+        Term ids index ``sorted_terms``, which must be sorted and duplicate free.
+        positions: optional (count per posting, concatenated positions) in the same order.
+        """
+        order = np.lexsort((docs, terms))
+        self.vocab = SortedVocabulary(StringTable.from_strings(sorted_terms))
+        self.indptr = np.zeros(len(sorted_terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(sorted_terms)), out=self.indptr[1:])
+        self.postings = PlainPostings(self.indptr, np.asarray(docs, dtype=np.int32)[order],
+                                      np.asarray(tfs, dtype=np.int32)[order])
+        self.doc_lens = np.asarray(doc_lens, dtype=np.int32)
+        self.chunk_ids = StringTable.from_strings(chunk_ids)
+        self.texts = StringTable.from_strings(texts)
+        self.pos_indptr = self.positions = None
+        if positions is not None:
+            counts, flat = positions
+            counts = np.asarray(counts, dtype=np.int64)
+            offsets = np.cumsum(counts) - counts
+            self.pos_indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts[order], out=self.pos_indptr[1:])
+            self.positions = np.asarray(flat, dtype=np.int32)[expand_ranges(offsets[order], offsets[order] + counts[order])]
+        self._compute_bounds()
+        self._compute_statistics()
+
+    def compress(self):
+        """Switch to block-compressed postings (delta/varint doc ids, one-byte tfs)."""
+        if isinstance(self.postings, PlainPostings):
+            doc_ids, term_freqs = self.postings.all()
+            self.postings = CompressedPostings.encode(self, doc_ids, term_freqs)
+
+    def _compute_bounds(self):
+        """Per-term and per-block maximum tf / minimum document length."""
+        num_terms = len(self.indptr) - 1
+        doc_ids, term_freqs = self.postings.all()
+        doc_freqs = self.doc_freqs()
+        blocks = (doc_freqs + self.block_size - 1) // self.block_size
+        self.block_indptr = np.zeros(num_terms + 1, dtype=np.int64)
+        np.cumsum(blocks, out=self.block_indptr[1:])
+        self.term_max_tf = np.zeros(num_terms, dtype=np.int32)
+        self.term_min_dl = np.zeros(num_terms, dtype=np.int32)
+        if not len(doc_ids):
+            self.block_last_doc = np.zeros(0, dtype=np.int32)
+            self.block_max_tf = np.zeros(0, dtype=np.int32)
+            self.block_min_dl = np.zeros(0, dtype=np.int32)
+            return
+
+        block_terms = np.repeat(np.arange(num_terms), blocks)
+        block_rank = np.arange(len(block_terms)) - self.block_indptr[block_terms]
+        starts = self.indptr[block_terms] + block_rank * self.block_size
+        ends = np.append(starts[1:], len(doc_ids))
+        self.block_last_doc = np.asarray(doc_ids)[ends - 1]
+        self.block_max_tf = np.maximum.reduceat(np.asarray(term_freqs), starts).astype(np.int32)
+        self.block_min_dl = np.minimum.reduceat(np.asarray(self.doc_lens)[doc_ids], starts).astype(np.int32)
+        has_blocks = blocks > 0
+        term_starts = self.block_indptr[:-1][has_blocks]
+        self.term_max_tf[has_blocks] = np.maximum.reduceat(self.block_max_tf, term_starts)
+        self.term_min_dl[has_blocks] = np.minimum.reduceat(self.block_min_dl, term_starts)
+
+    def save(self, path: str):
+        """
+        Write the index as a segment directory.
+        The segment is written next to ``path`` and swapped in atomically.
+        """
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        arrays = {
+            "indptr": self.indptr,
+            "doc_lens": self.doc_lens,
+            "vocab_offsets": self.vocab.terms.offsets,
+            "vocab_blob": self.vocab.terms.blob,
+            "id_offsets": self.chunk_ids.offsets,
+            "id_blob": self.chunk_ids.blob,
+            "text_offsets": self.texts.offsets,
+            "text_blob": self.texts.blob,
+        }
+        arrays.update({name: getattr(self, name) for name in BOUND_ARRAYS})
+        arrays.update(self.postings.to_arrays())
+        if self.has_positions:
+            arrays.update({"pos_indptr": self.pos_indptr, "positions": self.positions})
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(array))
+        meta = {
+            "format": SEGMENT_FORMAT,
+            "version": SEGMENT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "num_docs": self.num_docs,
+            "num_terms": len(self.vocab),
+            "postings": self.postings.format,
+            "positions": self.has_positions,
+        }
+        # meta.json is written last: a segment without it is incomplete
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        old_path = f"{path}.old"
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path, ignore_errors=True)
+        elif os.path.exists(old_path):
+            os.remove(old_path)
+
+    @classmethod
+    def open(cls, path: str) -> "BM25Index":
+        """Open a segment directory with every array memory-mapped read-only."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("format") != SEGMENT_FORMAT:
+            raise ValueError(f"{path} is not a BM25 segment")
+        if meta.get("version") not in (1, 2, 3, SEGMENT_VERSION):
+            raise ValueError(f"Unsupported BM25 segment version {meta.get('version')} (expected {SEGMENT_VERSION})")
+
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in SEGMENT_ARRAYS}
+        index = cls(k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"])
+        index.indptr = arrays["indptr"]
+        index.doc_lens = arrays["doc_lens"]
+        index.vocab = SortedVocabulary(StringTable(arrays["vocab_offsets"], arrays["vocab_blob"]))
+        index.chunk_ids = StringTable(arrays["id_offsets"], arrays["id_blob"])
+        index.texts = StringTable(arrays["text_offsets"], arrays["text_blob"])
+        if meta["version"] >= 2:
+            for name in BOUND_ARRAYS:
+                setattr(index, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        postings_format = POSTINGS_FORMATS.get(meta.get("postings", "plain"))
+        if postings_format is None:
+            raise ValueError(f"Unsupported postings format {meta.get('postings')}")
+        index.postings = postings_format.load(index, {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in postings_format.arrays})
+        if meta.get("positions"):
+            for name in POSITION_ARRAYS:
+                setattr(index, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        if meta["version"] < 2:
+            index._compute_bounds()
+        index._compute_statistics()
+        return index
+
+    def _compute_statistics(self):
+        """Precompute the segment-local IDF per term and average document length."""
+        num_docs = self.num_docs
+        self.avgdl = float(self.doc_lens.sum()) / num_docs if num_docs else 0.0
+        idf = bm25_idf(num_docs, self.doc_freqs().astype(np.float64))
+        if len(idf):
+            # Same floor as BM25Okapi for terms present in most documents
+            average_idf = float(idf.sum()) / len(idf)
+            idf[idf < 0] = self.epsilon * average_idf
+        self.idf = idf
+
+    def doc_freqs(self) -> np.ndarray:
+        """Document frequency of every term id."""
+        return np.diff(self.indptr)
+
+    def doc_freq(self, term: str) -> int:
+        term_id = self.vocab.get(term)
+        return 0 if term_id is None else int(self.indptr[term_id + 1] - self.indptr[term_id])
+
+    def docs_with_all(self, term_ids: Sequence[int]) -> np.ndarray:
+        """Documents containing every one of ``term_ids`` (ascending)."""
+        doc_freqs = self.doc_freqs()
+        term_ids = sorted(set(term_ids), key=lambda term_id: doc_freqs[term_id])
+        docs = np.asarray(self.postings.term(term_ids[0])[0])
+        for term_id in term_ids[1:]:
+            if not len(docs):
+                break
+            docs = docs[self.postings.locate(term_id, docs)[0]]
+        return docs
+
+    def term_positions(self, term_id: int, docs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(doc id, position) of every occurrence of a term in ``docs``, which must all contain it."""
+        _, postings = self.postings.locate(term_id, docs)
+        starts, ends = self.pos_indptr[postings], self.pos_indptr[postings + 1]
+        return np.repeat(docs, ends - starts), np.asarray(self.positions)[expand_ranges(starts, ends)]
+
+    def match_phrase(self, terms: Sequence[Tuple[str, int]], slop: int = 0) -> np.ndarray:
+        """
+        Documents matching a phrase given as (term, relative position) pairs
+        (see ``Analyzer.parse_query``). Requires positional postings.
+        """
+        if not self.has_positions:
+            raise ValueError("Phrase queries need an index built with positions")
+        term_ids = [self.vocab.get(term) for term, _ in terms]
+        if any(term_id is None for term_id in term_ids):
+            return np.zeros(0, dtype=np.int64)
+        docs = self.docs_with_all(term_ids)
+        if not len(docs):
+            return docs.astype(np.int64)
+        occurrences = {term_id: self.term_positions(term_id, docs) for term_id in set(term_ids)}
+        return match_positions([occurrences[term_id] for term_id in term_ids], [offset for _, offset in terms], slop)
+
+    def _query_terms(self, tokens: List[str], stats: Optional[BM25Stats]) -> List[Tuple[int, float]]:
+        """
+        Map query tokens to (term id, weight) for the terms known to this segment.
+        The weight is IDF times the query frequency, as BM25Okapi scores
+        repeated query tokens once per occurrence.
+        """
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        terms = []
+        for token, count in counts.items():
+            term_id = self.vocab.get(token)
+            if term_id is not None:
+                idf = self.idf[term_id] if stats is None else stats.idf(token)
+                terms.append((term_id, count * idf))
+        return terms
+
+    def score(self, tokens: List[str], stats: Optional[BM25Stats] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score the documents matching at least one query token.
+        Uses the segment's own statistics unless collection ``stats`` are given.
+        Returns (doc_ids, scores), doc ids ascending.
+        """
+        terms = self._query_terms(tokens, stats)
+        if not terms:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+
+        avgdl = (self.avgdl if stats is None else stats.avgdl) or 1.0
+        docs_parts, contrib_parts = [], []
+        for term_id, weight in terms:
+            docs, contrib = self._term_contributions(term_id, weight, avgdl)
+            docs_parts.append(docs)
+            contrib_parts.append(contrib)
+
+        docs = np.concatenate(docs_parts)
+        matched, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contrib_parts), minlength=len(matched))
+        return matched, scores
+
+    def _term_contributions(self, term_id: int, weight: float, avgdl: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Score contribution of one term to every document of its postings list."""
+        docs, tfs = self.postings.term(term_id)
+        return docs, weight * self._tf_component(tfs, self.doc_lens[docs], avgdl)
+
+    def _tf_component(self, tfs: np.ndarray, doc_lens: np.ndarray, avgdl: float) -> np.ndarray:
+        # Increasing in tf and decreasing in document length, so (max tf, min
+        # length) over a set of postings bounds the component for all of them
+        norm = self.k1 * (1 - self.b + self.b * doc_lens / avgdl)
+        return (tfs * (self.k1 + 1)) / (tfs + norm)
+
+    def score_pruned(self, tokens: List[str], k: int, stats: Optional[BM25Stats] = None,
+                     deleted: Optional[np.ndarray] = None, threshold: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k evaluation with MaxScore and block-max pruning.
+
+        Terms are visited by decreasing score upper bound. Their postings are
+        scored in full only while a document not seen yet could still reach
+        the current k-th best score (``threshold`` seeds it, e.g. from other
+        segments). After that only the surviving candidates are looked up in
+        the remaining postings lists, by binary search, and candidates whose
+        block-max bound falls below the threshold are dropped first.
+
+        Returns (doc_ids, scores) with exact scores for a superset of the
+        top ``k`` live documents scoring at least ``threshold``.
+
+        Not the default: the seed pass and the per-term unique/bincount merges
+        cost more than ``score``'s single vectorised pass on
+        benchmarks/bench_sparse_postings.py (200k documents: 1.22 vs 0.42 ms
+        plain, 2.27 vs 0.98 ms compressed).
+        """
+        terms = self._query_terms(tokens, stats)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        if not terms or k <= 0:
+            return empty
+        if any(weight <= 0 for _, weight in terms):
+            # Bounds only hold for non-negative contributions
+            docs, scores = self.score(tokens, stats)
+            if deleted is not None:
+                live = ~deleted[docs]
+                docs, scores = docs[live], scores[live]
+            return docs.astype(np.int64), scores
+
+        avgdl = (self.avgdl if stats is None else stats.avgdl) or 1.0
+        term_ids = np.array([term_id for term_id, _ in terms], dtype=np.int64)
+        weights = np.array([weight for _, weight in terms], dtype=np.float64)
+        bounds = weights * self._tf_component(self.term_max_tf[term_ids], self.term_min_dl[term_ids], avgdl)
+        remaining = float(bounds.sum())
+        if remaining < threshold:
+            return empty
+
+        theta = max(threshold, self._seed_threshold(term_ids, weights, k, avgdl, deleted))
+        cand_docs, cand_scores = empty
+        essential = True
+        for i in np.argsort(-bounds, kind="stable"):
+            term_id, weight = int(term_ids[i]), float(weights[i])
+            rest = remaining - bounds[i]
+            if essential:
+                docs, contrib = self._term_contributions(term_id, weight, avgdl)
+                if deleted is not None:
+                    live = ~deleted[docs]
+                    docs, contrib = docs[live], contrib[live]
+                merged, inverse = np.unique(np.concatenate([cand_docs, docs]), return_inverse=True)
+                cand_scores = np.bincount(inverse, weights=np.concatenate([cand_scores, contrib]),
+                                          minlength=len(merged))
+                cand_docs = merged
+            else:
+                # Cheap term-level bound first, the block-max bound for the survivors
+                keep = cand_scores + remaining >= theta * (1 - 1e-9)
+                cand_docs, cand_scores = self._score_candidates(
+                    term_id, weight, avgdl, cand_docs[keep], cand_scores[keep], rest, theta)
+            remaining = rest
+            if len(cand_scores) >= k:
+                theta = max(theta, float(np.partition(cand_scores, len(cand_scores) - k)[len(cand_scores) - k]))
+            # Documents not seen so far can score at most ``remaining``
+            essential = essential and remaining >= theta * (1 - 1e-9)
+        return cand_docs, cand_scores
+
+    def _seed_threshold(self, term_ids: np.ndarray, weights: np.ndarray, k: int, avgdl: float,
+                        deleted: Optional[np.ndarray], seeds: int = 256) -> float:
+        """
+        Lower bound on the k-th best score from a few fully scored documents:
+        the best postings of the rarest query term, looked up in every other list.
+        """
+        rarest = int(np.argmin(self.doc_freqs()[term_ids]))
+        docs, contrib = self._term_contributions(int(term_ids[rarest]), float(weights[rarest]), avgdl)
+        if deleted is not None:
+            live = ~deleted[docs]
+            docs, contrib = docs[live], contrib[live]
+        if len(docs) < k:
+            return 0.0
+        if len(docs) > max(seeds, k):
+            best = np.sort(np.argpartition(-contrib, max(seeds, k) - 1)[:max(seeds, k)])
+            docs, contrib = docs[best], contrib[best]
+        scores = contrib.copy()
+        for i, (term_id, weight) in enumerate(zip(term_ids, weights)):
+            if i == rarest:
+                continue
+            found, tfs = self.postings.lookup(term_id, docs)
+            scores[found] += weight * self._tf_component(tfs, self.doc_lens[docs[found]], avgdl)
+        return float(np.partition(scores, len(scores) - k)[len(scores) - k])
+
+    def _score_candidates(self, term_id: int, weight: float, avgdl: float, cand_docs: np.ndarray,
+                          cand_scores: np.ndarray, rest: float, theta: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Add one term's contribution to the candidates that can still reach ``theta``."""
+        b0, b1 = self.block_indptr[term_id], self.block_indptr[term_id + 1]
+        if b1 == b0:
+            return cand_docs, cand_scores
+        block = np.searchsorted(self.block_last_doc[b0:b1], cand_docs)
+        in_list = block < b1 - b0
+        block = np.minimum(block, b1 - b0 - 1) + b0
+        block_bound = np.where(
+            in_list, weight * self._tf_component(self.block_max_tf[block], self.block_min_dl[block], avgdl), 0.0)
+        keep = cand_scores + block_bound + rest >= theta * (1 - 1e-9)
+        cand_docs, cand_scores, in_list = cand_docs[keep], cand_scores[keep], in_list[keep]
+
+        found, tfs = self.postings.lookup(term_id, cand_docs[in_list])
+        hits = np.flatnonzero(in_list)[found]
+        if len(hits):
+            cand_scores = cand_scores.copy()
+            cand_scores[hits] += weight * self._tf_component(tfs, self.doc_lens[cand_docs[hits]], avgdl)
+        return cand_docs, cand_scores
+
+    def score_batch(self, queries: List[List[str]], stats: Optional[BM25Stats] = None,
+                    max_entries: int = 1 << 24) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Score several tokenized queries at once.
+
+        Each distinct term's postings are read and its tf component computed
+        once for the whole batch. Scores are then the sparse product of the
+        (query x term) weight matrix with the (term x document) tf-component
+        matrix, accumulated with a single unique/bincount per chunk of
+        queries holding at most ``max_entries`` postings.
+        Returns (doc_ids, scores) per query, as ``score`` does.
+        """
+        avgdl = (self.avgdl if stats is None else stats.avgdl) or 1.0
+        query_terms = [self._query_terms(tokens, stats) for tokens in queries]
+        postings: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for terms in query_terms:
+            for term_id, _ in terms:
+                if term_id not in postings:
+                    postings[term_id] = self._term_contributions(term_id, 1.0, avgdl)
+
+        results: List[Tuple[np.ndarray, np.ndarray]] = []
+        chunk: List[List[Tuple[int, float]]] = []
+        entries = 0
+        for terms in query_terms + [None]:
+            size = 0 if terms is None else sum(len(postings[term_id][0]) for term_id, _ in terms)
+            if chunk and (terms is None or entries + size > max_entries):
+                results.extend(self._score_chunk(chunk, postings))
+                chunk, entries = [], 0
+            if terms is not None:
+                chunk.append(terms)
+                entries += size
+        return results
+
+    def _score_chunk(self, chunk: List[List[Tuple[int, float]]],
+                     postings: Dict[int, Tuple[np.ndarray, np.ndarray]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        num_docs = max(self.num_docs, 1)
+        keys_parts, values_parts = [], []
+        for row, terms in enumerate(chunk):
+            for term_id, weight in terms:
+                docs, tf_component = postings[term_id]
+                # Row-major key: query position in the chunk, then doc id
+                keys_parts.append(docs.astype(np.int64) + row * num_docs)
+                values_parts.append(weight * tf_component)
+        if not keys_parts:
+            return [(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)) for _ in chunk]
+
+        keys, inverse = np.unique(np.concatenate(keys_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(values_parts), minlength=len(keys))
+        bounds = np.searchsorted(keys, np.arange(len(chunk) + 1, dtype=np.int64) * num_docs)
+        return [((keys[bounds[row]:bounds[row + 1]] - row * num_docs).astype(np.int32),
+                 scores[bounds[row]:bounds[row + 1]]) for row in range(len(chunk))]
+
+    def top_k(self, tokens: List[str], k: int, pruned: bool = False) -> List[Tuple[int, float]]:
+        """Return up to ``k`` (doc_id, score) pairs with a positive score, best first."""
+        docs, scores = self.score_pruned(tokens, k) if pruned else self.score(tokens)
+        return select_top_k(docs, scores, k)
+
+def match_positions(occurrences: List[Tuple[np.ndarray, np.ndarray]], offsets: Sequence[int],
+                    slop: int = 0) -> np.ndarray:
+    """
+    Documents where the phrase terms occur together.
+
+    ``occurrences`` gives (doc ids, positions) per phrase term, sorted by
+    doc then position (a repeated term passes the same arrays), and
+    ``offsets`` each term's position in the phrase.
+    With ``slop`` 0 the terms must appear at exactly those offsets. With a
+    positive slop every distinct term must occur within a window of the
+    phrase's span plus ``slop`` positions, in any order.
+    """
+    # Occurrences as sortable (doc, position) keys
+    keys = [(docs.astype(np.int64) << 32) + positions for docs, positions in occurrences]
+    if slop == 0:
+        matches = None
+        for term_keys, offset in zip(keys, offsets):
+            starts = term_keys - offset
+            starts = starts[(term_keys & 0xFFFFFFFF) >= offset]
+            matches = starts if matches is None else np.intersect1d(matches, starts)
+        return np.unique(matches >> 32)
+
+    window = max(offsets) - min(offsets) + slop
+    # A repeated term is passed as the same arrays and only needs to occur once
+    distinct = list({id(docs): term_keys for (docs, _), term_keys in zip(occurrences, keys)}.values())
+    # Every window containing all terms begins at one of their occurrences
+    starts = np.unique(np.concatenate(keys))
+    valid = np.ones(len(starts), dtype=bool)
+    last = starts.copy()
+    for term_keys in distinct:
+        pos = np.minimum(np.searchsorted(term_keys, starts), len(term_keys) - 1)
+        following = term_keys[pos]
+        valid &= (following >= starts) & ((following >> 32) == (starts >> 32))
+        last = np.maximum(last, following)
+    valid &= (last - starts) <= window
+    return np.unique(starts[valid] >> 32)
+
+def select_top_k(docs: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    """Pick the ``k`` best positive scores, ties broken by ascending doc id."""
+    positive = scores > 0
+    docs, scores = docs[positive], scores[positive]
+    if k <= 0 or not len(docs):
+        return []
+    if len(docs) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        # Keep every document tied with the k-th score so ties resolve by doc id
+        kth = scores[candidates].min()
+        candidates = np.flatnonzero(scores >= kth)
+        docs, scores = docs[candidates], scores[candidates]
+    order = np.lexsort((docs, -scores))[:k]
+    return [(int(docs[i]), float(scores[i])) for i in order]
+
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from src.agents.retrieval.analysis import Analyzer, Phrase
+from src.agents.retrieval.bm25 import BM25Stats
+from src.agents.retrieval.bm25_store import MANIFEST_FILE, Segment, SegmentedBM25Index
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SHARDS_FORMAT = "shapeshifter-bm25-shards"
+SHARDS_VERSION = 1
+SHARDS_FILE = "shards.json"
+
+# Shard served by the current worker process (set by the pool initializer)
+_worker_shard: Optional[SegmentedBM25Index] = None
+
+def _open_worker_shard(path: str):
+    global _worker_shard
+    _worker_shard = SegmentedBM25Index(path, background_merge=False)
+
+def _worker_stats(num_docs: int, avgdl: float, idfs: Dict[str, float]) -> BM25Stats:
+    return BM25Stats(num_docs, avgdl, lambda term: idfs.get(term, 0.0))
+
+def _search_worker_shard(queries: List[List[str]], phrases: List[Sequence[Phrase]], top_k: int, mode: str,
+                         num_docs: int, avgdl: float, idfs: Dict[str, float], batch: bool) -> List[List[Dict[str, Any]]]:
+    """Runs in a worker process: search its shard with the collection-wide statistics."""
+    _worker_shard.refresh()
+    stats = _worker_stats(num_docs, avgdl, idfs)
+    if batch:
+        return _worker_shard.search_batch(queries, top_k, stats, phrases)
+    return [_worker_shard.search(queries[0], top_k, mode, stats, phrases[0])]
+
+def shard_of(chunk_id: str, num_shards: int) -> int:
+    """Stable shard assignment of a document id (same in every process)."""
+    return zlib.crc32(chunk_id.encode("utf-8")) % num_shards
+
+class ShardedBM25Index:
+    """
+    BM25 index partitioned by document id into ``num_shards`` segmented
+    indexes, each searched by its own pool of worker processes.
+
+    Workers memory-map their shard's segments and pick up commits through
+    the shard manifest, so writes stay in the owning process. Every query is
+    scattered to all shards with collection-wide statistics (document count,
+    average length, IDF computed over every shard's live documents), so shard
+    scores are comparable and the gathered top k matches the single-index
+    engine. Documents carry their write sequence number, so equal scores
+    are ordered by write order across shards, as segments order them.
+    """
+    def __init__(self, path: str, num_shards: int = 4, workers_per_shard: int = 1,
+                 analyzer: Optional[Analyzer] = None, mp_context: str = "spawn", **kwargs):
+        self.path = path
+        self.num_shards = self._read_num_shards(num_shards)
+        self.workers_per_shard = workers_per_shard
+        self.mp_context = mp_context
+        self.shards = [
+            SegmentedBM25Index(self._shard_path(i), analyzer=analyzer, **kwargs) for i in range(self.num_shards)
+        ]
+        self._executors: Optional[List[ProcessPoolExecutor]] = None
+        self._stats: Optional[Tuple[List[List[Segment]], BM25Stats]] = None
+        self._next_seq: Optional[int] = None
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.path, f"shard-{shard:03d}")
+
+    def _read_num_shards(self, num_shards: int) -> int:
+        if os.path.exists(os.path.join(self.path, MANIFEST_FILE)):
+            raise ValueError(f"{self.path} holds an unsharded BM25 index")
+        shards_path = os.path.join(self.path, SHARDS_FILE)
+        if not os.path.exists(shards_path):
+            return num_shards
+        with open(shards_path) as f:
+            meta = json.load(f)
+        if meta.get("format") != SHARDS_FORMAT or meta.get("version") != SHARDS_VERSION:
+            raise ValueError(f"{self.path} is not a sharded BM25 index")
+        if meta["num_shards"] != num_shards:
+            logger.warning(f"Index at {self.path} has {meta['num_shards']} shards, ignoring num_shards={num_shards}")
+        return meta["num_shards"]
+
+    def _write_shards_file(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, SHARDS_FILE), "w") as f:
+            json.dump({"format": SHARDS_FORMAT, "version": SHARDS_VERSION, "num_shards": self.num_shards}, f)
+
+    @property
+    def analyzer(self) -> Analyzer:
+        return self.shards[0].analyzer
+
+    @property
+    def segments(self) -> List[Segment]:
+        return [seg for shard in self.shards for seg in shard.segments]
+
+    @property
+    def num_docs(self) -> int:
+        return sum(shard.num_docs for shard in self.shards)
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def refresh(self) -> bool:
+        return any([shard.refresh() for shard in self.shards])
+
+    # ---- Writes ----
+
+    def _partition(self, documents: List[Dict[str, str]],
+                   first_seq: int) -> List[Tuple[List[Dict[str, str]], List[int]]]:
+        """Documents of each shard with their write sequence numbers."""
+        parts: List[Tuple[List[Dict[str, str]], List[int]]] = [([], []) for _ in self.shards]
+        for seq, doc in enumerate(documents, first_seq):
+            part = parts[shard_of(doc['id'], self.num_shards)]
+            part[0].append(doc)
+            part[1].append(seq)
+        return parts
+
+    def _take_seqs(self, count: int) -> int:
+        if self._next_seq is None:
+            # Segments written before sequence numbers existed sort first
+            self._next_seq = max((int(np.max(seg.seqs)) + 1 for seg in self.segments
+                                  if seg.seqs is not None and len(seg.seqs)), default=0)
+        first = self._next_seq
+        self._next_seq += count
+        return first
+
+    def rebuild(self, documents: List[Dict[str, str]], analyzer: Optional[Analyzer] = None):
+        self._write_shards_file()
+        self._next_seq = 0
+        for shard, (part, seqs) in zip(self.shards, self._partition(documents, self._take_seqs(len(documents)))):
+            shard.rebuild(part, analyzer=analyzer, seqs=seqs)
+
+    def add_documents(self, documents: List[Dict[str, str]]):
+        self._write_shards_file()
+        # The last version of a document in a batch wins, at its first position (as in a single index)
+        documents = list({doc['id']: doc for doc in documents}.values())
+        for shard, (part, seqs) in zip(self.shards, self._partition(documents, self._take_seqs(len(documents)))):
+            if part:
+                shard.add_documents(part, seqs=seqs)
+
+    def update_documents(self, documents: List[Dict[str, str]]):
+        self.add_documents(documents)
+
+    def delete_documents(self, chunk_ids: List[str]) -> int:
+        parts: List[List[str]] = [[] for _ in self.shards]
+        for chunk_id in chunk_ids:
+            parts[shard_of(chunk_id, self.num_shards)].append(chunk_id)
+        return sum(shard.delete_documents(part) for shard, part in zip(self.shards, parts) if part)
+
+    def wait_for_merges(self, timeout: Optional[float] = None):
+        for shard in self.shards:
+            shard.wait_for_merges(timeout)
+
+    # ---- Queries ----
+
+    def stats(self) -> BM25Stats:
+        """Collection statistics over the live documents of every shard."""
+        snapshot = [shard.segments for shard in self.shards]
+        cached = self._stats
+        if cached is not None and all(a is b for a, b in zip(cached[0], snapshot)):
+            return cached[1]
+        segments = [seg for shard_segments in snapshot for seg in shard_segments]
+        base = self.shards[0]
+        stats = base._make_stats(segments, base._compute_average_idf(segments))
+        self._stats = (snapshot, stats)
+        return stats
+
+    def _pools(self) -> List[ProcessPoolExecutor]:
+        if self._executors is None:
+            context = multiprocessing.get_context(self.mp_context)
+            self._executors = [
+                ProcessPoolExecutor(max_workers=self.workers_per_shard, mp_context=context,
+                                    initializer=_open_worker_shard, initargs=(self._shard_path(i),))
+                for i in range(self.num_shards)
+            ]
+        return self._executors
+
+    def _scatter(self, queries: List[List[str]], phrases: Optional[List[Sequence[Phrase]]], top_k: int,
+                 mode: str, batch: bool) -> List[Future]:
+        stats = self.stats()
+        idfs = {term: stats.idf(term) for tokens in queries for term in tokens}
+        phrases = phrases or [()] * len(queries)
+        return [
+            pool.submit(_search_worker_shard, queries, phrases, top_k, mode, stats.num_docs, stats.avgdl, idfs, batch)
+            for pool in self._pools()
+        ]
+
+    @staticmethod
+    def _gather(shard_results: List[List[List[Dict[str, Any]]]], top_k: int) -> List[List[Dict[str, Any]]]:
+        """Global top k per query; ties in write order, as in a single index."""
+        merged = []
+        for per_shard in zip(*shard_results):
+            hits = [hit for results in per_shard for hit in results]
+            # Documents without a sequence number were written before any that have one
+            hits.sort(key=lambda hit: (-hit["score"], hit.get("seq", -1)))
+            for hit in hits:
+                hit.pop("seq", None)
+            merged.append(hits[:top_k])
+        return merged
+
+    def search(self, tokens: List[str], top_k: int, mode: str = "exact",
+               phrases: Optional[Sequence[Phrase]] = None) -> List[Dict[str, Any]]:
+        futures = self._scatter([tokens], [phrases or ()], top_k, mode, batch=False)
+        return self._gather([f.result() for f in futures], top_k)[0]
+
+    def search_batch(self, queries: List[List[str]], top_k: int,
+                     phrases: Optional[List[Sequence[Phrase]]] = None) -> List[List[Dict[str, Any]]]:
+        futures = self._scatter(queries, phrases, top_k, "exact", batch=True)
+        return self._gather([f.result() for f in futures], top_k)
+
+    async def search_async(self, tokens: List[str], top_k: int, mode: str = "exact",
+                           phrases: Optional[Sequence[Phrase]] = None) -> List[Dict[str, Any]]:
+        """``search`` without blocking the event loop while shards score."""
+        futures = self._scatter([tokens], [phrases or ()], top_k, mode, batch=False)
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        return self._gather(list(results), top_k)[0]
+
+    async def search_batch_async(self, queries: List[List[str]], top_k: int,
+                                 phrases: Optional[List[Sequence[Phrase]]] = None) -> List[List[Dict[str, Any]]]:
+        futures = self._scatter(queries, phrases, top_k, "exact", batch=True)
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        return self._gather(list(results), top_k)
+
+    def close(self):
+        """Stop the worker processes."""
+        if self._executors is not None:
+            for pool in self._executors:
+                pool.shutdown(wait=True)
+            self._executors = None
@@ -0,0 +1,702 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from src.agents.retrieval.analysis import Analyzer, Phrase
+from src.agents.retrieval.bm25 import BM25Index, BM25Stats, bm25_idf, map_vocabulary, match_positions, select_top_k
+from src.agents.retrieval.postings import expand_ranges
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT = "shapeshifter-bm25-index"
+MANIFEST_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+# Optional per-document write sequence numbers (written by ShardedBM25Index)
+SEQS_FILE = "seqs.npy"
+
+class Segment:
+    """
+    An immutable BM25 segment plus its tombstones.
+    Tombstones are persisted as ``deleted.<generation>.npz`` inside the
+    segment directory (deleted doc ids and the per-term document counts they
+    remove) and referenced from the manifest. ``seqs``, when present, gives
+    each document's position in the write order of a larger collection.
+    """
+    def __init__(self, name: str, index: BM25Index, deleted: Optional[np.ndarray] = None,
+                 deleted_df: Optional[np.ndarray] = None, deletes_file: Optional[str] = None,
+                 seqs: Optional[np.ndarray] = None):
+        self.name = name
+        self.index = index
+        self.seqs = seqs
+        self.deleted = deleted if deleted is not None else np.zeros(index.num_docs, dtype=bool)
+        self.deleted_df = deleted_df if deleted_df is not None else np.zeros(len(index.vocab), dtype=np.int64)
+        self.deletes_file = deletes_file
+        self._base_mapping: Optional[Tuple[str, np.ndarray]] = None
+
+    @classmethod
+    def open(cls, path: str, name: str, deletes_file: Optional[str] = None) -> "Segment":
+        seqs_path = os.path.join(path, name, SEQS_FILE)
+        seqs = np.load(seqs_path, mmap_mode="r") if os.path.exists(seqs_path) else None
+        return cls(name, BM25Index.open(os.path.join(path, name)), seqs=seqs).with_deletes(path, deletes_file)
+
+    def with_deletes(self, path: str, deletes_file: Optional[str]) -> "Segment":
+        """Copy of this segment carrying the tombstones stored in ``deletes_file``."""
+        seg = Segment(self.name, self.index, deletes_file=deletes_file, seqs=self.seqs)
+        if deletes_file:
+            with np.load(os.path.join(path, self.name, deletes_file)) as data:
+                seg.deleted[data["docs"]] = True
+                seg.deleted_df[data["term_ids"]] = data["counts"]
+        seg._base_mapping = self._base_mapping
+        return seg
+
+    def save_deletes(self, path: str, deletes_file: str):
+        term_ids = np.flatnonzero(self.deleted_df)
+        np.savez(os.path.join(path, self.name, deletes_file), docs=np.flatnonzero(self.deleted).astype(np.int32),
+                 term_ids=term_ids, counts=self.deleted_df[term_ids])
+        self.deletes_file = deletes_file
+
+    @property
+    def num_docs(self) -> int:
+        return self.index.num_docs
+
+    @property
+    def num_deleted(self) -> int:
+        return int(self.deleted.sum())
+
+    @property
+    def num_live(self) -> int:
+        return self.num_docs - self.num_deleted
+
+    def live_length(self) -> int:
+        return int(self.index.doc_lens.sum()) - int(self.index.doc_lens[self.deleted].sum())
+
+    def live_doc_freqs(self) -> np.ndarray:
+        return self.index.doc_freqs() - self.deleted_df
+
+    def delete(self, doc: int, analyzer: Analyzer):
+        if self.deleted[doc]:
+            return
+        self.deleted[doc] = True
+        # Re-analysing the stored text yields exactly the terms indexed for the document
+        for term in set(analyzer.analyze(self.index.texts[doc])):
+            term_id = self.index.vocab.get(term)
+            if term_id is not None:
+                self.deleted_df[term_id] += 1
+
+    def mapping_to(self, base: "Segment") -> np.ndarray:
+        """Term id in ``base`` for each term of this segment (-1 when absent)."""
+        if self._base_mapping is None or self._base_mapping[0] != base.name:
+            self._base_mapping = (base.name, map_vocabulary(self.index.vocab, base.index.vocab))
+        return self._base_mapping[1]
+
+class SegmentedBM25Index:
+    """
+    Log-structured BM25 index supporting incremental updates.
+
+    Every write is a small immutable segment; deletes and updates tombstone
+    the previous version of a document. Segments are merged in a background
+    thread, which drops tombstoned documents by rewriting postings directly
+    (no re-tokenization). Queries score every segment against collection-wide
+    statistics over the live documents, so results are identical to a full
+    rebuild of the same corpus.
+
+    The analyzer configuration is recorded in the manifest: an existing
+    index always uses the analyzer it was built with, and ``analyzer`` only
+    applies to new indexes (and to ``rebuild``).
+
+    ``postings_format`` ("plain" or "compressed") applies to segments
+    written from now on; existing segments convert as they are merged.
+    With ``positions`` new segments also store token positions for phrase
+    queries. Segments without them (older ones, or merges including one)
+    answer phrase queries by re-analysing the stored text of the documents
+    containing every phrase term. Past ``phrase_fallback_limit`` of them
+    re-analysing would stall the query, so it fails with a ValueError
+    instead: results always match every phrase.
+    """
+    def __init__(self, path: str, analyzer: Optional[Analyzer] = None, k1: float = 1.5, b: float = 0.75,
+                 epsilon: float = 0.25, max_segments: int = 8, merge_factor: int = 4,
+                 purge_ratio: float = 0.3, background_merge: bool = True, postings_format: str = "plain",
+                 positions: bool = False, phrase_fallback_limit: int = 256):
+        if postings_format not in ("plain", "compressed"):
+            raise ValueError(f"Unknown postings format: {postings_format}")
+        self.path = path
+        self.analyzer = analyzer or Analyzer.preset("english")
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.max_segments = max_segments
+        self.merge_factor = merge_factor
+        self.purge_ratio = purge_ratio
+        self.background_merge = background_merge
+        self.postings_format = postings_format
+        self.positions = positions
+        self.phrase_fallback_limit = phrase_fallback_limit
+
+        # Serialises writers, merge commits and manifest updates. Readers never
+        # take it: the segment list is replaced, never mutated in place.
+        self._lock = threading.RLock()
+        self._segments: List[Segment] = []
+        self._generation = 0
+        self._next_segment = 1
+        self._manifest_mtime = None
+        self._stats: Optional[BM25Stats] = None
+        self._average_idf = 0.0
+        self._locations: Optional[Dict[str, Tuple[Segment, int]]] = None
+        self._merge_thread: Optional[threading.Thread] = None
+        self._cleaned = False
+        # Segments being written by a merge, protected from cleanup
+        self._pending: set = set()
+        if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+            self._open()
+
+    @property
+    def segments(self) -> List[Segment]:
+        return self._segments
+
+    @property
+    def num_docs(self) -> int:
+        return sum(seg.num_live for seg in self._segments)
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    # ---- Persistence ----
+
+    def _open(self):
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != MANIFEST_FORMAT:
+            raise ValueError(f"{self.path} is not a BM25 index")
+        if manifest.get("version") not in (1, MANIFEST_VERSION):
+            raise ValueError(f"Unsupported BM25 index version {manifest.get('version')} (expected {MANIFEST_VERSION})")
+
+        current = {seg.name: seg for seg in self._segments}
+        segments = []
+        for entry in manifest["segments"]:
+            seg = current.get(entry["name"])
+            if seg is None:
+                seg = Segment.open(self.path, entry["name"], entry.get("deletes"))
+            elif entry.get("deletes") != seg.deletes_file:
+                seg = seg.with_deletes(self.path, entry.get("deletes"))
+            segments.append(seg)
+
+        self.k1, self.b, self.epsilon = manifest["k1"], manifest["b"], manifest["epsilon"]
+        self._generation = manifest["generation"]
+        self._next_segment = manifest["next_segment"]
+        self._average_idf = manifest["average_idf"]
+        # Version 1 indexes were built with whitespace tokenization
+        config = manifest.get("analyzer") or Analyzer.preset("whitespace").config()
+        if config != self.analyzer.config():
+            self.analyzer = Analyzer.from_config(config)
+        self._manifest_mtime = os.stat(manifest_path).st_mtime_ns
+        self._segments = segments
+        self._stats = None
+        self._locations = None
+
+    def refresh(self) -> bool:
+        """
+        Pick up changes committed by another process (e.g. an ingest worker).
+        Returns True if a newer manifest was loaded.
+        """
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+        with self._lock:
+            try:
+                self._open()
+                return True
+            except Exception as e:
+                logger.error(f"Failed to refresh BM25 index: {e}")
+                return False
+
+    def _commit(self, segments: List[Segment]):
+        """Atomically publish a new segment list."""
+        # The IDF floor needs the whole vocabulary: compute it once here so
+        # readers only ever do per-term lookups
+        self._average_idf = self._compute_average_idf(segments)
+        self._generation += 1
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "version": MANIFEST_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "generation": self._generation,
+            "next_segment": self._next_segment,
+            "average_idf": self._average_idf,
+            "analyzer": self.analyzer.config(),
+            "segments": [{"name": seg.name, "deletes": seg.deletes_file} for seg in segments],
+        }
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        with open(f"{manifest_path}.tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+        self._manifest_mtime = os.stat(manifest_path).st_mtime_ns
+        self._segments = segments
+        self._stats = None
+
+    def _write_deletes(self, seg: Segment):
+        """Persist a new tombstone generation for ``seg`` (published by the next commit)."""
+        seg.save_deletes(self.path, f"deleted.{self._generation + 1}.npz")
+
+    def _cleanup(self, segments: List[Segment]):
+        """Remove segment directories and tombstone files no longer referenced."""
+        live = {seg.name: seg.deletes_file for seg in segments}
+        for entry in os.listdir(self.path):
+            entry_path = os.path.join(self.path, entry)
+            if not os.path.isdir(entry_path) or any(entry.startswith(name) for name in self._pending):
+                continue
+            if entry not in live:
+                shutil.rmtree(entry_path, ignore_errors=True)
+                continue
+            for name in os.listdir(entry_path):
+                if name.startswith("deleted.") and name != live[entry]:
+                    os.remove(os.path.join(entry_path, name))
+
+    def _new_segment(self, documents: List[Dict[str, str]], seqs: Optional[Sequence[int]] = None) -> Segment:
+        name = f"seg-{self._next_segment:06d}"
+        self._next_segment += 1
+        index = BM25Index(k1=self.k1, b=self.b, epsilon=self.epsilon)
+        chunk_ids, texts = [doc['id'] for doc in documents], [doc['text'] for doc in documents]
+        if self.positions:
+            analyzed = [self.analyzer.analyze_with_positions(text) for text in texts]
+            index.build([[term for term, _ in terms] for terms in analyzed], chunk_ids, texts,
+                        positions=[[position for _, position in terms] for terms in analyzed])
+        else:
+            index.build([self.analyzer.analyze(text) for text in texts], chunk_ids, texts)
+        self._save_segment(index, name, seqs)
+        return Segment.open(self.path, name)
+
+    def _save_segment(self, index: BM25Index, name: str, seqs: Optional[Sequence[int]] = None):
+        if self.postings_format == "compressed":
+            index.compress()
+        index.save(os.path.join(self.path, name))
+        if seqs is not None:
+            np.save(os.path.join(self.path, name, SEQS_FILE), np.asarray(seqs, dtype=np.int64))
+
+    # ---- Writes ----
+
+    def _ensure_writable(self):
+        os.makedirs(self.path, exist_ok=True)
+        if not self._cleaned:
+            # Drop leftovers of interrupted writes or merges
+            self._cleanup(self._segments)
+            self._cleaned = True
+        if self._locations is None:
+            self._locations = {}
+            for seg in self._segments:
+                for doc, chunk_id in enumerate(seg.index.chunk_ids):
+                    if not seg.deleted[doc]:
+                        self._locations[chunk_id] = (seg, doc)
+
+    def rebuild(self, documents: List[Dict[str, str]], analyzer: Optional[Analyzer] = None,
+                seqs: Optional[Sequence[int]] = None):
+        """
+        Replace the whole index with a single segment built from ``documents``,
+        optionally switching to a different analyzer. ``seqs`` (one per
+        document) records their write order in a larger collection.
+        """
+        with self._lock:
+            if analyzer is not None:
+                self.analyzer = analyzer
+            os.makedirs(self.path, exist_ok=True)
+            segments = [self._new_segment(documents, seqs)] if documents else []
+            self._commit(segments)
+            self._cleanup(segments)
+            self._locations = None
+
+    def add_documents(self, documents: List[Dict[str, str]], seqs: Optional[Sequence[int]] = None):
+        """
+        Add documents as a new segment.
+        Documents whose id is already indexed replace the previous version.
+        """
+        self._write(documents, [], seqs)
+
+    def update_documents(self, documents: List[Dict[str, str]], seqs: Optional[Sequence[int]] = None):
+        """Replace indexed documents (documents not yet indexed are added)."""
+        self._write(documents, [], seqs)
+
+    def delete_documents(self, chunk_ids: List[str]) -> int:
+        """Tombstone documents by id. Returns the number of documents deleted."""
+        return self._write([], chunk_ids)
+
+    def _write(self, documents: List[Dict[str, str]], deletes: List[str],
+               seqs: Optional[Sequence[int]] = None) -> int:
+        # The last version of a document in a batch wins
+        if seqs is not None:
+            latest = {doc['id']: (doc, seq) for doc, seq in zip(documents, seqs)}
+            documents, seqs = [doc for doc, _ in latest.values()], [seq for _, seq in latest.values()]
+        else:
+            documents = list({doc['id']: doc for doc in documents}.values())
+        with self._lock:
+            self._ensure_writable()
+            touched: Dict[str, Segment] = {}
+            deleted = 0
+            for chunk_id in list(deletes) + [doc['id'] for doc in documents]:
+                location = self._locations.pop(chunk_id, None)
+                if location is not None:
+                    seg, doc = location
+                    seg.delete(doc, self.analyzer)
+                    touched[seg.name] = seg
+                    deleted += 1
+            if not documents and not touched:
+                return 0
+
+            segments = list(self._segments)
+            if documents:
+                seg = self._new_segment(documents, seqs)
+                segments.append(seg)
+                for doc in range(seg.num_docs):
+                    self._locations[seg.index.chunk_ids[doc]] = (seg, doc)
+            for seg in touched.values():
+                self._write_deletes(seg)
+            self._commit(segments)
+            self._cleanup(segments)
+        self._schedule_merge()
+        return deleted
+
+    # ---- Merging ----
+
+    def _schedule_merge(self):
+        if not self.background_merge:
+            self.merge()
+            return
+        with self._lock:
+            if self._merge_thread is None or not self._merge_thread.is_alive():
+                self._merge_thread = threading.Thread(target=self.merge, name="bm25-merge", daemon=True)
+                self._merge_thread.start()
+
+    def wait_for_merges(self, timeout: Optional[float] = None):
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _select_merge(self, segments: List[Segment]) -> Optional[Tuple[int, int]]:
+        """
+        Choose a window [start, end) of adjacent segments to merge.
+        Merging adjacent segments keeps documents in insertion order.
+        """
+        for i, seg in enumerate(segments):
+            if seg.num_docs and seg.num_deleted / seg.num_docs > self.purge_ratio:
+                return i, i + 1
+        if len(segments) <= self.max_segments:
+            return None
+        width = min(self.merge_factor, len(segments))
+        sizes = np.array([seg.num_live for seg in segments])
+        window_sizes = np.convolve(sizes, np.ones(width, dtype=np.int64), mode="valid")
+        start = int(np.argmin(window_sizes))
+        return start, start + width
+
+    def merge(self):
+        """Merge segments until the merge policy is satisfied."""
+        while True:
+            with self._lock:
+                window = self._select_merge(self._segments)
+                if window is None:
+                    return
+                sources = self._segments[window[0]:window[1]]
+                snapshots = [seg.deleted.copy() for seg in sources]
+                name = f"seg-{self._next_segment:06d}"
+                self._next_segment += 1
+                self._pending.add(name)
+            try:
+                merged, doc_maps = self._merge_segments(name, sources, snapshots)
+            except Exception as e:
+                logger.error(f"BM25 segment merge failed: {e}")
+                with self._lock:
+                    self._pending.discard(name)
+                return
+            with self._lock:
+                self._pending.discard(name)
+                if not all(any(seg is cur for cur in self._segments) for seg in sources):
+                    # The index was rebuilt while merging
+                    shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+                    continue
+                self._commit_merge(sources, snapshots, merged, doc_maps)
+            logger.info(f"Merged {len(sources)} BM25 segments into {name} ({merged.num_live if merged else 0} documents).")
+
+    def _commit_merge(self, sources: List[Segment], snapshots: List[np.ndarray],
+                      merged: Optional[Segment], doc_maps: List[np.ndarray]):
+        if merged is not None:
+            # Apply deletes that happened while the merge was running
+            late = False
+            for seg, snapshot, doc_map in zip(sources, snapshots, doc_maps):
+                for doc in np.flatnonzero(seg.deleted & ~snapshot):
+                    merged.delete(int(doc_map[doc]), self.analyzer)
+                    late = True
+            if late:
+                self._write_deletes(merged)
+            if self._locations is not None:
+                for doc in range(merged.num_docs):
+                    if not merged.deleted[doc]:
+                        self._locations[merged.index.chunk_ids[doc]] = (merged, doc)
+
+        start = next(i for i, seg in enumerate(self._segments) if seg is sources[0])
+        segments = self._segments[:start] + ([merged] if merged is not None else []) \
+            + self._segments[start + len(sources):]
+        self._commit(segments)
+        self._cleanup(segments)
+
+    def _merge_segments(self, name: str, sources: List[Segment],
+                        snapshots: List[np.ndarray]) -> Tuple[Optional[Segment], List[np.ndarray]]:
+        """
+        Rewrite the live documents of ``sources`` as one segment.
+        Returns the new segment (None if nothing is live) and, per source, the
+        mapping from old to new doc ids (-1 for dropped documents).
+        """
+        vocab = sorted(set().union(*(set(seg.index.vocab.terms) for seg in sources)))
+        term_index = {term: i for i, term in enumerate(vocab)}
+        terms_parts, docs_parts, tfs_parts, lens_parts = [], [], [], []
+        # Positions survive a merge only if every source has them
+        with_positions = all(seg.index.has_positions for seg in sources)
+        counts_parts, positions_parts = [], []
+        chunk_ids: List[str] = []
+        texts: List[str] = []
+        # Sequence numbers survive a merge only if every source has them
+        with_seqs = all(seg.seqs is not None for seg in sources)
+        seqs_parts = []
+        doc_maps = []
+        offset = 0
+        for seg, deleted in zip(sources, snapshots):
+            index = seg.index
+            live_docs = np.flatnonzero(~deleted)
+            doc_map = np.full(index.num_docs, -1, dtype=np.int64)
+            doc_map[live_docs] = offset + np.arange(len(live_docs))
+            term_map = np.fromiter((term_index[t] for t in index.vocab.terms), dtype=np.int64, count=len(index.vocab))
+            posting_terms = np.repeat(np.arange(len(index.vocab)), index.doc_freqs())
+            doc_ids, term_freqs = index.postings.all()
+            new_docs = doc_map[doc_ids]
+            keep = new_docs >= 0
+            terms_parts.append(term_map[posting_terms[keep]])
+            docs_parts.append(new_docs[keep])
+            tfs_parts.append(term_freqs[keep])
+            if with_positions:
+                starts, ends = index.pos_indptr[:-1][keep], index.pos_indptr[1:][keep]
+                counts_parts.append(ends - starts)
+                positions_parts.append(np.asarray(index.positions)[expand_ranges(starts, ends)])
+            lens_parts.append(index.doc_lens[live_docs])
+            chunk_ids.extend(index.chunk_ids[int(d)] for d in live_docs)
+            texts.extend(index.texts[int(d)] for d in live_docs)
+            if with_seqs:
+                seqs_parts.append(np.asarray(seg.seqs)[live_docs])
+            doc_maps.append(doc_map)
+            offset += len(live_docs)
+
+        if not offset:
+            return None, doc_maps
+
+        terms = np.concatenate(terms_parts)
+        # Terms that only occurred in dropped documents leave the vocabulary
+        used, terms = np.unique(terms, return_inverse=True)
+        index = BM25Index(k1=self.k1, b=self.b, epsilon=self.epsilon)
+        positions = (np.concatenate(counts_parts), np.concatenate(positions_parts)) if with_positions else None
+        index.set_postings([vocab[i] for i in used], terms, np.concatenate(docs_parts),
+                           np.concatenate(tfs_parts), np.concatenate(lens_parts), chunk_ids, texts,
+                           positions=positions)
+        self._save_segment(index, name, np.concatenate(seqs_parts) if with_seqs else None)
+        return Segment.open(self.path, name), doc_maps
+
+    # ---- Queries ----
+
+    def stats(self) -> BM25Stats:
+        """Collection statistics over live documents, recomputed after each change."""
+        stats = self._stats
+        if stats is None:
+            with self._lock:
+                stats = self._make_stats(self._segments, self._average_idf)
+                self._stats = stats
+        return stats
+
+    def _compute_average_idf(self, segments: List[Segment]) -> float:
+        """Mean IDF over the live vocabulary of all segments (BM25Okapi's floor basis)."""
+        if not segments:
+            return 0.0
+        num_docs = sum(seg.num_live for seg in segments)
+        # Global document frequencies: a dense vector over the largest
+        # segment's vocabulary plus a dict for terms it does not contain
+        base = max(segments, key=lambda seg: seg.num_docs)
+        doc_freqs = base.live_doc_freqs().astype(np.int64)
+        extra: Dict[str, int] = {}
+        for seg in segments:
+            if seg is base:
+                continue
+            seg_df = seg.live_doc_freqs()
+            mapping = seg.mapping_to(base)
+            known = mapping >= 0
+            np.add.at(doc_freqs, mapping[known], seg_df[known])
+            for term_id in np.flatnonzero(~known & (seg_df > 0)):
+                term = seg.index.vocab.terms[int(term_id)]
+                extra[term] = extra.get(term, 0) + int(seg_df[term_id])
+
+        all_df = np.concatenate([doc_freqs[doc_freqs > 0], np.fromiter(extra.values(), dtype=np.int64)])
+        if not len(all_df):
+            return 0.0
+        return float(bm25_idf(num_docs, all_df.astype(np.float64)).sum()) / len(all_df)
+
+    def _make_stats(self, segments: List[Segment], average_idf: float) -> BM25Stats:
+        num_docs = sum(seg.num_live for seg in segments)
+        avgdl = sum(seg.live_length() for seg in segments) / num_docs if num_docs else 0.0
+        floor = self.epsilon * average_idf
+        cache: Dict[str, float] = {}
+
+        def idf(term: str) -> float:
+            value = cache.get(term)
+            if value is None:
+                df = 0
+                for seg in segments:
+                    term_id = seg.index.vocab.get(term)
+                    if term_id is not None:
+                        df += int(seg.index.indptr[term_id + 1] - seg.index.indptr[term_id])
+                        df -= int(seg.deleted_df[term_id])
+                value = float(bm25_idf(num_docs, np.float64(df))) if df else 0.0
+                if value < 0:
+                    value = floor
+                cache[term] = value
+            return value
+
+        return BM25Stats(num_docs, avgdl, idf)
+
+    def _phrase_matches(self, seg: Segment, phrase: Phrase) -> np.ndarray:
+        """Documents of ``seg`` matching one phrase constraint."""
+        terms, slop = phrase
+        index = seg.index
+        if index.has_positions:
+            return index.match_phrase(terms, slop)
+        term_ids = [index.vocab.get(term) for term, _ in terms]
+        if any(term_id is None for term_id in term_ids):
+            return np.zeros(0, dtype=np.int64)
+        docs = index.docs_with_all(term_ids)
+        docs = docs[~seg.deleted[docs]]
+        if len(docs) > self.phrase_fallback_limit:
+            raise ValueError(f"Phrase query needs {len(docs)} documents re-analysed in a segment without "
+                             f"positions (limit {self.phrase_fallback_limit}); rebuild with positions=True")
+        positions: Dict[str, Tuple[List[int], List[int]]] = {term: ([], []) for term, _ in terms}
+        for doc in docs:
+            for term, position in self.analyzer.analyze_with_positions(index.texts[int(doc)]):
+                if term in positions:
+                    positions[term][0].append(int(doc))
+                    positions[term][1].append(position)
+        occurrences = {term: (np.array(d, dtype=np.int64), np.array(p, dtype=np.int64))
+                       for term, (d, p) in positions.items()}
+        return match_positions([occurrences[term] for term, _ in terms], [offset for _, offset in terms], slop)
+
+    def _excluded(self, seg: Segment, phrases: Optional[Sequence[Phrase]]) -> np.ndarray:
+        """Documents of ``seg`` a query must skip: deleted, or failing a phrase constraint."""
+        if not phrases:
+            return seg.deleted
+        allowed = ~seg.deleted
+        for phrase in phrases:
+            matches = np.zeros(seg.num_docs, dtype=bool)
+            matches[self._phrase_matches(seg, phrase)] = True
+            allowed &= matches
+        return ~allowed
+
+    def search(self, tokens: List[str], top_k: int, mode: str = "exact",
+               stats: Optional[BM25Stats] = None, phrases: Optional[Sequence[Phrase]] = None) -> List[Dict[str, Any]]:
+        """
+        Return the ``top_k`` live documents as {'id', 'text', 'score'}.
+        ``tokens`` come from ``self.analyzer.analyze_query``.
+        mode: 'exact' scores every matching document, 'pruned' uses
+        MaxScore/block-max evaluation (same results, fewer documents scored,
+        but slower than the vectorised exact pass on the benchmarks so far).
+        ``stats`` overrides the index's own statistics, e.g. when this index
+        is one shard of a larger collection.
+        ``phrases`` (from ``self.analyzer.parse_query``) restricts the results
+        to documents matching every phrase; they are filtered before scoring.
+        Raises ValueError if a phrase cannot be checked (see the class docstring).
+        """
+        if mode not in ("exact", "pruned"):
+            raise ValueError(f"Unknown search mode: {mode}")
+        segments = self._segments
+        if not segments:
+            return []
+        stats = stats or self.stats()
+        offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        np.cumsum([seg.num_docs for seg in segments], out=offsets[1:])
+        keys = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0, dtype=np.float64)
+        threshold = 0.0
+        # Largest segments first so they set a high threshold for the rest
+        for i in sorted(range(len(segments)), key=lambda i: -segments[i].num_docs):
+            seg = segments[i]
+            excluded = self._excluded(seg, phrases)
+            if phrases and excluded.all():
+                continue
+            if mode == "exact":
+                docs, seg_scores = seg.index.score(tokens, stats)
+                live = ~excluded[docs]
+                docs, seg_scores = docs[live], seg_scores[live]
+            else:
+                docs, seg_scores = seg.index.score_pruned(tokens, top_k, stats, excluded, threshold)
+            # Global key orders documents by segment, then by position in it
+            keys = np.concatenate([keys, docs.astype(np.int64) + offsets[i]])
+            scores = np.concatenate([scores, seg_scores])
+            if mode == "pruned" and len(scores) >= top_k > 0:
+                threshold = float(np.partition(scores, len(scores) - top_k)[len(scores) - top_k])
+
+        return self._materialise(segments, offsets, select_top_k(keys, scores, top_k))
+
+    def search_batch(self, queries: List[List[str]], top_k: int, stats: Optional[BM25Stats] = None,
+                     phrases: Optional[List[Sequence[Phrase]]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Top ``top_k`` live documents for each tokenized query.
+        Every segment scores the whole batch in one pass (see
+        ``BM25Index.score_batch``); identical queries are scored once.
+        Queries with phrase constraints (``phrases``, per query) go through
+        ``search`` one by one.
+        """
+        segments = self._segments
+        if not segments:
+            return [[] for _ in queries]
+        stats = stats or self.stats()
+        if phrases and any(phrases):
+            plain = [row for row, query_phrases in enumerate(phrases) if not query_phrases]
+            results = dict(zip(plain, self.search_batch([queries[row] for row in plain], top_k, stats)))
+            return [results[row] if row in results else self.search(queries[row], top_k, stats=stats, phrases=phrases[row])
+                    for row in range(len(queries))]
+        unique: Dict[Tuple[str, ...], int] = {}
+        for tokens in queries:
+            unique.setdefault(tuple(tokens), len(unique))
+        batch = [list(tokens) for tokens in unique]
+
+        offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        np.cumsum([seg.num_docs for seg in segments], out=offsets[1:])
+        keys = [[] for _ in batch]
+        scores = [[] for _ in batch]
+        for i, seg in enumerate(segments):
+            for row, (docs, seg_scores) in enumerate(seg.index.score_batch(batch, stats)):
+                live = ~seg.deleted[docs]
+                keys[row].append(docs[live].astype(np.int64) + offsets[i])
+                scores[row].append(seg_scores[live])
+
+        results = [
+            self._materialise(segments, offsets, select_top_k(np.concatenate(keys[row]), np.concatenate(scores[row]), top_k))
+            for row in range(len(batch))
+        ]
+        return [results[unique[tuple(tokens)]] for tokens in queries]
+
+    @staticmethod
+    def _materialise(segments: List[Segment], offsets: np.ndarray,
+                     top: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+        results = []
+        for key, score in top:
+            i = int(np.searchsorted(offsets, key, side="right")) - 1
+            doc = key - int(offsets[i])
+            results.append({
+                "id": segments[i].index.chunk_ids[doc],
+                "text": segments[i].index.texts[doc],
+                "score": score,
+            })
+            if segments[i].seqs is not None:
+                # Lets a sharded index order ties as the single-index engine does
+                results[-1]["seq"] = int(segments[i].seqs[doc])
+        return results
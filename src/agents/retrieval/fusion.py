@@ -1,72 +1,245 @@
 import logging
-from typing import List, Dict, Any
-from collections import defaultdict
+from typing import List, Dict, Any, Hashable, Iterable, Iterator, Optional, Sequence, Tuple
+import numpy as np
 from src.agents.base import BaseAgent
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+FUSION_METHODS = ("rrf", "combsum", "combmnz")
+
+def intern_ids(ranked: Sequence[Sequence[Hashable]]) -> Tuple[List[Hashable], List[np.ndarray]]:
+    """
+    Map the ids of each ranked list to dense integer codes, numbered in order
+    of first occurrence. Returns the ids by code and one code array per list.
+    """
+    codes: Dict[Hashable, int] = {}
+    arrays = []
+    for ids in ranked:
+        arrays.append(np.fromiter((codes.setdefault(doc_id, len(codes)) for doc_id in ids),
+                                  dtype=np.int64, count=len(ids)))
+    return list(codes), arrays
+
+def _normalized(scores: Optional[Sequence[float]], n: int) -> np.ndarray:
+    """Min-max normalized scores, or (n - rank) / n when a list has none."""
+    if n == 0:
+        return np.zeros(0)
+    if scores is None:
+        return (n - np.arange(n)) / n
+    scores = np.asarray(scores, dtype=np.float64)
+    low, high = scores.min(), scores.max()
+    if high == low:
+        return np.ones(n)
+    return (scores - low) / (high - low)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` best scores, ties broken by ascending index."""
+    if k <= 0 or not len(scores):
+        return np.empty(0, dtype=np.int64)
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        # Keep every index tied with the k-th score so ties resolve by index
+        candidates = np.flatnonzero(scores >= scores[candidates].min())
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))[:k]]
+
+def fuse(ranked: Sequence[np.ndarray], num_ids: int, method: str = "rrf",
+         weights: Optional[Sequence[float]] = None, scores: Optional[Sequence[Optional[Sequence[float]]]] = None,
+         rrf_k: int = 60) -> np.ndarray:
+    """
+    Fused score of every id code, given one array of codes per retriever
+    (best first).
+
+    - 'rrf': sum of weight / (rrf_k + rank)
+    - 'combsum': sum of weight * min-max normalized score (rank-based when a
+      retriever has no scores)
+    - 'combmnz': combsum times the number of retrievers returning the id
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method: {method}")
+    weights = np.ones(len(ranked)) if weights is None else np.asarray(weights, dtype=np.float64)
+    lengths = [len(codes) for codes in ranked]
+    if not sum(lengths):
+        return np.zeros(num_ids)
+    codes = np.concatenate(ranked)
+    if method == "rrf":
+        contrib = np.concatenate([1.0 / (rrf_k + np.arange(1, n + 1)) for n in lengths])
+    else:
+        contrib = np.concatenate([_normalized(None if scores is None else scores[i], n)
+                                  for i, n in enumerate(lengths)])
+    contrib *= np.repeat(weights, lengths)
+    fused = np.bincount(codes, weights=contrib, minlength=num_ids)
+    if method == "combmnz":
+        fused *= sum(np.bincount(array, minlength=num_ids) > 0 for array in ranked)
+    return fused
+
+def threshold_fuse(streams: Sequence[Iterable[Tuple[Hashable, float]]], top_k: int, method: str = "rrf",
+                   weights: Optional[Sequence[float]] = None, rrf_k: int = 60,
+                   check_every: int = 8) -> Tuple[List[Tuple[Hashable, float]], int]:
+    """
+    RRF of retriever streams of (id, score), each sorted best first, reading
+    them in lockstep and stopping as soon as the ``top_k`` ids and their order
+    can no longer change (the threshold algorithm without random access).
+    Meant for lazy streams, e.g. paginated retrievers; on lists already in
+    memory ``fuse`` is faster.
+
+    Each id has a lower bound (the contributions seen so far) and an upper
+    bound (plus, for every stream it has not appeared in yet, that stream's
+    latest contribution, which no later one exceeds). Reading stops once
+    every one of the top ids has a lower bound at least the upper bound of the
+    id after it, and of any id not seen yet. The streams are then read on
+    only as far as the winners' remaining ranks, so their scores are the full
+    fusion's (a stream missing a winner is read to its end).
+
+    Only 'rrf' is supported: CombSUM and CombMNZ normalize each list by its
+    minimum score, which is only known at its end.
+    Returns the (id, score) pairs, best first, and the depth read.
+    """
+    if method != "rrf":
+        raise ValueError(f"Threshold fusion supports only 'rrf', not {method}")
+    iterators: List[Optional[Iterator[Tuple[Hashable, float]]]] = [iter(stream) for stream in streams]
+    weights = np.ones(len(iterators)) if weights is None else np.asarray(weights, dtype=np.float64)
+    latest = np.zeros(len(iterators))
+    codes: Dict[Hashable, int] = {}
+    lower: List[float] = []
+    seen: List[int] = []  # bit i set once stream i returned the id
+    depth = 0
+    next_check = check_every
+    while any(it is not None for it in iterators):
+        depth += 1
+        for i, it in enumerate(iterators):
+            if it is None:
+                continue
+            item = next(it, None)
+            if item is None:
+                iterators[i] = None
+                latest[i] = 0.0
+                continue
+            contrib = weights[i] / (rrf_k + depth)
+            latest[i] = contrib
+            code = codes.setdefault(item[0], len(codes))
+            if code == len(lower):
+                lower.append(0.0)
+                seen.append(0)
+            lower[code] += contrib
+            seen[code] |= 1 << i
+        if depth == next_check:
+            if _resolved(lower, seen, latest, top_k):
+                break
+            # Checks cost O(ids seen): space them out geometrically
+            next_check = max(depth + check_every, int(depth * 1.25))
+    ids = list(codes)
+    best = top_k_indices(np.asarray(lower), top_k).tolist()
+    fused = _complete(iterators, depth, {ids[code]: code for code in best}, lower, seen, weights, rrf_k)
+    return [(ids[code], fused[code]) for code in best], depth
+
+def _bounds(lower: List[float], seen: List[int], latest: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    lower = np.asarray(lower)
+    bits = (np.asarray(seen, dtype=np.int64)[:, None] >> np.arange(len(latest))) & 1
+    return lower, lower + (1 - bits) @ latest
+
+def _resolved(lower: List[float], seen: List[int], latest: np.ndarray, top_k: int) -> bool:
+    if len(lower) < top_k:
+        return False
+    low, high = _bounds(lower, seen, latest)
+    best = top_k_indices(low, top_k)
+    rest = np.ones(len(low), dtype=bool)
+    rest[best] = False
+    following = np.append(high[best[1:]], max(high[rest].max(initial=0.0), latest.sum()))
+    return bool(np.all(low[best] >= following))
+
+def _complete(iterators: List[Optional[Iterator[Tuple[Hashable, float]]]], depth: int, winners: Dict[Hashable, int],
+              lower: List[float], seen: List[int], weights: np.ndarray, rrf_k: int) -> Dict[int, float]:
+    """Full RRF scores of the winners (by code): add their ranks past ``depth``."""
+    fused = {code: lower[code] for code in winners.values()}
+    for i, it in enumerate(iterators):
+        waiting = {doc_id for doc_id, code in winners.items() if not seen[code] >> i & 1}
+        rank = depth
+        while it is not None and waiting:
+            item = next(it, None)
+            if item is None:
+                break
+            rank += 1
+            if item[0] in waiting:
+                waiting.discard(item[0])
+                fused[winners[item[0]]] += weights[i] / (rrf_k + rank)
+    return {code: float(score) for code, score in fused.items()}
+
 class HybridFusionAgent(BaseAgent):
     """
-    Agent responsible for fusing results from multiple retrieval methods using RRF.
+    Agent responsible for fusing results from multiple retrieval methods.
+
+    ``method``: 'rrf', 'combsum' or 'combmnz' (see ``fuse``), with optional
+    per-retriever ``weights`` ({'vector': 1.0, 'sparse': 0.5}, default 1.0).
+    Ids are interned to integer codes and scored with NumPy; only the
+    ``top_k`` winners are sorted and copied.
     """
-    def __init__(self, name: str, rrf_k: int = 60):
+    def __init__(self, name: str, rrf_k: int = 60, method: str = "rrf",
+                 weights: Optional[Dict[str, float]] = None):
         super().__init__(name=name)
+        if method not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion method: {method}")
         self.rrf_k = rrf_k
+        self.method = method
+        self.weights = weights or {}
 
     async def execute(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """
         Execute hybrid fusion.
-        Task format: {'results': Dict[str, List[Dict]], 'top_k': int}
+        Task format: {'results': Dict[str, List[Dict]], 'top_k': int, 'method': str,
+                      'weights': Dict[str, float]}
         results: {'vector': [{'id': '1', ...}, ...], 'sparse': [...]}
         """
         results_map = task.get("results", {})
         top_k = task.get("top_k", 10)
-        
+        method = task.get("method", self.method)
+        weights = {**self.weights, **task.get("weights", {})}
+
         if not results_map:
             return {"error": "No results provided for fusion"}
 
         try:
-            fused_results = self.reciprocal_rank_fusion(results_map)
+            fused_results = self.reciprocal_rank_fusion(results_map, top_k, method, weights)
             return {
                 "status": "success",
-                "results": fused_results[:top_k],
-                "count": len(fused_results[:top_k])
+                "results": fused_results,
+                "count": len(fused_results)
             }
         except Exception as e:
             logger.error(f"Hybrid fusion failed: {e}")
             return {"status": "error", "message": str(e)}
 
-    def reciprocal_rank_fusion(self, results_map: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _result(item: Dict[str, Any], score: float, rank: int) -> Dict[str, Any]:
+        return {**item, "score": score, "fusion_rank": rank}
+
+    def reciprocal_rank_fusion(self, results_map: Dict[str, List[Dict[str, Any]]], top_k: Optional[int] = None,
+                               method: str = "rrf", weights: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
         """
-        Perform Reciprocal Rank Fusion.
+        Fuse the ranked lists and return the ``top_k`` best (all by default),
+        keeping each document's metadata from its first occurrence.
         """
-        scores = defaultdict(float)
-        metadata_map = {}
-        
-        for method, items in results_map.items():
-            for rank, item in enumerate(items):
-                doc_id = item['id']
-                scores[doc_id] += 1.0 / (self.rrf_k + rank + 1)
-                
-                # Keep metadata from the first occurrence (or merge?)
-                if doc_id not in metadata_map:
-                    metadata_map[doc_id] = item
-                    # Ensure text is preserved
-                    if 'text' in item:
-                        metadata_map[doc_id]['text'] = item['text']
-        
-        # Sort by score descending
-        sorted_ids = sorted(scores.keys(), key=lambda x: scores[x], reverse=True)
-        
-        fused_results = []
-        for doc_id in sorted_ids:
-            result = metadata_map[doc_id].copy()
-            result['score'] = scores[doc_id]
-            result['fusion_rank'] = len(fused_results) + 1
-            fused_results.append(result)
-            
-        return fused_results
+        weights = weights or {}
+        lists = list(results_map.values())
+        ids, ranked = intern_ids([[item['id'] for item in items] for items in lists])
+        scores = None
+        if method != "rrf":
+            scores = [[item['score'] for item in items] if all('score' in item for item in items) else None
+                      for items in lists]
+        fused = fuse(ranked, len(ids), method, [weights.get(name, 1.0) for name in results_map], scores, self.rrf_k)
+
+        best = top_k_indices(fused, len(ids) if top_k is None else top_k)
+        # Metadata of the winners only, from each one's first occurrence
+        ends = np.cumsum([len(items) for items in lists])
+        _, first = np.unique(np.concatenate(ranked), return_index=True)
+        results = []
+        for rank, code in enumerate(best.tolist(), 1):
+            position = int(first[code])
+            list_index = int(np.searchsorted(ends, position, side="right"))
+            offset = position - (int(ends[list_index - 1]) if list_index else 0)
+            results.append(self._result(lists[list_index][offset], float(fused[code]), rank))
+        return results
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,186 @@
+from typing import Dict, Tuple
+import numpy as np
+
+# Largest tf kept by compressed postings; BM25 saturates long before it
+MAX_TF_CODE = 255
+
+def encode_varint(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    LEB128 varint encoding of non-negative integers, vectorised.
+    Returns (bytes, offsets) where value ``i`` occupies ``bytes[offsets[i]:offsets[i + 1]]``.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    out = np.zeros(int(offsets[-1]), dtype=np.uint8)
+    for i in range(int(lengths.max()) if len(values) else 0):
+        mask = lengths > i
+        byte = (values[mask] >> np.uint64(7 * i)) & np.uint64(0x7F)
+        more = (lengths[mask] > i + 1).astype(np.uint64) << np.uint64(7)
+        out[offsets[:-1][mask] + i] = (byte | more).astype(np.uint8)
+    return out, offsets
+
+def decode_varint(buf: np.ndarray) -> np.ndarray:
+    """Decode a run of LEB128 varints, vectorised."""
+    buf = np.asarray(buf, dtype=np.uint8)
+    if not len(buf):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shift = np.arange(len(buf)) - np.repeat(starts, ends - starts + 1)
+    parts = (buf & 0x7F).astype(np.int64) << (7 * shift)
+    return np.add.reduceat(parts, starts)
+
+class PlainPostings:
+    """Doc ids and term frequencies as int32 arrays in CSR order."""
+    format = "plain"
+    arrays = ("doc_ids", "term_freqs")
+
+    def __init__(self, indptr: np.ndarray, doc_ids: np.ndarray, term_freqs: np.ndarray):
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+
+    @classmethod
+    def load(cls, index, arrays: Dict[str, np.ndarray]) -> "PlainPostings":
+        return cls(index.indptr, arrays["doc_ids"], arrays["term_freqs"])
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {"doc_ids": self.doc_ids, "term_freqs": self.term_freqs}
+
+    @property
+    def nbytes(self) -> int:
+        return self.doc_ids.nbytes + self.term_freqs.nbytes
+
+    def term(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.doc_ids[start:end], self.term_freqs[start:end]
+
+    def locate(self, term_id: int, docs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """For sorted ``docs``: which appear in the term's postings, and their posting positions."""
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        postings = self.doc_ids[start:end]
+        pos = np.searchsorted(postings, docs)
+        found = pos < end - start
+        found[found] = postings[pos[found]] == docs[found]
+        return found, start + pos[found]
+
+    def lookup(self, term_id: int, docs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """For sorted ``docs``: which appear in the term's postings, and their tfs."""
+        found, positions = self.locate(term_id, docs)
+        return found, self.term_freqs[positions]
+
+    def all(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.doc_ids, self.term_freqs
+
+class CompressedPostings:
+    """
+    Block-compressed postings.
+
+    Doc ids are delta encoded along each postings list and stored as LEB128
+    varints; ``block_offsets`` gives the byte range of every block of
+    ``BLOCK_SIZE`` postings. Term frequencies are quantized to one byte
+    (clamped at ``MAX_TF_CODE``). Queries decode a whole list only when it is
+    scored in full; candidate lookups use the block skip data
+    (``block_last_doc``) to decode just the blocks that may hold a candidate.
+    """
+    format = "varint"
+    arrays = ("posting_blob", "block_offsets", "tf_codes")
+
+    def __init__(self, indptr: np.ndarray, block_indptr: np.ndarray, block_last_doc: np.ndarray,
+                 block_size: int, posting_blob: np.ndarray, block_offsets: np.ndarray, tf_codes: np.ndarray):
+        self.indptr = indptr
+        self.block_indptr = block_indptr
+        self.block_last_doc = block_last_doc
+        self.block_size = block_size
+        self.posting_blob = posting_blob
+        self.block_offsets = block_offsets
+        self.tf_codes = tf_codes
+
+    @classmethod
+    def encode(cls, index, doc_ids: np.ndarray, term_freqs: np.ndarray) -> "CompressedPostings":
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        previous = np.empty_like(doc_ids)
+        previous[1:] = doc_ids[:-1]
+        # Every postings list starts from -1 so its first delta is doc + 1
+        previous[index.indptr[:-1][index.doc_freqs() > 0]] = -1
+        blob, offsets = encode_varint(doc_ids - previous)
+        block_terms = np.repeat(np.arange(len(index.indptr) - 1), np.diff(index.block_indptr))
+        block_starts = index.indptr[block_terms] + (np.arange(len(block_terms)) - index.block_indptr[block_terms]) * index.block_size
+        block_offsets = np.append(offsets[block_starts], offsets[-1]).astype(np.int64)
+        tf_codes = np.minimum(np.asarray(term_freqs), MAX_TF_CODE).astype(np.uint8)
+        return cls(index.indptr, index.block_indptr, index.block_last_doc, index.block_size,
+                   blob, block_offsets, tf_codes)
+
+    @classmethod
+    def load(cls, index, arrays: Dict[str, np.ndarray]) -> "CompressedPostings":
+        return cls(index.indptr, index.block_indptr, index.block_last_doc, index.block_size,
+                   arrays["posting_blob"], arrays["block_offsets"], arrays["tf_codes"])
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {"posting_blob": self.posting_blob, "block_offsets": self.block_offsets, "tf_codes": self.tf_codes}
+
+    @property
+    def nbytes(self) -> int:
+        return self.posting_blob.nbytes + self.block_offsets.nbytes + self.tf_codes.nbytes
+
+    def term(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        b0, b1 = self.block_indptr[term_id], self.block_indptr[term_id + 1]
+        deltas = decode_varint(self.posting_blob[self.block_offsets[b0]:self.block_offsets[b1]])
+        docs = (np.cumsum(deltas) - 1).astype(np.int32)
+        return docs, self.tf_codes[self.indptr[term_id]:self.indptr[term_id + 1]]
+
+    def _decode_blocks(self, term_id: int, blocks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Doc ids of the given (ascending) blocks of a term, with their posting positions."""
+        b0 = self.block_indptr[term_id]
+        starts = self.indptr[term_id] + (blocks - b0) * self.block_size
+        lengths = np.minimum(self.block_size, self.indptr[term_id + 1] - starts)
+        bases = np.where(blocks == b0, -1, self.block_last_doc[np.maximum(blocks - 1, 0)]).astype(np.int64)
+        buf = self.posting_blob[expand_ranges(self.block_offsets[blocks], self.block_offsets[blocks + 1])]
+        docs = _segment_cumsum(decode_varint(buf), lengths, bases)
+        return docs, expand_ranges(starts, starts + lengths)
+
+    def locate(self, term_id: int, docs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """For sorted ``docs``: which appear in the term's postings, and their posting positions."""
+        b0, b1 = self.block_indptr[term_id], self.block_indptr[term_id + 1]
+        blocks = np.searchsorted(self.block_last_doc[b0:b1], docs) + b0
+        found = np.zeros(len(docs), dtype=bool)
+        needed = np.unique(blocks[blocks < b1])
+        if not len(needed):
+            return found, np.zeros(0, dtype=np.int64)
+        block_docs, positions = self._decode_blocks(term_id, needed)
+        pos = np.minimum(np.searchsorted(block_docs, docs), len(block_docs) - 1)
+        found = block_docs[pos] == docs
+        return found, positions[pos[found]]
+
+    def lookup(self, term_id: int, docs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """For sorted ``docs``: which appear in the term's postings, and their tfs."""
+        found, positions = self.locate(term_id, docs)
+        return found, self.tf_codes[positions]
+
+    def all(self) -> Tuple[np.ndarray, np.ndarray]:
+        lengths = np.diff(self.indptr)
+        lengths = lengths[lengths > 0]
+        docs = _segment_cumsum(decode_varint(self.posting_blob), lengths, np.full(len(lengths), -1))
+        return docs.astype(np.int32), self.tf_codes
+
+def expand_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenation of ``arange(start, end)`` for every pair."""
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(int(lengths.sum()))
+
+def _segment_cumsum(values: np.ndarray, lengths: np.ndarray, bases: np.ndarray) -> np.ndarray:
+    """Running sum of ``values`` restarted at every segment and offset by its base."""
+    sums = np.cumsum(values)
+    before = np.concatenate(([0], sums))[np.cumsum(lengths) - lengths]
+    return sums + np.repeat(bases - before, lengths)
+
+POSTINGS_FORMATS = {cls.format: cls for cls in (PlainPostings, CompressedPostings)}
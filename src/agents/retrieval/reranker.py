@@ -1,40 +1,144 @@
+import asyncio
 import logging
-from typing import List, Dict, Any
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
 from src.agents.base import BaseAgent
+from src.agents.cross_encoder import CrossEncoderExecutor, close_executor, get_executor
+from src.agents.models import model_registry
+from src.agents.retrieval.analysis import Analyzer
+from src.agents.retrieval.score_cache import RerankScoreCache
+from src.config import settings
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+FIRST_STAGES = ("input", "lexical")
+
 class RerankerAgent(BaseAgent):
     """
     Agent responsible for reranking retrieved documents using a Cross-Encoder.
+    ``inference_backend``: 'torch', 'onnx' or 'onnx-int8' (default: settings.INFERENCE_BACKEND).
+
+    Scores are cached by (model, query, text): ``cache_size`` entries in
+    process (0 disables it) and, with ``cache_redis_url``, in Redis.
+    Only pairs missing from both tiers are run through the model.
+
+    Cascade: with ``max_rerank`` (documents) and/or ``max_rerank_ms`` (a
+    latency budget, also settable per task) a cheap first stage orders the
+    candidates and the cross-encoder scores only the top N. N grows down the
+    first-stage ranking while the uncached pairs fit in the budget, at the
+    executor's measured forward time per pair, and is at least
+    ``min_rerank``. The rest follow in first-stage order with a
+    ``rerank_score`` of -1.0, like documents without text. ``first_stage``:
+    'input' (the incoming order, e.g. fusion rank) or 'lexical' (query term
+    overlap).
+
+    Predictions go through the model's shared ``CrossEncoderExecutor``,
+    which merges the pairs of concurrent requests (``max_wait_ms``,
+    ``max_batch``; the first agent to use a model sets them).
     """
-    def __init__(self, name: str, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
+    def __init__(self, name: str, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                 inference_backend: Optional[str] = None, cache_size: int = 10000,
+                 cache_ttl: Optional[float] = 3600.0, cache_redis_url: Optional[str] = None,
+                 first_stage: str = "input", max_rerank: Optional[int] = None,
+                 max_rerank_ms: Optional[float] = None, min_rerank: int = 10,
+                 max_wait_ms: float = 2.0, max_batch: int = 128):
         super().__init__(name=name)
+        if first_stage not in FIRST_STAGES:
+            raise ValueError(f"Unknown first stage: {first_stage}")
         self.model_name = model_name
+        self.inference_backend = inference_backend or settings.INFERENCE_BACKEND
+        self.first_stage = first_stage
+        self.max_rerank = max_rerank
+        self.max_rerank_ms = max_rerank_ms
+        self.min_rerank = min_rerank
+        self.max_wait_ms = max_wait_ms
+        self.max_batch = max_batch
+        self.analyzer = Analyzer.preset("english")
         self.model = None
+        self.score_cache = RerankScoreCache(f"{model_name}@{self.inference_backend}", max_size=cache_size,
+                                            ttl=cache_ttl, redis_url=cache_redis_url)
         self._load_model()
 
     def _load_model(self):
         """Load Cross-Encoder model."""
         try:
             from sentence_transformers import CrossEncoder
-            self.model = CrossEncoder(self.model_name)
+            self.model = model_registry.acquire(CrossEncoder, self.model_name, backend=self.inference_backend)
             logger.info(f"Loaded Cross-Encoder model: {self.model_name}")
         except ImportError:
             logger.warning("sentence-transformers not installed. Reranking will be skipped.")
         except Exception as e:
             logger.error(f"Failed to load Cross-Encoder model: {e}")
 
+    @property
+    def executor(self) -> CrossEncoderExecutor:
+        return get_executor(self.model, max_wait_ms=self.max_wait_ms, max_batch=self.max_batch)
+
+    def _lexical_scores(self, query: str, texts: List[str]) -> List[float]:
+        terms = set(self.analyzer.analyze_query(query))
+        scores = []
+        for text in texts:
+            tfs = Counter(term for term in self.analyzer.analyze(text) if term in terms)
+            scores.append(sum(tf / (tf + 1.2) for tf in tfs.values()))
+        return scores
+
+    def _first_stage(self, query: str, texts: List[str]) -> List[int]:
+        """Candidate indices, best first."""
+        if self.first_stage == "lexical":
+            scores = self._lexical_scores(query, texts)
+            return sorted(range(len(texts)), key=lambda i: -scores[i])
+        return list(range(len(texts)))
+
+    def _select(self, query: str, texts: List[str], keys: List[str], scores: Dict[str, float],
+                max_rerank: Optional[int], max_rerank_ms: Optional[float]) -> Tuple[List[int], int]:
+        """Candidate indices in first-stage order and how many of them to rerank."""
+        if max_rerank is None and max_rerank_ms is None:
+            return list(range(len(texts))), len(texts)
+        order = self._first_stage(query, texts)
+        selected = 0
+        missing = set()
+        pair_ms = self.executor.pair_ms
+        for i in order:
+            new_miss = keys[i] not in scores and keys[i] not in missing
+            over_count = max_rerank is not None and selected >= max_rerank
+            over_budget = max_rerank_ms is not None and (len(missing) + new_miss) * pair_ms > max_rerank_ms
+            if selected >= self.min_rerank and (over_count or over_budget):
+                break
+            selected += 1
+            if new_miss:
+                missing.add(keys[i])
+        return order, selected
+
+    async def _score(self, query: str, texts: List[str], max_rerank: Optional[int] = None,
+                     max_rerank_ms: Optional[float] = None) -> Tuple[List[int], List[float]]:
+        """
+        Candidate indices in first-stage order and the cross-encoder scores
+        of the leading ones that were reranked. Only cache misses are
+        predicted, batched with concurrent requests by the model's executor.
+        """
+        keys = self.score_cache.keys(query, texts)
+        scores = await asyncio.to_thread(self.score_cache.get_many, keys)
+        order, selected = self._select(query, texts, keys, scores, max_rerank, max_rerank_ms)
+
+        missing = {keys[i]: texts[i] for i in order[:selected] if keys[i] not in scores}
+        if missing:
+            predicted = await self.executor.predict([(query, text) for text in missing.values()])
+            fresh = {key: float(score) for key, score in zip(missing, predicted)}
+            await asyncio.to_thread(self.score_cache.put_many, fresh)
+            scores.update(fresh)
+        return order, [scores[keys[i]] for i in order[:selected]]
+
     async def execute(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """
         Execute reranking.
-        Task format: {'query': str, 'documents': List[Dict], 'top_k': int}
+        Task format: {'query': str, 'documents': List[Dict], 'top_k': int, 'max_rerank_ms': float}
         documents: [{'id': '1', 'text': '...'}, ...]
         """
         query = task.get("query")
         documents = task.get("documents", [])
         top_k = task.get("top_k", len(documents))
+        max_rerank_ms = task.get("max_rerank_ms", self.max_rerank_ms)
         
         if not query or not documents:
             return {"error": "Query and documents required for reranking"}
@@ -45,32 +149,46 @@ class RerankerAgent(BaseAgent):
 
         try:
             # Prepare pairs for cross-encoder
-            pairs = [[query, doc['text']] for doc in documents if 'text' in doc]
+            scored = [doc for doc in documents if 'text' in doc]
             
-            if not pairs:
+            if not scored:
                 return {"status": "success", "results": documents[:top_k]}
                 
-            scores = self.model.predict(pairs)
+            order, scores = await self._score(query, [doc['text'] for doc in scored], self.max_rerank, max_rerank_ms)
             
-            # Attach scores and sort
-            for i, doc in enumerate(documents):
-                if i < len(scores):
-                    doc['rerank_score'] = float(scores[i])
-                else:
+            # Attach scores and sort by rerank_score descending
+            reranked = [scored[i] for i in order[:len(scores)]]
+            for doc, score in zip(reranked, scores):
+                doc['rerank_score'] = score
+            reranked_docs = sorted(reranked, key=lambda x: x['rerank_score'], reverse=True)
+            # Then the candidates the cascade pruned, in first-stage order,
+            # and documents without text
+            for i in order[len(scores):]:
+                scored[i]['rerank_score'] = -1.0
+                reranked_docs.append(scored[i])
+            for doc in documents:
+                if 'text' not in doc:
                     doc['rerank_score'] = -1.0
-            
-            # Sort by rerank_score descending
-            reranked_docs = sorted(documents, key=lambda x: x.get('rerank_score', -1.0), reverse=True)
+                    reranked_docs.append(doc)
             
             return {
                 "status": "success",
                 "results": reranked_docs[:top_k],
-                "count": len(reranked_docs[:top_k])
+                "count": len(reranked_docs[:top_k]),
+                "reranked": len(scores)
             }
             
         except Exception as e:
             logger.error(f"Reranking failed: {e}")
             return {"status": "error", "message": str(e)}
 
+    def close(self):
+        """Release the shared model and the Redis connection."""
+        self.score_cache.close()
+        if self.model is not None:
+            if model_registry.release(self.model):
+                close_executor(self.model)
+            self.model = None
+
 if __name__ == "__main__":
     pass
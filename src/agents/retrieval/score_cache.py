@@ -0,0 +1,77 @@
+import logging
+from typing import Dict, List, Optional, Sequence
+from src.agents.retrieval.cache import TTLCache
+from src.agents.workflow.embedding_cache import text_hash
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class RerankScoreCache:
+    """
+    Cross-encoder scores keyed by (model, normalized query hash, text hash).
+
+    Two tiers: an in-process LRU (``max_size`` entries, ``ttl`` seconds) and,
+    with ``redis_url`` (or ``redis_client``), a Redis tier shared by every
+    process. Redis hits are copied into the local tier. Redis errors are
+    logged and treated as misses.
+    """
+    def __init__(self, model_name: str, max_size: int = 10000, ttl: Optional[float] = 3600.0,
+                 redis_url: Optional[str] = None, redis_client=None, prefix: str = "rerank"):
+        self.model_name = model_name
+        self.ttl = ttl
+        self.prefix = prefix
+        self.local = TTLCache("rerank_score", max_size=max_size, ttl=ttl)
+        if redis_client is None and redis_url:
+            import redis
+            redis_client = redis.Redis.from_url(redis_url)
+        self.redis = redis_client
+        self.redis_hits = 0
+
+    def keys(self, query: str, texts: Sequence[str]) -> List[str]:
+        query_hash = text_hash(query)
+        return [f"{self.prefix}:{self.model_name}:{query_hash}:{text_hash(text)}" for text in texts]
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, float]:
+        scores = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            score = self.local.get(key)
+            if score is None:
+                missing.append(key)
+            else:
+                scores[key] = score
+        if missing and self.redis is not None:
+            try:
+                values = self.redis.mget(missing)
+            except Exception as e:
+                logger.error(f"Rerank cache lookup failed: {e}")
+                return scores
+            for key, value in zip(missing, values):
+                if value is not None:
+                    scores[key] = float(value)
+                    self.local.put(key, scores[key])
+                    self.redis_hits += 1
+        return scores
+
+    def put_many(self, scores: Dict[str, float]):
+        for key, score in scores.items():
+            self.local.put(key, score)
+        if scores and self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                # In milliseconds: whole seconds would truncate a sub-second ttl to 0
+                ttl_ms = None if self.ttl is None else max(1, int(self.ttl * 1000))
+                for key, score in scores.items():
+                    pipe.set(key, repr(score), px=ttl_ms)
+                pipe.execute()
+            except Exception as e:
+                logger.error(f"Rerank cache write failed: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        stats = self.local.stats()
+        stats["redis_hits"] = self.redis_hits
+        return stats
+
+    def close(self):
+        if self.redis is not None:
+            self.redis.close()
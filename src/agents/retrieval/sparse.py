@@ -1,8 +1,12 @@
 import logging
 import pickle
 import os
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Tuple, Union
 from src.agents.base import BaseAgent
+from src.agents.retrieval.analysis import Analyzer, Phrase
+from src.agents.retrieval.bm25_shards import ShardedBM25Index
+from src.agents.retrieval.bm25_store import SegmentedBM25Index
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -11,104 +15,227 @@ class SparseRetrieverAgent(BaseAgent):
     """
     Agent responsible for sparse retrieval using BM25.
     """
-    def __init__(self, name: str, index_path: str = "bm25_index.pkl"):
+    def __init__(self, name: str, index_path: str = "bm25_index", background_merge: bool = True,
+                 refresh_interval: float = 1.0, search_mode: str = "exact",
+                 analyzer: Union[str, Analyzer] = "english", postings_format: str = "plain",
+                 num_shards: int = 1, workers_per_shard: int = 1, positions: bool = False):
         super().__init__(name=name)
         self.index_path = index_path
+        # Used for new indexes; an existing index keeps the analyzer it was built with
+        self.analyzer = Analyzer.preset(analyzer) if isinstance(analyzer, str) else analyzer
+        self.search_mode = search_mode # 'exact' or 'pruned' (MaxScore/block-max; see BM25Index.score_pruned)
+        self.postings_format = postings_format # 'plain' or 'compressed' (delta/varint doc ids, one-byte tfs)
+        # More than one shard scores queries in worker processes, off the event loop
+        self.num_shards = num_shards
+        self.workers_per_shard = workers_per_shard
+        # Store token positions so "phrase" and "proximity"~N queries use the index
+        self.positions = positions
+
+        self.background_merge = background_merge
+        self.refresh_interval = refresh_interval # Seconds between checks for segments written by other processes
         self.bm25 = None
-        self.corpus = [] # List of chunk texts
-        self.chunk_ids = [] # List of chunk IDs corresponding to corpus
+        self._last_refresh = time.monotonic()
         self._load_index()
 
+    def _open_index(self) -> Union[SegmentedBM25Index, ShardedBM25Index]:
+        if self.num_shards > 1:
+            return ShardedBM25Index(self.index_path, num_shards=self.num_shards,
+                                    workers_per_shard=self.workers_per_shard, analyzer=self.analyzer,
+                                    background_merge=self.background_merge, postings_format=self.postings_format,
+                                    positions=self.positions)
+        return SegmentedBM25Index(self.index_path, analyzer=self.analyzer, background_merge=self.background_merge,
+                                  postings_format=self.postings_format, positions=self.positions)
+
+    def _parse_query(self, query: str) -> Tuple[List[str], Tuple[Phrase, ...]]:
+        """Analyse a query with the index's analyzer (cached): its terms and phrase constraints."""
+        tokens, phrases = self.bm25.analyzer.parse_query(query)
+        return list(tokens), phrases
+
     def _load_index(self):
-        """Load BM25 index from disk."""
-        if os.path.exists(self.index_path):
-            try:
-                with open(self.index_path, 'rb') as f:
-                    data = pickle.load(f)
-                    self.bm25 = data['bm25']
-                    self.corpus = data['corpus']
-                    self.chunk_ids = data['chunk_ids']
-                logger.info(f"Loaded BM25 index with {len(self.corpus)} documents.")
-            except Exception as e:
-                logger.error(f"Failed to load BM25 index: {e}")
+        """
+        Load BM25 index from disk. ``self.bm25`` is always left usable: an
+        unreadable index directory is moved aside and replaced by an empty one.
+        """
+        legacy_path = f"{self.index_path}.pkl"
+        backup = None
+        if os.path.isfile(self.index_path):
+            backup = self._set_aside(self.index_path)
+        elif not os.path.exists(self.index_path) and os.path.isfile(legacy_path):
+            # Older releases defaulted to "bm25_index.pkl" next to the new default directory
+            backup = self._set_aside(legacy_path)
+        try:
+            self.bm25 = self._open_index()
+        except Exception as e:
+            logger.error(f"Failed to load BM25 index: {e}")
+            unreadable = f"{self.index_path}.unreadable-{int(time.time())}"
+            os.replace(self.index_path, unreadable)
+            logger.warning(f"Moved the unreadable BM25 index to {unreadable}; starting with an empty index.")
+            self.bm25 = self._open_index()
+        if self.bm25.segments:
+            logger.info(f"Loaded BM25 index with {self.bm25.num_docs} documents.")
+            return
+        if backup is None:
+            # A migration that failed before committing left its pickle aside
+            backup = next((path for path in (f"{self.index_path}.bak", f"{legacy_path}.bak")
+                           if os.path.isfile(path)), None)
+        if backup is not None:
+            self._migrate_legacy_index(backup)
         else:
             logger.info("No existing BM25 index found.")
 
-    def save_index(self):
-        """Save BM25 index to disk."""
+    @staticmethod
+    def _set_aside(legacy_path: str) -> str:
+        # Moved aside first: the index directory may take the pickle's name
+        backup = f"{legacy_path}.bak"
+        os.replace(legacy_path, backup)
+        return backup
+
+    def _migrate_legacy_index(self, backup: str):
+        """
+        Rewrite a pickled index from older releases (set aside as ``backup``)
+        into the empty segmented index. The pickle is deleted once the new
+        index is committed; a failed migration is retried on the next start.
+        """
         try:
-            with open(self.index_path, 'wb') as f:
-                pickle.dump({
-                    'bm25': self.bm25,
-                    'corpus': self.corpus,
-                    'chunk_ids': self.chunk_ids
-                }, f)
-            logger.info("Saved BM25 index.")
+            with open(backup, 'rb') as f:
+                data = pickle.load(f)
+            documents = [{'id': chunk_id, 'text': text} for chunk_id, text in zip(data['chunk_ids'], data['corpus'])]
+            self.bm25.rebuild(documents, analyzer=self.analyzer)
+            os.remove(backup)
+            logger.warning(f"Migrated legacy pickled BM25 index with {len(documents)} documents.")
         except Exception as e:
-            logger.error(f"Failed to save BM25 index: {e}")
+            logger.error(f"Failed to migrate legacy BM25 index (kept at {backup}): {e}")
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if now - self._last_refresh >= self.refresh_interval:
+            self._last_refresh = now
+            self.bm25.refresh()
 
     def index_documents(self, documents: List[Dict[str, str]]):
         """
-        Build BM25 index from documents.
+        Build BM25 index from documents, replacing any existing index.
+        The rebuilt index uses this agent's analyzer.
         documents: List of {'id': str, 'text': str}
         """
         try:
-            from rank_bm25 import BM25Okapi
-            
-            self.chunk_ids = [doc['id'] for doc in documents]
-            self.corpus = [doc['text'] for doc in documents]
-            
-            # Simple tokenization
-            tokenized_corpus = [doc.lower().split() for doc in self.corpus]
-            
-            self.bm25 = BM25Okapi(tokenized_corpus)
-            self.save_index()
+            self.bm25.rebuild(documents, analyzer=self.analyzer)
             logger.info(f"Indexed {len(documents)} documents.")
-            
-        except ImportError:
-            logger.error("rank-bm25 not installed.")
         except Exception as e:
             logger.error(f"Indexing failed: {e}")
 
+    def add_documents(self, documents: List[Dict[str, str]]):
+        """
+        Add documents without rebuilding the index.
+        documents: List of {'id': str, 'text': str}
+        """
+        try:
+            self.bm25.add_documents(documents)
+            logger.info(f"Added {len(documents)} documents.")
+        except Exception as e:
+            logger.error(f"Adding documents failed: {e}")
+
+    def update_documents(self, documents: List[Dict[str, str]]):
+        """
+        Replace the indexed version of documents.
+        documents: List of {'id': str, 'text': str}
+        """
+        try:
+            self.bm25.update_documents(documents)
+            logger.info(f"Updated {len(documents)} documents.")
+        except Exception as e:
+            logger.error(f"Updating documents failed: {e}")
+
+    def delete_documents(self, chunk_ids: List[str]):
+        """Remove documents by chunk ID."""
+        try:
+            deleted = self.bm25.delete_documents(chunk_ids)
+            logger.info(f"Deleted {deleted} documents.")
+        except Exception as e:
+            logger.error(f"Deleting documents failed: {e}")
+
     async def execute(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """
         Execute sparse retrieval.
-        Task format: {'query': str, 'top_k': int}
+        Task format: {'query': str, 'top_k': int, 'mode': 'exact' | 'pruned'}
+                  or {'queries': List[str], 'top_k': int} for a batch (see execute_batch).
+        A query may hold "exact phrases" and "proximity terms"~N, which
+        every result must match; on an index without positions a phrase
+        too common to check returns an error.
         """
+        if "queries" in task:
+            return await self.execute_batch(task)
+
         query = task.get("query")
         top_k = task.get("top_k", 5)
-        
+        mode = task.get("mode", self.search_mode)
+
         if not query:
             return {"error": "No query provided"}
-            
-        if not self.bm25:
+
+        if self.bm25:
+            self._maybe_refresh()
+        if not self.bm25 or not self.bm25.segments:
             return {"error": "BM25 index not initialized"}
 
         try:
-            tokenized_query = query.lower().split()
-            scores = self.bm25.get_scores(tokenized_query)
-            
-            # Get top_k indices
-            top_n = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
-            
-            results = []
-            for i in top_n:
-                if scores[i] > 0: # Only return relevant results
-                    results.append({
-                        "id": self.chunk_ids[i],
-                        "text": self.corpus[i],
-                        "score": scores[i]
-                    })
-                
+            tokens, phrases = self._parse_query(query)
+            if isinstance(self.bm25, ShardedBM25Index):
+                results = await self.bm25.search_async(tokens, top_k, mode=mode, phrases=phrases)
+            else:
+                results = self.bm25.search(tokens, top_k, mode=mode, phrases=phrases)
+
             return {
                 "status": "success",
                 "results": results,
                 "count": len(results)
             }
-            
+
         except Exception as e:
             logger.error(f"Sparse retrieval failed: {e}")
             return {"status": "error", "message": str(e)}
 
+    async def execute_batch(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Execute sparse retrieval for several queries in one pass, e.g. the
+        expanded_queries of QueryAnalyzerAgent or an offline evaluation set.
+        Task format: {'queries': List[str], 'top_k': int}
+        Returns one result list per query, in input order.
+        """
+        queries = task.get("queries")
+        top_k = task.get("top_k", 5)
+
+        if not queries:
+            return {"error": "No queries provided"}
+
+        if self.bm25:
+            self._maybe_refresh()
+        if not self.bm25 or not self.bm25.segments:
+            return {"error": "BM25 index not initialized"}
+
+        try:
+            parsed = [self._parse_query(query) for query in queries]
+            tokenized = [tokens for tokens, _ in parsed]
+            phrases = [query_phrases for _, query_phrases in parsed]
+            if isinstance(self.bm25, ShardedBM25Index):
+                results = await self.bm25.search_batch_async(tokenized, top_k, phrases=phrases)
+            else:
+                results = self.bm25.search_batch(tokenized, top_k, phrases=phrases)
+
+            return {
+                "status": "success",
+                "results": results,
+                "count": len(results)
+            }
+
+        except Exception as e:
+            logger.error(f"Batch sparse retrieval failed: {e}")
+            return {"status": "error", "message": str(e)}
+
+    def close(self):
+        """Stop shard worker processes, if any."""
+        if isinstance(self.bm25, ShardedBM25Index):
+            self.bm25.close()
+
 if __name__ == "__main__":
     pass
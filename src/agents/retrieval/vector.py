@@ -1,38 +1,118 @@
 import logging
+import unicodedata
 from typing import List, Dict, Any, Optional
-from qdrant_client import QdrantClient
+import numpy as np
+from qdrant_client import AsyncQdrantClient
 from src.agents.base import BaseAgent
+from src.agents.batching import MicroBatcher
+from src.agents.models import model_registry
+from src.config import settings
+from src.agents.retrieval.cache import TTLCache
+from src.agents.retrieval.vector_backends import LocalVectorBackend, QdrantVectorBackend, VectorBackend, Vectors
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# One async client (and connection pool) per Qdrant URL, shared by all agents
+_clients: Dict[str, AsyncQdrantClient] = {}
+
+def get_async_client(url: str) -> AsyncQdrantClient:
+    client = _clients.get(url)
+    if client is None:
+        client = _clients[url] = AsyncQdrantClient(url=url)
+    return client
+
+async def close_async_clients():
+    """Close the shared Qdrant connections (on application shutdown)."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.close()
+
 class VectorRetrieverAgent(BaseAgent):
     """
     Agent responsible for dense vector retrieval using Qdrant.
+    Never blocks the event loop: Qdrant is queried through the shared async
+    client and query encoding runs in a worker thread.
+
+    backend: 'qdrant', or an in-process index persisted at ``index_path``
+    (no service needed): 'exact' (matmul over all vectors) or 'hnsw'
+    (approximate graph search). ``vector_dtype`` ('float32' or 'float16')
+    sets how a new in-process index stores vectors. ``max_wait_ms`` and
+    ``max_batch`` bound the micro-batches query encoding is grouped into.
     """
-    def __init__(self, name: str, qdrant_url: str = "http://localhost:6333", collection_name: str = "chunks"):
+    def __init__(self, name: str, qdrant_url: str = "http://localhost:6333", collection_name: str = "chunks",
+                 model_name: str = "all-MiniLM-L6-v2", cache_size: int = 10000, cache_ttl: Optional[float] = 3600.0,
+                 backend: str = "qdrant", index_path: str = "vector_index", vector_dtype: str = "float32",
+                 max_wait_ms: float = 5.0, max_batch: int = 64, inference_backend: Optional[str] = None):
         super().__init__(name=name)
-        self.client = QdrantClient(url=qdrant_url)
         self.collection_name = collection_name
+        self.client = None
+        if backend == "qdrant":
+            self.client = get_async_client(qdrant_url)
+            self.backend: VectorBackend = QdrantVectorBackend(self.client, collection_name)
+        elif backend in ("exact", "hnsw"):
+            self.backend = LocalVectorBackend(index_path, mode=backend, dtype=vector_dtype)
+        else:
+            raise ValueError(f"Unknown vector backend: {backend}")
+        self.model_name = model_name
+        # Should match the EmbeddingAgent that embedded the collection
+        self.inference_backend = inference_backend or settings.INFERENCE_BACKEND
         self.model = None
+        # Query embeddings keyed by (model, normalized query); cache_size=0 disables it
+        self.query_cache = TTLCache("query_embedding", max_size=cache_size, ttl=cache_ttl)
+        # Cache misses of concurrent requests share one encode call
+        self.batcher = MicroBatcher(self._encode, max_wait_ms=max_wait_ms, max_batch=max_batch, name=name)
         self._load_embedding_model()
 
     def _load_embedding_model(self):
         """Load embedding model (sentence-transformers)."""
         try:
             from sentence_transformers import SentenceTransformer
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
-            logger.info("Loaded embedding model: all-MiniLM-L6-v2")
+            self.model = model_registry.acquire(SentenceTransformer, self.model_name, backend=self.inference_backend)
+            logger.info(f"Loaded embedding model: {self.model_name}")
         except ImportError:
             logger.warning("sentence-transformers not installed. Vector retrieval will fail without embeddings.")
         except Exception as e:
             logger.error(f"Failed to load embedding model: {e}")
 
+    def _encode(self, queries: List[str]):
+        return self.model.encode(queries)
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        # Unicode and whitespace variants of a query embed the same way
+        return " ".join(unicodedata.normalize("NFKC", query).split())
+
+    async def _embed_queries(self, queries: List[str]) -> List[np.ndarray]:
+        """
+        Query embeddings (float32 arrays), served from the cache when a query
+        was seen recently.
+        Cache misses are encoded by the micro-batcher's worker thread, together
+        with those of other concurrent requests.
+        """
+        keys = [(self.model_name, self._normalize_query(query)) for query in queries]
+        vectors = {key: self.query_cache.get(key) for key in dict.fromkeys(keys)}
+        missing = [key for key, vector in vectors.items() if vector is None]
+        if missing:
+            encoded = await self.batcher.run([key[1] for key in missing])
+            for key, vector in zip(missing, encoded):
+                vector = np.array(vector, dtype=np.float32)
+                # Shared by every request that hits the cache
+                vector.flags.writeable = False
+                vectors[key] = vector
+                self.query_cache.put(key, vector)
+        return [vectors[key] for key in keys]
+
     async def execute(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """
         Execute retrieval task.
         Task format: {'query': str, 'top_k': int, 'filters': dict}
+        or {'queries': List[str], 'top_k': int} for a batch (see execute_batch).
         """
+        if "queries" in task:
+            return await self.execute_batch(task)
+
         query = task.get("query")
         top_k = task.get("top_k", 5)
         filters = task.get("filters", {})
@@ -45,23 +125,10 @@ class VectorRetrieverAgent(BaseAgent):
 
         try:
             # Generate embedding
-            query_vector = self.model.encode(query).tolist()
+            query_vector = (await self._embed_queries([query]))[0]
             
             # Search in Qdrant
-            search_result = self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_vector,
-                limit=top_k,
-                # query_filter=... (implement filter logic if needed)
-            )
-            
-            results = []
-            for hit in search_result:
-                results.append({
-                    "id": hit.id,
-                    "score": hit.score,
-                    "payload": hit.payload
-                })
+            results = (await self.backend.search([query_vector], top_k))[0]
                 
             return {
                 "status": "success",
@@ -73,6 +140,67 @@ class VectorRetrieverAgent(BaseAgent):
             logger.error(f"Vector retrieval failed: {e}")
             return {"status": "error", "message": str(e)}
 
+    async def execute_batch(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Execute retrieval for several queries (e.g. the expanded_queries of
+        QueryAnalyzerAgent) with one encode call and one Qdrant request.
+        Task format: {'queries': List[str], 'top_k': int}
+        Returns one result list per query, in input order, plus 'merged':
+        the union of all hits, de-duplicated by id with the best score kept.
+        """
+        queries = task.get("queries")
+        top_k = task.get("top_k", 5)
+
+        if not queries:
+            return {"error": "No queries provided"}
+
+        if not self.model:
+            return {"error": "Embedding model not loaded"}
+
+        try:
+            vectors = await self._embed_queries(queries)
+            # Identical variants are searched once
+            unique = {vector.tobytes(): i for i, vector in reversed(list(enumerate(vectors)))}
+            responses = await self.backend.search([vectors[i] for i in unique.values()], top_k)
+            hits = dict(zip(unique, responses))
+            results = [hits[vector.tobytes()] for vector in vectors]
+
+            merged: Dict[Any, Dict[str, Any]] = {}
+            for result in results:
+                for hit in result:
+                    if hit["id"] not in merged or hit["score"] > merged[hit["id"]]["score"]:
+                        merged[hit["id"]] = hit
+
+            return {
+                "status": "success",
+                "results": results,
+                "merged": sorted(merged.values(), key=lambda hit: hit["score"], reverse=True),
+                "count": len(results)
+            }
+
+        except Exception as e:
+            logger.error(f"Batch vector retrieval failed: {e}")
+            return {"status": "error", "message": str(e)}
+
+    async def upsert(self, ids: List[Any], vectors: Vectors,
+                     payloads: Optional[List[Optional[Dict[str, Any]]]] = None) -> Dict[str, Any]:
+        """Store points (e.g. EmbeddingAgent output) in the configured backend."""
+        try:
+            await self.backend.upsert(ids, vectors, payloads)
+            return {"status": "success", "count": len(ids)}
+        except Exception as e:
+            logger.error(f"Vector upsert failed: {e}")
+            return {"status": "error", "message": str(e)}
+
+    def close(self):
+        """Stop the batcher, save a local index and release the shared model."""
+        self.batcher.close()
+        if isinstance(self.backend, LocalVectorBackend):
+            self.backend.close()
+        if self.model is not None:
+            model_registry.release(self.model)
+            self.model = None
+
 if __name__ == "__main__":
     # Test stub
     pass
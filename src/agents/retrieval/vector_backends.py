@@ -0,0 +1,199 @@
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Union
+import numpy as np
+from qdrant_client import AsyncQdrantClient, models
+from src.agents.retrieval.vector_index import LocalVectorIndex
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+Vectors = Union[np.ndarray, Sequence[Sequence[float]]]
+
+class VectorBackend(ABC):
+    """
+    Vector store queried by VectorRetrieverAgent.
+    Vectors are float arrays (or lists), one row per vector.
+    """
+
+    @abstractmethod
+    async def search(self, vectors: Vectors, top_k: int) -> List[List[Dict[str, Any]]]:
+        """
+        Nearest neighbours of each vector, best first.
+        Returns one list of {'id', 'score', 'payload'} per vector.
+        """
+        pass
+
+    @abstractmethod
+    async def upsert(self, ids: Sequence[Any], vectors: Vectors,
+                     payloads: Optional[Sequence[Optional[Dict[str, Any]]]] = None):
+        """Insert or replace points by id."""
+        pass
+
+    async def flush(self):
+        """Persist the upserts made so far (stores that persist every write need nothing)."""
+        pass
+
+    @contextlib.asynccontextmanager
+    async def deferred_flush(self):
+        """
+        Bulk writes: upserts inside the block need not be persisted one by
+        one; everything is flushed when it exits.
+        """
+        try:
+            yield self
+        finally:
+            await self.flush()
+
+def _as_list(vector) -> List[float]:
+    # The Qdrant request models take plain lists
+    return vector.tolist() if isinstance(vector, np.ndarray) else list(vector)
+
+def qdrant_point_id(point_id: Any) -> Any:
+    """
+    Qdrant only accepts unsigned integers and UUIDs as point ids; other ids
+    (e.g. chunk ids) map to a stable UUID derived from them.
+    """
+    if isinstance(point_id, int) and point_id >= 0:
+        return point_id
+    try:
+        return str(uuid.UUID(str(point_id)))
+    except ValueError:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, str(point_id)))
+
+def format_hits(points) -> List[Dict[str, Any]]:
+    """
+    Hits keyed by chunk id: points store it in their payload, as their own
+    id may be a UUID derived from it (see ``qdrant_point_id``).
+    """
+    results = []
+    seen = set()
+    for hit in points:
+        doc_id = (hit.payload or {}).get("chunk_id", hit.id)
+        # A point can come back more than once, e.g. from multi-vector collections
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        results.append({
+            "id": doc_id,
+            "score": hit.score,
+            "payload": hit.payload
+        })
+    return results
+
+class QdrantVectorBackend(VectorBackend):
+    """A Qdrant collection, queried through the async client."""
+
+    def __init__(self, client: AsyncQdrantClient, collection_name: str):
+        self.client = client
+        self.collection_name = collection_name
+
+    async def search(self, vectors: Vectors, top_k: int) -> List[List[Dict[str, Any]]]:
+        if len(vectors) == 1:
+            response = await self.client.query_points(
+                collection_name=self.collection_name,
+                query=_as_list(vectors[0]),
+                limit=top_k,
+                with_payload=True,
+                # query_filter=... (implement filter logic if needed)
+            )
+            return [format_hits(response.points)]
+        responses = await self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[models.QueryRequest(query=_as_list(vector), limit=top_k, with_payload=True) for vector in vectors],
+        )
+        return [format_hits(response.points) for response in responses]
+
+    async def upsert(self, ids: Sequence[Any], vectors: Vectors,
+                     payloads: Optional[Sequence[Optional[Dict[str, Any]]]] = None):
+        payloads = payloads or [None] * len(ids)
+        await self.client.upsert(
+            collection_name=self.collection_name,
+            points=[models.PointStruct(id=qdrant_point_id(point_id), vector=_as_list(vector), payload=payload)
+                    for point_id, vector, payload in zip(ids, vectors, payloads)],
+        )
+
+class LocalVectorBackend(VectorBackend):
+    """
+    An in-process ``LocalVectorIndex`` persisted at ``path``.
+    Searches and writes run in worker threads, one at a time (HNSW inserts
+    update the graph in place). Saving rewrites the whole index, so with
+    ``autosave`` writes are saved before they return, except inside
+    ``deferred_flush`` (bulk loads); otherwise they are saved by ``flush``
+    and ``close``.
+    """
+    def __init__(self, path: str, mode: str = "exact", dtype: str = "float32", autosave: bool = True,
+                 **index_options):
+        self.path = path
+        self.mode = mode
+        self.dtype = dtype
+        self.autosave = autosave
+        self.index_options = index_options
+        self.index: Optional[LocalVectorIndex] = None
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._deferred = 0
+        if os.path.exists(os.path.join(path, "meta.json")):
+            self.index = LocalVectorIndex.open(path)
+            if (self.index.mode, self.index.dtype) != (mode, dtype):
+                logger.warning(f"Vector index at {path} is {self.index.mode}/{self.index.dtype}; "
+                               f"ignoring {mode}/{dtype}")
+            logger.info(f"Loaded local vector index with {len(self.index)} vectors.")
+
+    def _search(self, vectors: Vectors, top_k: int) -> List[List[Dict[str, Any]]]:
+        with self._lock:
+            index = self.index
+            if index is None:
+                return [[] for _ in vectors]
+            return [
+                [{"id": index.ids[row], "score": score, "payload": index.payloads[row]} for row, score in hits]
+                for hits in index.search(np.asarray(vectors, dtype=np.float32), top_k)
+            ]
+
+    async def search(self, vectors: Vectors, top_k: int) -> List[List[Dict[str, Any]]]:
+        return await asyncio.to_thread(self._search, vectors, top_k)
+
+    def _upsert(self, ids: Sequence[Any], vectors: Vectors,
+                payloads: Optional[Sequence[Optional[Dict[str, Any]]]]):
+        with self._lock:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            if self.index is None:
+                self.index = LocalVectorIndex(vectors.shape[1], mode=self.mode, dtype=self.dtype, **self.index_options)
+            self.index.add(list(ids), vectors, payloads)
+            self._dirty = True
+            if self.autosave and not self._deferred:
+                self._save()
+
+    async def upsert(self, ids: Sequence[Any], vectors: Vectors,
+                     payloads: Optional[Sequence[Optional[Dict[str, Any]]]] = None):
+        await asyncio.to_thread(self._upsert, ids, vectors, payloads)
+
+    def _save(self):
+        if self._dirty and self.index is not None:
+            self.index.save(self.path)
+            self._dirty = False
+
+    def _flush(self):
+        with self._lock:
+            self._save()
+
+    async def flush(self):
+        await asyncio.to_thread(self._flush)
+
+    @contextlib.asynccontextmanager
+    async def deferred_flush(self):
+        self._deferred += 1
+        try:
+            yield self
+        finally:
+            self._deferred -= 1
+            await self.flush()
+
+    def close(self):
+        """Save any unsaved writes."""
+        self._flush()
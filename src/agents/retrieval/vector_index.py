@@ -0,0 +1,365 @@
+import heapq
+import json
+import logging
+import math
+import os
+import shutil
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = "shapeshifter-vectors"
+INDEX_VERSION = 1
+MODES = ("exact", "hnsw")
+DTYPES = ("float32", "float16")
+
+class LocalVectorIndex:
+    """
+    In-process cosine-similarity vector index, a stand-in for a Qdrant
+    collection in dev, CI and edge deployments.
+
+    Vectors are L2-normalised and kept as one float32 or float16 matrix, so
+    scores equal Qdrant's cosine scores. ``exact`` mode scores queries with a
+    chunked matmul over the (memory-mapped) matrix. ``hnsw`` mode also keeps
+    a hierarchical navigable small world graph and answers queries with a
+    beam search of width ``ef_search``.
+
+    Re-adding an id tombstones its previous vector; tombstoned rows are never
+    returned. ``save`` writes a versioned directory (dropping tombstoned rows
+    in exact mode) and ``open`` maps it back read-only.
+    """
+    def __init__(self, dim: int, mode: str = "exact", dtype: str = "float32", m: int = 16,
+                 ef_construction: int = 100, ef_search: int = 64, seed: int = 0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown vector index mode: {mode}")
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        self.dim = dim
+        self.mode = mode
+        self.dtype = dtype
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self.vectors = np.zeros((0, dim), dtype=dtype)
+        # Spare capacity behind ``vectors`` (a view of its first rows) for appends
+        self._buffer: Optional[np.ndarray] = None
+        self.deleted = np.zeros(0, dtype=bool)
+        self.ids: List[Any] = []
+        self.payloads: List[Optional[Dict[str, Any]]] = []
+        self._rows: Dict[Any, int] = {}
+        # HNSW: per level, node -> neighbour list (mutable) or (nodes, padded neighbours) arrays (opened)
+        self._graph: List[Dict[int, List[int]]] = []
+        self._frozen: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None
+        self.levels = np.zeros(0, dtype=np.int8)
+        self.entry = -1
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        return len(self.ids) - int(self.deleted.sum())
+
+    # ---- Writes ----
+
+    def add(self, ids: Sequence[Any], vectors: np.ndarray, payloads: Optional[Sequence[Optional[Dict[str, Any]]]] = None):
+        """Add (or replace) vectors by id."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = (vectors / np.where(norms > 0, norms, 1.0)).astype(self.dtype)
+        payloads = list(payloads) if payloads is not None else [None] * len(ids)
+
+        deleted = np.array(self.deleted, dtype=bool)
+        for point_id in ids:
+            row = self._rows.pop(point_id, None)
+            if row is not None:
+                deleted[row] = True
+        start = len(self.ids)
+        self._append_vectors(vectors)
+        self.deleted = np.concatenate([deleted, np.zeros(len(ids), dtype=bool)])
+        for offset, (point_id, payload) in enumerate(zip(ids, payloads)):
+            self.ids.append(point_id)
+            self.payloads.append(payload)
+            # The last version of an id in a batch wins
+            previous = self._rows.get(point_id)
+            if previous is not None:
+                self.deleted[previous] = True
+            self._rows[point_id] = start + offset
+
+        if self.mode == "hnsw":
+            self._thaw()
+            self.levels = np.concatenate([self.levels, self._random_levels(len(ids))])
+            for node in range(start, len(self.ids)):
+                self._insert(node)
+
+    def _append_vectors(self, vectors: np.ndarray):
+        # Grown geometrically, so a stream of small adds copies each row a bounded number of times
+        n = len(self.vectors)
+        if self._buffer is None or self.vectors.base is not self._buffer or len(self._buffer) < n + len(vectors):
+            buffer = np.empty((max(n + len(vectors), n * 3 // 2, 1024), self.dim), dtype=self.dtype)
+            buffer[:n] = self.vectors
+            self._buffer = buffer
+        self._buffer[n:n + len(vectors)] = vectors
+        self.vectors = self._buffer[:n + len(vectors)]
+
+    def delete(self, ids: Sequence[Any]) -> int:
+        """Tombstone vectors by id. Returns the number deleted."""
+        self.deleted = np.array(self.deleted, dtype=bool)
+        deleted = 0
+        for point_id in ids:
+            row = self._rows.pop(point_id, None)
+            if row is not None:
+                self.deleted[row] = True
+                deleted += 1
+        return deleted
+
+    # ---- Queries ----
+
+    def search(self, queries: np.ndarray, top_k: int) -> List[List[Tuple[int, float]]]:
+        """Best ``top_k`` (row, cosine score) pairs per query, best first."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1.0)
+        if not len(self) or top_k <= 0:
+            return [[] for _ in queries]
+        if self.mode == "hnsw":
+            return [self._search_hnsw(query, top_k) for query in queries]
+        return self._search_exact(queries, top_k)
+
+    def _search_exact(self, queries: np.ndarray, top_k: int, chunk: int = 65536) -> List[List[Tuple[int, float]]]:
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.ids), chunk):
+            block = np.asarray(self.vectors[start:start + chunk], dtype=np.float32)
+            scores = queries @ block.T
+            scores[:, np.asarray(self.deleted[start:start + chunk])] = -np.inf
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            if scores.shape[1] > top_k:
+                keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores, best_rows = scores, rows
+        results = []
+        for rows, scores in zip(best_rows, best_scores):
+            order = np.lexsort((rows, -scores))
+            results.append([(int(rows[i]), float(scores[i])) for i in order if np.isfinite(scores[i])])
+        return results
+
+    # ---- HNSW ----
+
+    def _similarities(self, query: np.ndarray, nodes: Sequence[int]) -> np.ndarray:
+        return np.asarray(self.vectors[np.asarray(nodes, dtype=np.int64)], dtype=np.float32) @ query
+
+    def _neighbors(self, level: int, node: int) -> Sequence[int]:
+        if self._frozen is None:
+            return self._graph[level].get(node, ())
+        nodes, neighbors = self._frozen[level]
+        row = int(np.searchsorted(nodes, node))
+        if row >= len(nodes) or nodes[row] != node:
+            return ()
+        return neighbors[row][neighbors[row] >= 0]
+
+    def _search_layer(self, query: np.ndarray, entry_points: List[int], ef: int, level: int) -> List[Tuple[float, int]]:
+        """Beam search of one layer: up to ``ef`` (similarity, node) pairs, unordered."""
+        visited = set(entry_points)
+        sims = self._similarities(query, entry_points)
+        candidates = [(-float(s), node) for s, node in zip(sims, entry_points)]
+        heapq.heapify(candidates)
+        results = [(float(s), node) for s, node in zip(sims, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if -neg_sim < results[0][0] and len(results) >= ef:
+                break
+            fresh = [n for n in self._neighbors(level, node) if n not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for sim, n in zip(self._similarities(query, fresh), fresh):
+                sim = float(sim)
+                if len(results) < ef or sim > results[0][0]:
+                    heapq.heappush(candidates, (-sim, n))
+                    heapq.heappush(results, (sim, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return results
+
+    def _select_neighbors(self, candidates: List[Tuple[float, int]], m: int) -> List[int]:
+        """
+        HNSW's neighbour selection heuristic: prefer candidates closer to the
+        base than to any neighbour already selected, to keep the graph navigable.
+        """
+        candidates = sorted(candidates, reverse=True)
+        if len(candidates) <= m:
+            return [node for _, node in candidates]
+        nodes = [node for _, node in candidates]
+        sims = np.array([sim for sim, _ in candidates])
+        vectors = np.asarray(self.vectors[np.asarray(nodes)], dtype=np.float32)
+        pairwise = vectors @ vectors.T
+        # Similarity of every candidate to its closest selected neighbour so far
+        closest = np.full(len(nodes), -np.inf)
+        selected: List[int] = []
+        for i in range(len(nodes)):
+            if closest[i] < sims[i]:
+                selected.append(i)
+                if len(selected) == m:
+                    break
+                np.maximum(closest, pairwise[i], out=closest)
+        if len(selected) < m:
+            # Top up with the closest pruned candidates
+            chosen = set(selected)
+            selected += [i for i in range(len(nodes)) if i not in chosen][:m - len(selected)]
+        return [nodes[i] for i in selected]
+
+    def _random_levels(self, count: int) -> np.ndarray:
+        # Exponentially decaying layer occupancy, as in the HNSW paper (mL = 1 / ln M)
+        return np.floor(-np.log(1.0 - self._rng.random(count)) / math.log(self.m)).astype(np.int8)
+
+    def _insert(self, node: int):
+        level = int(self.levels[node])
+        while len(self._graph) <= level:
+            self._graph.append({})
+        for lvl in range(level + 1):
+            self._graph[lvl][node] = []
+        if self.entry < 0:
+            self.entry = node
+            return
+
+        query = np.asarray(self.vectors[node], dtype=np.float32)
+        top = int(self.levels[self.entry])
+        entry_points = [self.entry]
+        for lvl in range(top, level, -1):
+            entry_points = [max(self._search_layer(query, entry_points, 1, lvl))[1]]
+        for lvl in range(min(level, top), -1, -1):
+            found = self._search_layer(query, entry_points, self.ef_construction, lvl)
+            found = [(sim, n) for sim, n in found if n != node]
+            max_links = 2 * self.m if lvl == 0 else self.m
+            neighbors = self._select_neighbors(found, self.m)
+            self._graph[lvl][node] = neighbors
+            for n in neighbors:
+                links = self._graph[lvl][n]
+                links.append(node)
+                if len(links) > max_links:
+                    base = np.asarray(self.vectors[n], dtype=np.float32)
+                    sims = self._similarities(base, links)
+                    self._graph[lvl][n] = self._select_neighbors(list(zip(sims.tolist(), links)), max_links)
+            entry_points = [n for _, n in found] or entry_points
+        if level > top:
+            self.entry = node
+
+    def _search_hnsw(self, query: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        entry_points = [self.entry]
+        for lvl in range(int(self.levels[self.entry]), 0, -1):
+            entry_points = [max(self._search_layer(query, entry_points, 1, lvl))[1]]
+        # Widen the beam by the tombstones so deleted nodes do not crowd out results
+        ef = max(self.ef_search, top_k) + min(int(self.deleted.sum()), 4 * top_k)
+        found = self._search_layer(query, entry_points, ef, 0)
+        found = sorted(((sim, n) for sim, n in found if not self.deleted[n]), key=lambda x: (-x[0], x[1]))
+        return [(n, sim) for sim, n in found[:top_k]]
+
+    def _thaw(self):
+        """Turn an opened (array) graph back into mutable neighbour lists."""
+        if self._frozen is None:
+            return
+        self._graph = []
+        for nodes, neighbors in self._frozen:
+            self._graph.append({int(node): [int(n) for n in row[row >= 0]] for node, row in zip(nodes, neighbors)})
+        self._frozen = None
+        self.levels = np.array(self.levels, dtype=np.int8)
+
+    def _freeze(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if self._frozen is not None:
+            return self._frozen
+        frozen = []
+        for lvl, graph in enumerate(self._graph):
+            nodes = np.array(sorted(graph), dtype=np.int64)
+            width = 2 * self.m if lvl == 0 else self.m
+            neighbors = np.full((len(nodes), width), -1, dtype=np.int32)
+            for row, node in enumerate(nodes):
+                links = graph[int(node)][:width]
+                neighbors[row, :len(links)] = links
+            frozen.append((nodes, neighbors))
+        return frozen
+
+    # ---- Persistence ----
+
+    def save(self, path: str):
+        """Write the index as a directory, swapped in atomically."""
+        if self.mode == "exact" and self.deleted.any():
+            # Exact mode has no graph to renumber, so tombstones are dropped
+            live = np.flatnonzero(~np.asarray(self.deleted))
+            self.vectors = np.asarray(self.vectors)[live]
+            self.ids = [self.ids[i] for i in live]
+            self.payloads = [self.payloads[i] for i in live]
+            self.deleted = np.zeros(len(live), dtype=bool)
+            self._rows = {point_id: row for row, point_id in enumerate(self.ids)}
+
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        arrays = {"vectors": self.vectors, "deleted": self.deleted}
+        if self.mode == "hnsw":
+            arrays["levels"] = self.levels
+            for lvl, (nodes, neighbors) in enumerate(self._freeze()):
+                arrays[f"graph{lvl}_nodes"] = nodes
+                arrays[f"graph{lvl}"] = neighbors
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(tmp_path, "points.json"), "w") as f:
+            json.dump({"ids": self.ids, "payloads": self.payloads}, f)
+        meta = {
+            "format": INDEX_FORMAT,
+            "version": INDEX_VERSION,
+            "mode": self.mode,
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "m": self.m,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "seed": self.seed,
+            "count": len(self.ids),
+            "entry": self.entry,
+            "graph_levels": len(self._freeze()) if self.mode == "hnsw" else 0,
+        }
+        # meta.json is written last: an index without it is incomplete
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        old_path = f"{path}.old"
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def open(cls, path: str) -> "LocalVectorIndex":
+        """Open an index directory with its arrays memory-mapped read-only."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("format") != INDEX_FORMAT:
+            raise ValueError(f"{path} is not a vector index")
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported vector index version {meta.get('version')} (expected {INDEX_VERSION})")
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        index = cls(meta["dim"], mode=meta["mode"], dtype=meta["dtype"], m=meta["m"],
+                    ef_construction=meta["ef_construction"], ef_search=meta["ef_search"], seed=meta["seed"])
+        index.vectors = load("vectors")
+        index.deleted = load("deleted")
+        with open(os.path.join(path, "points.json")) as f:
+            points = json.load(f)
+        index.ids, index.payloads = points["ids"], points["payloads"]
+        index._rows = {point_id: row for row, point_id in enumerate(index.ids) if not index.deleted[row]}
+        if index.mode == "hnsw":
+            index.levels = load("levels")
+            index.entry = meta["entry"]
+            index._frozen = [(load(f"graph{lvl}_nodes"), load(f"graph{lvl}")) for lvl in range(meta["graph_levels"])]
+            # Levels drawn after reopening must not repeat the ones already used
+            index._rng = np.random.default_rng([meta["seed"], meta["count"]])
+        return index
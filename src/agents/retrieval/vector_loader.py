@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
+from src.agents.retrieval.vector_backends import VectorBackend
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+Record = Tuple[Any, Any, Optional[Dict[str, Any]]]
+
+CHECKPOINT_FORMAT = "shapeshifter-vector-load"
+
+async def _aiter(records: Union[Iterable[Record], AsyncIterator[Record]]) -> AsyncIterator[Record]:
+    if hasattr(records, "__aiter__"):
+        async for record in records:
+            yield record
+    else:
+        for record in records:
+            yield record
+
+class BulkVectorLoader:
+    """
+    Streams ``(chunk_id, vector, payload)`` records into a vector backend.
+
+    Records are grouped into batches of at most ``batch_size`` points and
+    ``max_batch_bytes`` (estimated request size). Up to ``max_in_flight``
+    upserts run at once while the next batches are produced (and up to
+    ``max_in_flight`` more wait ready), so embedding and the vector store
+    work in parallel. Failed upserts are retried with backoff.
+
+    The load runs inside the backend's ``deferred_flush``, so backends that
+    persist by rewriting their index (LocalVectorBackend) do it when
+    checkpointing, not after every batch.
+
+    With ``checkpoint_path`` the loader records how many leading records of
+    the stream are stored (upserts can complete out of order, so this is the
+    end of the contiguous prefix), at most every ``checkpoint_interval``
+    seconds and when the load ends. A restarted load skips them: pass the
+    same stream to ``load``, or let ``load_chunks`` skip embedding them.
+    Upserts are idempotent, so batches past the checkpoint may be sent twice.
+    """
+    def __init__(self, backend: VectorBackend, batch_size: int = 256, max_batch_bytes: int = 8 * 2**20,
+                 max_in_flight: int = 4, checkpoint_path: Optional[str] = None, retries: int = 3,
+                 retry_delay: float = 0.5, checkpoint_interval: float = 10.0):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_in_flight = max_in_flight
+        self.checkpoint_path = checkpoint_path
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.checkpoint_interval = checkpoint_interval
+
+    # ---- Checkpoints ----
+
+    def resume_offset(self) -> int:
+        """Number of leading records already stored by an earlier run."""
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("format") != CHECKPOINT_FORMAT:
+            raise ValueError(f"{self.checkpoint_path} is not a vector load checkpoint")
+        return checkpoint["offset"]
+
+    def _write_checkpoint(self, offset: int):
+        if not self.checkpoint_path:
+            return
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"format": CHECKPOINT_FORMAT, "offset": offset, "updated": time.time()}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    async def _checkpoint(self, offset: int):
+        # Records count as stored once the backend has persisted them
+        await self.backend.flush()
+        self._write_checkpoint(offset)
+
+    def reset(self):
+        """Forget the checkpoint (start the next load from the beginning)."""
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    # ---- Loading ----
+
+    @staticmethod
+    def _record_bytes(vector: Any, payload: Optional[Dict[str, Any]]) -> int:
+        # Qdrant requests are JSON: about 12 bytes per float plus the payload
+        size = 12 * len(vector) + 64
+        if payload:
+            size += len(json.dumps(payload, default=str))
+        return size
+
+    async def _batches(self, records, offset: int) -> AsyncIterator[Tuple[int, List[Record]]]:
+        """(stream position, records) of each batch."""
+        batch: List[Record] = []
+        start = offset
+        size = 0
+        async for record in _aiter(records):
+            record_bytes = self._record_bytes(record[1], record[2])
+            if batch and (len(batch) >= self.batch_size or size + record_bytes > self.max_batch_bytes):
+                yield start, batch
+                start += len(batch)
+                batch, size = [], 0
+            batch.append(record)
+            size += record_bytes
+        if batch:
+            yield start, batch
+
+    async def _upsert(self, batch: List[Record]):
+        ids = [record[0] for record in batch]
+        vectors = [record[1] for record in batch]
+        payloads = [record[2] for record in batch]
+        for attempt in range(self.retries + 1):
+            try:
+                await self.backend.upsert(ids, vectors, payloads)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning(f"Upsert of {len(batch)} points failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _produce(self, records, offset: int, ready: asyncio.Queue, progress: "_LoadProgress"):
+        """Assemble batches into ``ready``, ending with None."""
+        try:
+            async for item in self._batches(records, offset):
+                await ready.put(item)
+        except Exception as e:
+            progress.errors.append(e)
+        await ready.put(None)
+
+    async def _store(self, start: int, batch: List[Record], progress: "_LoadProgress", in_flight: asyncio.Semaphore):
+        try:
+            await self._upsert(batch)
+            progress.done(start, start + len(batch))
+        except Exception as e:
+            progress.errors.append(e)
+        finally:
+            in_flight.release()
+
+    async def _dispatch(self, ready: asyncio.Queue, progress: "_LoadProgress"):
+        """Upsert the ready batches, ``max_in_flight`` at a time, until the stream ends or one fails."""
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        while True:
+            item = await ready.get()
+            if item is None:
+                break
+            await in_flight.acquire()
+            if progress.errors:
+                in_flight.release()
+                break
+            task = asyncio.create_task(self._store(*item, progress, in_flight))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def load(self, records: Union[Iterable[Record], AsyncIterator[Record]], offset: int = 0) -> Dict[str, Any]:
+        """
+        Upsert every record of ``records``, a stream whose first record is at
+        position ``offset`` of the full load (see ``resume_offset``).
+        Raises the upsert error if a batch still fails after the retries.
+        """
+        started = time.perf_counter()
+        progress = _LoadProgress(self, offset)
+        # The next batches are produced (embedded) while upserts wait for a slot
+        ready: "asyncio.Queue[Optional[Tuple[int, List[Record]]]]" = asyncio.Queue(maxsize=self.max_in_flight)
+
+        async with self.backend.deferred_flush():
+            producer = asyncio.create_task(self._produce(records, offset, ready, progress))
+            await self._dispatch(ready, progress)
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+            if progress.checkpointing is not None:
+                await progress.checkpointing
+            # Also after a failure: the batches that did succeed are kept
+            if self.checkpoint_path:
+                await self._checkpoint(progress.watermark)
+        if progress.errors:
+            logger.error(f"Bulk vector load stopped at record {progress.watermark}: {progress.errors[0]}")
+            raise progress.errors[0]
+
+        elapsed = time.perf_counter() - started
+        loaded, batches = progress.loaded, progress.batches
+        logger.info(f"Loaded {loaded} vectors in {batches} batches ({loaded / max(elapsed, 1e-9):.0f}/s)")
+        return {"status": "success", "count": loaded, "batches": batches, "offset": progress.watermark,
+                "seconds": elapsed}
+
+    async def load_chunks(self, embedding_agent, chunks: List[Dict[str, Any]], embed_batch: int = 256) -> Dict[str, Any]:
+        """
+        Embed ``chunks`` ({'id', 'text', ...metadata}) with ``embedding_agent``
+        and load them, resuming after the checkpoint. The payload holds the
+        chunk id, text and metadata.
+        """
+        offset = self.resume_offset()
+        if offset:
+            logger.info(f"Resuming vector load at chunk {offset} of {len(chunks)}")
+
+        async def records() -> AsyncIterator[Record]:
+            for i in range(offset, len(chunks), embed_batch):
+                batch = chunks[i:i + embed_batch]
+                result = await embedding_agent.execute({"texts": [c["text"] for c in batch], "format": "numpy"})
+                if result.get("status") != "success":
+                    raise RuntimeError(f"Embedding failed: {result.get('error') or result.get('message')}")
+                for chunk, vector in zip(batch, result["embeddings"]):
+                    payload = {key: value for key, value in chunk.items() if key != "id"}
+                    payload["chunk_id"] = chunk["id"]
+                    yield chunk["id"], np.asarray(vector), payload
+
+        return await self.load(records(), offset)
+
+class _LoadProgress:
+    """Stored records of one ``BulkVectorLoader.load``, and its periodic checkpoints."""
+
+    def __init__(self, loader: BulkVectorLoader, offset: int):
+        self.loader = loader
+        self.pending: Dict[int, int] = {}  # batch start -> end, for batches stored ahead of the watermark
+        self.watermark = offset
+        self.loaded = 0
+        self.batches = 0
+        self.errors: List[BaseException] = []
+        self.last_checkpoint = time.monotonic()
+        self.checkpointing: Optional[asyncio.Task] = None
+
+    def done(self, start: int, end: int):
+        self.loaded += end - start
+        self.batches += 1
+        self.pending[start] = end
+        while self.watermark in self.pending:
+            self.watermark = self.pending.pop(self.watermark)
+        due = time.monotonic() - self.last_checkpoint >= self.loader.checkpoint_interval
+        if self.loader.checkpoint_path and due and (self.checkpointing is None or self.checkpointing.done()):
+            self.last_checkpoint = time.monotonic()
+            self.checkpointing = asyncio.create_task(self.loader._checkpoint(self.watermark))
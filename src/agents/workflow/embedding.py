@@ -1,53 +1,172 @@
+import asyncio
+import base64
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import numpy as np
 from src.agents.base import BaseAgent
+from src.agents.batching import MicroBatcher, length_buckets
+from src.agents.models import model_registry
+from src.config import settings
+from src.agents.workflow.embedding_cache import EmbeddingCache, open_embedding_cache, text_hash
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+OUTPUT_FORMATS = ("list", "numpy", "base64")
+# Little-endian, as sent over the wire
+OUTPUT_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2")}
+
+def pack_embeddings(embeddings: np.ndarray) -> Dict[str, Any]:
+    """
+    Compact JSON form of an embedding matrix: base64 of the raw
+    little-endian buffer, with its dtype and shape.
+    """
+    embeddings = np.ascontiguousarray(embeddings)
+    if embeddings.dtype.byteorder == ">":
+        embeddings = embeddings.astype(embeddings.dtype.newbyteorder("<"))
+    return {
+        "embeddings": base64.b64encode(embeddings.data).decode("ascii"),
+        "dtype": embeddings.dtype.name,
+        "shape": list(embeddings.shape),
+    }
+
+def unpack_embeddings(packed: Dict[str, Any]) -> np.ndarray:
+    """Inverse of ``pack_embeddings``."""
+    buffer = base64.b64decode(packed["embeddings"])
+    return np.frombuffer(buffer, dtype=OUTPUT_DTYPES[packed["dtype"]]).reshape(packed["shape"])
+
 class EmbeddingAgent(BaseAgent):
     """
     Agent responsible for generating embeddings for text chunks.
+    Concurrent requests are encoded together: ``max_wait_ms`` and
+    ``max_batch`` bound how long and how many texts a batch collects.
+
+    With ``cache_url`` (a sqlite file path or a 'redis://' URL) embeddings
+    persist by content hash: re-indexing unchanged chunks only encodes the
+    texts that are new. Cached vectors are stored as float16.
+
+    ``length_bucketing`` sorts each batch by token length and encodes it in
+    buckets of similar length, each as large as ``token_budget`` padded
+    tokens allow, so short chunks are not padded to the longest one.
+
+    ``inference_backend`` ('torch', 'onnx' or 'onnx-int8'; defaults to
+    settings.INFERENCE_BACKEND) selects how the model runs.
     """
-    def __init__(self, name: str, model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(self, name: str, model_name: str = "all-MiniLM-L6-v2",
+                 max_wait_ms: float = 5.0, max_batch: int = 64, cache_url: Optional[str] = None,
+                 length_bucketing: bool = False, token_budget: int = 16384,
+                 inference_backend: Optional[str] = None):
         super().__init__(name=name)
         self.model_name = model_name
+        self.inference_backend = inference_backend or settings.INFERENCE_BACKEND
+        # Quantized models embed slightly differently: cache their vectors apart
+        self.cache_key = model_name if self.inference_backend == "torch" else f"{model_name}@{self.inference_backend}"
         self.model = None
+        self.length_bucketing = length_bucketing
+        self.token_budget = token_budget
+        self.batcher = MicroBatcher(self._encode, max_wait_ms=max_wait_ms, max_batch=max_batch, name=name)
+        self.cache: Optional[EmbeddingCache] = open_embedding_cache(cache_url) if cache_url else None
         self._load_model()
 
     def _load_model(self):
         """Load embedding model."""
         try:
             from sentence_transformers import SentenceTransformer
-            self.model = SentenceTransformer(self.model_name)
+            self.model = model_registry.acquire(SentenceTransformer, self.model_name, backend=self.inference_backend)
             logger.info(f"Loaded embedding model: {self.model_name}")
         except ImportError:
             logger.warning("sentence-transformers not installed.")
         except Exception as e:
             logger.error(f"Failed to load embedding model: {e}")
 
+    def _token_lengths(self, texts: List[str]) -> List[int]:
+        tokenizer = getattr(self.model, "tokenizer", None)
+        max_length = getattr(self.model, "max_seq_length", None) or 512
+        if tokenizer is None:
+            # Rough subword count when the model exposes no tokenizer
+            return [min(len(text.split()) * 4 // 3 + 2, max_length) for text in texts]
+        input_ids = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=max_length)["input_ids"]
+        return [len(ids) for ids in input_ids]
+
+    def _encode(self, texts: List[str]):
+        if not self.length_bucketing or len(texts) < 2:
+            return self.model.encode(texts)
+        embeddings = None
+        for bucket in length_buckets(self._token_lengths(texts), self.token_budget, len(texts)):
+            encoded = np.asarray(self.model.encode([texts[i] for i in bucket], batch_size=len(bucket)))
+            if embeddings is None:
+                embeddings = np.empty((len(texts), encoded.shape[1]), dtype=encoded.dtype)
+            # Back to the callers' order
+            embeddings[bucket] = encoded
+        return embeddings
+
+    async def _embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embeddings of ``texts`` as one float32 array, encoding only those
+        missing from the cache.
+        """
+        if self.cache is None:
+            return np.asarray(await self.batcher.run(texts), dtype=np.float32)
+
+        hashes = [text_hash(text) for text in texts]
+        try:
+            vectors = await asyncio.to_thread(self.cache.get_many, self.cache_key, hashes)
+        except Exception as e:
+            logger.error(f"Embedding cache lookup failed: {e}")
+            vectors = {}
+        missing = {h: text for h, text in zip(hashes, texts) if h not in vectors}
+        if missing:
+            encoded = dict(zip(missing, await self.batcher.run(list(missing.values()))))
+            vectors.update(encoded)
+            try:
+                await asyncio.to_thread(self.cache.put_many, self.cache_key, encoded)
+            except Exception as e:
+                logger.error(f"Embedding cache write failed: {e}")
+        return np.asarray([vectors[h] for h in hashes], dtype=np.float32)
+
     async def execute(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """
         Generate embeddings.
-        Task format: {'texts': List[str]}
+        Task format: {'texts': List[str], 'format': str, 'dtype': str}
+        format: 'list' (default, nested lists of floats), 'numpy' (one
+        contiguous array, for callers in this process) or 'base64' (see
+        ``pack_embeddings``); dtype: 'float32' (default) or 'float16'.
         """
         texts = task.get("texts", [])
+        output_format = task.get("format", "list")
+        dtype = task.get("dtype", "float32")
         if not texts:
             return {"error": "No texts provided"}
+        if output_format not in OUTPUT_FORMATS:
+            return {"error": f"Unknown embedding format: {output_format}"}
+        if dtype not in OUTPUT_DTYPES:
+            return {"error": f"Unsupported embedding dtype: {dtype}"}
 
         if not self.model:
             return {"error": "Embedding model not loaded"}
 
         try:
-            embeddings = self.model.encode(texts).tolist()
-            return {
-                "status": "success",
-                "embeddings": embeddings,
-                "count": len(embeddings)
-            }
+            embeddings = np.ascontiguousarray(await self._embed(texts), dtype=OUTPUT_DTYPES[dtype])
+            result = {"status": "success", "count": len(embeddings)}
+            if output_format == "numpy":
+                result["embeddings"] = embeddings
+            elif output_format == "base64":
+                result.update(pack_embeddings(embeddings))
+            else:
+                result["embeddings"] = embeddings.tolist()
+            return result
         except Exception as e:
             logger.error(f"Embedding generation failed: {e}")
             return {"status": "error", "message": str(e)}
 
+    def close(self):
+        """Stop the batcher, close the cache and release the shared model."""
+        self.batcher.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.model is not None:
+            model_registry.release(self.model)
+            self.model = None
+
 if __name__ == "__main__":
     pass
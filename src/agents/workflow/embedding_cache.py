@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from src.monitoring.metrics import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Vectors are stored as raw little-endian float16
+STORE_DTYPE = np.dtype("<f2")
+
+def text_hash(text: str) -> str:
+    """SHA-256 of the normalized text (Unicode NFKC, collapsed whitespace)."""
+    normalized = " ".join(unicodedata.normalize("NFKC", text).split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def _to_blob(vector: np.ndarray) -> bytes:
+    return np.asarray(vector, dtype=STORE_DTYPE).tobytes()
+
+def _from_blob(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=STORE_DTYPE).astype(np.float32)
+
+class EmbeddingCache(ABC):
+    """
+    Persistent embeddings keyed by (model name, ``text_hash``), so re-indexing
+    unchanged chunks skips the model. Lookups and writes are bulk operations.
+    """
+    name = "embedding"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def _get_many(self, model_name: str, hashes: List[str]) -> Dict[str, bytes]:
+        pass
+
+    @abstractmethod
+    def _put_many(self, model_name: str, blobs: Dict[str, bytes]):
+        pass
+
+    def get_many(self, model_name: str, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Cached vectors (float32) of the hashes found."""
+        hashes = list(dict.fromkeys(hashes))
+        found = {h: _from_blob(blob) for h, blob in self._get_many(model_name, hashes).items()}
+        self.hits += len(found)
+        self.misses += len(hashes) - len(found)
+        for h in hashes:
+            metrics.log_cache(self.name, h in found)
+        return found
+
+    def put_many(self, model_name: str, vectors: Dict[str, np.ndarray]):
+        if vectors:
+            self._put_many(model_name, {h: _to_blob(v) for h, v in vectors.items()})
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        pass
+
+class SQLiteEmbeddingCache(EmbeddingCache):
+    """Embedding cache in a local sqlite file (float16 blobs)."""
+    # Stay under SQLITE_MAX_VARIABLE_NUMBER of older sqlite builds
+    chunk_size = 500
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def _get_many(self, model_name: str, hashes: List[str]) -> Dict[str, bytes]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), self.chunk_size):
+                chunk = hashes[start:start + self.chunk_size]
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(chunk))})",
+                    [model_name, *chunk],
+                )
+                found.update(rows.fetchall())
+        return found
+
+    def _put_many(self, model_name: str, blobs: Dict[str, bytes]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model_name, h, blob) for h, blob in blobs.items()],
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class RedisEmbeddingCache(EmbeddingCache):
+    """
+    Embedding cache in Redis, shared by ingestion workers on several hosts.
+    ``ttl`` (seconds) expires entries; None keeps them.
+    """
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "embedding",
+                 ttl: Optional[int] = None, client=None):
+        super().__init__()
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, model_name: str, h: str) -> str:
+        return f"{self.prefix}:{model_name}:{h}"
+
+    def _get_many(self, model_name: str, hashes: List[str]) -> Dict[str, bytes]:
+        if not hashes:
+            return {}
+        values = self.client.mget([self._key(model_name, h) for h in hashes])
+        return {h: value for h, value in zip(hashes, values) if value is not None}
+
+    def _put_many(self, model_name: str, blobs: Dict[str, bytes]):
+        pipe = self.client.pipeline(transaction=False)
+        for h, blob in blobs.items():
+            pipe.set(self._key(model_name, h), blob, ex=self.ttl)
+        pipe.execute()
+
+    def close(self):
+        self.client.close()
+
+def open_embedding_cache(url: str) -> EmbeddingCache:
+    """'redis://...' (or 'rediss://...') opens a Redis cache, anything else a sqlite file."""
+    if url.startswith(("redis://", "rediss://")):
+        return RedisEmbeddingCache(url)
+    return SQLiteEmbeddingCache(url)
@@ -1,8 +1,11 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Dict, Any, List
 from src.core.orchestrator import orchestrator
 from src.core.models import WorkflowStatus
+from src.agents.models import model_registry
+from src.agents.registry import agent_registry
+from src.agents.retrieval.vector import close_async_clients
 
 app = FastAPI(
     title="ShapeShifter RAG API",
@@ -16,10 +19,24 @@ class WorkflowRequest(BaseModel):
     workflow_type: str
     inputs: Dict[str, Any]
 
+class EmbeddingRequest(BaseModel):
+    texts: List[str]
+    # 'json' (lists of floats), 'base64' (raw little-endian buffer) or 'binary'
+    encoding: str = "base64"
+    dtype: str = "float32"
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_async_clients()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/models")
+async def loaded_models():
+    return {"models": model_registry.stats(), "memory_bytes": model_registry.memory_bytes()}
+
 @app.post("/workflows")
 async def create_workflow(request: WorkflowRequest):
     try:
@@ -31,6 +48,36 @@ async def create_workflow(request: WorkflowRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/embeddings")
+async def create_embeddings(request: EmbeddingRequest):
+    """
+    Embed texts with the registered 'embedding_agent'. 'binary' returns the
+    raw little-endian matrix as application/octet-stream, with its dtype and
+    shape in the X-Embedding-Dtype and X-Embedding-Shape headers.
+    """
+    agent = agent_registry.get("embedding_agent")
+    if agent is None:
+        raise HTTPException(status_code=503, detail="Embedding agent not available")
+    if request.encoding not in ("json", "base64", "binary"):
+        raise HTTPException(status_code=400, detail=f"Unknown encoding: {request.encoding}")
+
+    output_format = {"json": "list", "base64": "base64", "binary": "numpy"}[request.encoding]
+    result = await agent.execute({"texts": request.texts, "format": output_format, "dtype": request.dtype})
+    if result.get("status") != "success":
+        raise HTTPException(status_code=400 if "error" in result else 500,
+                            detail=result.get("error") or result.get("message"))
+    if request.encoding == "binary":
+        embeddings = result["embeddings"]
+        return Response(
+            content=embeddings.tobytes(),
+            media_type="application/octet-stream",
+            headers={
+                "X-Embedding-Dtype": embeddings.dtype.name,
+                "X-Embedding-Shape": ",".join(str(n) for n in embeddings.shape),
+            },
+        )
+    return result
+
 @app.get("/workflows/{workflow_id}")
 async def get_workflow_status(workflow_id: str):
     workflow = await orchestrator.state_store.get_workflow(workflow_id)
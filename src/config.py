@@ -26,6 +26,13 @@ class Settings(BaseSettings):
     OLLAMA_BASE_URL: str = "http://localhost:11434"
     VLLM_BASE_URL: str = "http://localhost:8000"
 
+    # Model Inference Configuration
+    # torch, onnx or onnx-int8 (ONNX Runtime with dynamic int8 quantization)
+    INFERENCE_BACKEND: str = "torch"
+    ONNX_CACHE_DIR: str = "models/onnx"
+    # arm64, avx2, avx512 or avx512_vnni
+    ONNX_QUANTIZATION: str = "avx512_vnni"
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 settings = Settings()
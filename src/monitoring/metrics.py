@@ -1,5 +1,5 @@
 import logging
-from prometheus_client import Counter, Histogram, start_http_server
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
 from typing import Optional
 
 # Configure logging
@@ -28,6 +28,18 @@ WORKFLOW_COUNT = Counter(
     ['type', 'status']
 )
 
+CACHE_REQUESTS = Counter(
+    'cache_requests_total',
+    'Cache lookups by result',
+    ['cache', 'result']
+)
+
+MODEL_MEMORY = Gauge(
+    'model_memory_bytes',
+    'Memory held by each loaded model',
+    ['model']
+)
+
 class MetricsManager:
     """Manager for application metrics and monitoring"""
     
@@ -63,4 +75,18 @@ class MetricsManager:
         WORKFLOW_COUNT.labels(type=workflow_type, status=status).inc()
         self.logger.info(f"Workflow: {workflow_type} - {status}")
 
+    def log_cache(self, cache: str, hit: bool):
+        """Count a cache lookup (not logged: called on every lookup)"""
+        CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+    def log_model_memory(self, model: str, nbytes: Optional[int]):
+        """Set a loaded model's memory gauge (None once it is unloaded)"""
+        if nbytes is None:
+            try:
+                MODEL_MEMORY.remove(model)
+            except KeyError:
+                pass
+        else:
+            MODEL_MEMORY.labels(model=model).set(nbytes)
+
 metrics = MetricsManager()
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from src.agents.batching import MicroBatcher, length_buckets
+from src.agents.workflow.embedding import EmbeddingAgent
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_call():
+    calls = []
+    batcher = MicroBatcher(lambda items: calls.append(list(items)) or [x * 2 for x in items],
+                           max_wait_ms=50, max_batch=64)
+    results = await asyncio.gather(*(batcher.run([i, i + 100]) for i in range(5)))
+    batcher.close()
+    assert results == [[2 * i, 2 * (i + 100)] for i in range(5)]
+    assert len(calls) == 1 and sorted(calls[0]) == sorted(x for i in range(5) for x in (i, i + 100))
+
+def test_batches_are_capped_at_max_batch():
+    gate = threading.Event()
+    sizes = []
+
+    def fn(items):
+        gate.wait()
+        sizes.append(len(items))
+        return items
+
+    batcher = MicroBatcher(fn, max_wait_ms=20, max_batch=4)
+    first = batcher.submit([0])
+    futures = [batcher.submit([i, i]) for i in range(5)]
+    gate.set()
+    assert first.result(timeout=5) == [0]
+    assert [f.result(timeout=5) for f in futures] == [[i, i] for i in range(5)]
+    batcher.close()
+    # Whole requests only: a request never straddles two batches
+    assert all(size <= 4 for size in sizes) and sum(sizes) == 11
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_caller():
+    def fn(items):
+        raise RuntimeError("boom")
+
+    batcher = MicroBatcher(fn, max_wait_ms=20)
+    results = await asyncio.gather(batcher.run(["a"]), batcher.run(["b"]), return_exceptions=True)
+    batcher.close()
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+def test_length_buckets_respect_token_budget():
+    lengths = [300, 10, 12, 290, 11, 50]
+    buckets = length_buckets(lengths, token_budget=600, max_batch=3)
+    assert [b.tolist() for b in buckets] == [[1, 4, 2], [5, 3], [0]]
+    assert sorted(i for b in buckets for i in b) == list(range(len(lengths)))
+    # An item longer than the budget still gets its own batch
+    assert [b.tolist() for b in length_buckets([5000, 1], 100, 8)] == [[1], [0]]
+
+@pytest.mark.asyncio
+async def test_embedding_agent_encodes_sorted_buckets_in_caller_order():
+    with patch.object(EmbeddingAgent, "_load_model"):
+        agent = EmbeddingAgent("embed", length_bucketing=True, token_budget=40)
+    agent.model = model = MagicMock(tokenizer=None, max_seq_length=256)
+    model.encode.side_effect = lambda texts, batch_size: np.array([[len(t.split()), 1.0] for t in texts])
+    texts = ["word " * n for n in (25, 2, 3, 24, 1)]
+    result = await agent.execute({"texts": texts})
+    agent.close()
+
+    assert [vector[0] for vector in result["embeddings"]] == [25, 2, 3, 24, 1]
+    batches = [call.args[0] for call in model.encode.call_args_list]
+    assert [[len(t.split()) for t in batch] for batch in batches] == [[1, 2, 3], [24], [25]]
@@ -0,0 +1,131 @@
+import asyncio
+import re
+import time
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from src.agents.cross_encoder import CrossEncoderExecutor, close_executor, get_executor
+from src.agents.generation.verifier import VerifierAgent
+from src.agents.passages import PassageWindower
+from src.agents.retrieval.reranker import RerankerAgent
+
+def length_model():
+    model = MagicMock(max_length=512, tokenizer=None)
+    model.predict.side_effect = lambda pairs, batch_size=None: np.array([float(len(t)) for _, t in pairs])
+    return model
+
+@pytest.mark.asyncio
+async def test_executor_sorts_by_length_and_scatters_scores():
+    model = length_model()
+    executor = CrossEncoderExecutor(model, token_budget=12)
+    pairs = [("q", "x" * 60), ("q", "x"), ("q", "xx"), ("q", "x" * 29)]
+    scores = await executor.predict(pairs)
+    executor.close()
+    assert scores.tolist() == [60.0, 1.0, 2.0, 29.0]
+    batches = [[len(t) for _, t in call.args[0]] for call in model.predict.call_args_list]
+    assert batches == [[1, 2], [29], [60]]
+
+@pytest.mark.asyncio
+async def test_executor_times_the_forward_pass_per_pair():
+    model = MagicMock(max_length=512, tokenizer=None)
+    # 4 ms of model time per pair; the batching wait is much longer
+    model.predict.side_effect = lambda pairs, batch_size=None: time.sleep(0.004 * len(pairs)) or np.zeros(len(pairs))
+    executor = CrossEncoderExecutor(model, max_wait_ms=100)
+    executor.pair_ms = 0.0
+    await executor.predict([("q", f"passage {i}") for i in range(4)])
+    executor.close()
+    # One moving-average step towards 4 ms, none of the wait included
+    assert 0.8 <= executor.pair_ms < 2.0
+
+@pytest.mark.asyncio
+async def test_concurrent_rerankers_and_verifier_share_forward_passes():
+    model = length_model()
+    with patch.object(RerankerAgent, "_load_model"), patch.object(VerifierAgent, "_load_model"):
+        rerankers = [RerankerAgent(f"rerank{i}", max_wait_ms=50, cache_size=0) for i in range(3)]
+        verifier = VerifierAgent("verify")
+    for agent in rerankers + [verifier]:
+        agent.model = model
+    assert rerankers[0].executor is verifier.executor
+
+    tasks = [agent.execute({"query": "q", "documents": [{"id": "a", "text": "aa"}, {"id": "b", "text": "bbb"}]})
+             for agent in rerankers]
+    tasks.append(verifier.execute({"response": "The sky is blue today", "evidence": ["sky", "blue"]}))
+    results = await asyncio.gather(*tasks)
+    close_executor(model)
+
+    assert model.predict.call_count == 1
+    assert [d["id"] for d in results[0]["results"]] == ["b", "a"]
+    assert results[-1]["results"][0]["confidence"] == 4.0
+
+@pytest.mark.asyncio
+async def test_verifier_splits_multi_label_scores_per_claim():
+    model = MagicMock(max_length=512, tokenizer=None)
+    # [contradiction, entailment, neutral] per pair
+    model.predict.side_effect = lambda pairs, batch_size=None: np.array(
+        [[0.1, 0.9 if "rain" in claim and "rain" in ev else 0.2, 0.0] for claim, ev in pairs])
+    with patch.object(VerifierAgent, "_load_model"):
+        verifier = VerifierAgent("verify")
+    verifier.model = model
+    result = await verifier.execute({"response": "It will rain tomorrow. Prices rose sharply",
+                                     "evidence": ["rain expected", "markets flat"]})
+    close_executor(model)
+    assert [(r["supported"], r["confidence"]) for r in result["results"]] == [(True, 0.9), (False, 0.2)]
+
+def test_get_executor_is_per_model():
+    a, b = length_model(), length_model()
+    assert get_executor(a) is get_executor(a) is not get_executor(b)
+    close_executor(a)
+    close_executor(b)
+
+class WordTokenizer:
+    """Fast-tokenizer stand-in: one token per word, with offsets."""
+    is_fast = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=False):
+        self.calls += 1
+        return {"offset_mapping": [[m.span() for m in re.finditer(r"\S+", text)] for text in texts]}
+
+def test_windower_keeps_short_passages_and_cuts_long_ones_to_query_terms():
+    tokenizer = WordTokenizer()
+    windower = PassageWindower(tokenizer, max_length=16)
+    filler = " ".join(f"w{i}" for i in range(40))
+    long_text = f"{filler} the solar panel output dropped {filler}"
+    pairs, lengths = windower([("solar panel output", "short text"), ("solar panel output", long_text)])
+
+    assert pairs[0] == ("solar panel output", "short text")
+    assert lengths[0] == 3 + 2 + 3
+    passage = pairs[1][1]
+    assert "solar panel output" in passage and long_text.find(passage) > 0
+    assert len(passage.split()) == 10 and lengths[1] == 16
+
+def test_windower_falls_back_to_the_start_and_caches_tokenizations():
+    tokenizer = WordTokenizer()
+    windower = PassageWindower(tokenizer, max_length=8)
+    text = " ".join(f"w{i}" for i in range(20))
+    pairs, _ = windower([("unrelated", text)])
+    assert pairs[0][1] == "w0 w1 w2 w3"
+    windower([("unrelated", text), ("unrelated", text)])
+    assert tokenizer.calls == 1
+
+def test_windower_skips_the_offset_pass_for_pairs_that_fit():
+    tokenizer = WordTokenizer()
+    windower = PassageWindower(tokenizer, max_length=512)
+    pairs, lengths = windower([("query", "a short passage"), ("query", "x " * 300)])
+    assert pairs[0] == ("query", "a short passage") and lengths[0] == 8
+    # Only the long pair was tokenized, and it fits in 512 tokens
+    assert tokenizer.calls == 1 and lengths[1] == 1 + 300 + 3
+
+@pytest.mark.asyncio
+async def test_executor_windows_passages_with_fast_tokenizer():
+    model = length_model()
+    model.max_length = 16
+    model.tokenizer = WordTokenizer()
+    executor = CrossEncoderExecutor(model)
+    text = " ".join(f"w{i}" for i in range(30)) + " target"
+    await executor.predict([("target", text)])
+    executor.close()
+    (_, passage), = model.predict.call_args.args[0]
+    assert passage.endswith("target") and len(passage.split()) == 12
@@ -0,0 +1,57 @@
+import base64
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import MagicMock, patch
+from src.agents.registry import agent_registry
+from src.agents.workflow.embedding import EmbeddingAgent, pack_embeddings, unpack_embeddings
+from src.api.main import app
+
+@pytest.fixture
+def agent():
+    with patch.object(EmbeddingAgent, "_load_model"):
+        agent = EmbeddingAgent("embed")
+    agent.model = MagicMock()
+    agent.model.encode.side_effect = lambda texts: np.array([[len(t), 0.25, -1.5] for t in texts], dtype=np.float32)
+    yield agent
+    agent.batcher.close()
+
+@pytest.mark.asyncio
+async def test_numpy_format_returns_one_contiguous_array(agent):
+    result = await agent.execute({"texts": ["ab", "abcd"], "format": "numpy"})
+    embeddings = result["embeddings"]
+    assert isinstance(embeddings, np.ndarray) and embeddings.flags.c_contiguous
+    assert embeddings.dtype == np.float32 and embeddings.shape == (2, 3)
+
+    half = await agent.execute({"texts": ["ab"], "format": "numpy", "dtype": "float16"})
+    assert half["embeddings"].dtype == np.float16
+    assert (await agent.execute({"texts": ["ab"], "format": "csv"}))["error"]
+
+@pytest.mark.asyncio
+async def test_base64_format_round_trips(agent):
+    result = await agent.execute({"texts": ["ab", "abcd"], "format": "base64", "dtype": "float16"})
+    assert result["dtype"] == "float16" and result["shape"] == [2, 3]
+    assert len(base64.b64decode(result["embeddings"])) == 2 * 3 * 2
+    np.testing.assert_array_equal(unpack_embeddings(result), [[2, 0.25, -1.5], [4, 0.25, -1.5]])
+
+def test_pack_embeddings_is_little_endian():
+    big_endian = np.array([[1.0, 2.0]], dtype=">f4")
+    raw = base64.b64decode(pack_embeddings(big_endian)["embeddings"])
+    assert raw == np.array([1.0, 2.0], dtype="<f4").tobytes()
+
+def test_embeddings_endpoint_encodings(agent):
+    client = TestClient(app)
+    with patch.dict(agent_registry.agents, {"embedding_agent": agent}):
+        packed = client.post("/embeddings", json={"texts": ["ab"]}).json()
+        assert unpack_embeddings(packed).tolist() == [[2.0, 0.25, -1.5]]
+
+        as_json = client.post("/embeddings", json={"texts": ["ab"], "encoding": "json"}).json()
+        assert as_json["embeddings"] == [[2.0, 0.25, -1.5]]
+
+        raw = client.post("/embeddings", json={"texts": ["ab", "abc"], "encoding": "binary", "dtype": "float16"})
+        assert raw.headers["content-type"] == "application/octet-stream"
+        assert raw.headers["x-embedding-shape"] == "2,3" and raw.headers["x-embedding-dtype"] == "float16"
+        assert np.frombuffer(raw.content, dtype="<f2").reshape(2, 3)[1, 0] == 3.0
+
+        assert client.post("/embeddings", json={"texts": ["ab"], "encoding": "xml"}).status_code == 400
+    assert client.post("/embeddings", json={"texts": ["ab"]}).status_code == 503
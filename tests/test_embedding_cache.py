@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from src.agents.workflow.embedding import EmbeddingAgent
+from src.agents.workflow.embedding_cache import RedisEmbeddingCache, SQLiteEmbeddingCache, text_hash
+
+def make_agent(cache_url):
+    with patch.object(EmbeddingAgent, "_load_model"):
+        agent = EmbeddingAgent("embed", cache_url=cache_url)
+    agent.model = MagicMock()
+    agent.model.encode.side_effect = lambda texts: np.array([[len(t), 0.5] for t in texts], dtype=np.float32)
+    return agent
+
+def test_text_hash_ignores_whitespace_and_unicode_forms():
+    assert text_hash("RAG  pipelines\n") == text_hash("RAG pipelines")
+    assert text_hash("ﬁle") == text_hash("file")
+    assert text_hash("RAG") != text_hash("rag")
+
+def test_sqlite_cache_round_trip(tmp_path):
+    cache = SQLiteEmbeddingCache(str(tmp_path / "cache" / "embeddings.sqlite"))
+    cache.put_many("mini", {"a": np.array([0.1, 0.2], dtype=np.float32)})
+    assert cache.get_many("other-model", ["a"]) == {}
+    found = cache.get_many("mini", ["a", "b"])
+    assert list(found) == ["a"]
+    np.testing.assert_allclose(found["a"], [0.1, 0.2], rtol=1e-3)
+    assert found["a"].dtype == np.float32
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+    cache.close()
+
+def test_redis_cache_uses_bulk_commands():
+    store = {}
+    client = MagicMock()
+    client.mget.side_effect = lambda keys: [store.get(key) for key in keys]
+    client.pipeline.return_value.set.side_effect = lambda key, value, ex=None: store.__setitem__(key, value)
+    cache = RedisEmbeddingCache(client=client, ttl=60)
+    cache.put_many("mini", {"a": np.ones(3), "b": np.zeros(3)})
+    client.pipeline.return_value.execute.assert_called_once()
+    assert sorted(store) == ["embedding:mini:a", "embedding:mini:b"]
+    assert sorted(cache.get_many("mini", ["a", "b", "c"])) == ["a", "b"]
+    client.mget.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_reindexing_encodes_only_new_texts(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    agent = make_agent(path)
+    first = await agent.execute({"texts": ["alpha", "beta", "alpha"]})
+    assert first["count"] == 3
+    agent.model.encode.assert_called_once_with(["alpha", "beta"])
+    agent.close()
+
+    # A new process after a chunker tweak: only the changed chunk is encoded
+    agent = make_agent(path)
+    second = await agent.execute({"texts": ["alpha", "beta", "gamma!"]})
+    agent.model.encode.assert_called_once_with(["gamma!"])
+    assert second["embeddings"][:2] == first["embeddings"][:2]
+    assert second["embeddings"][2] == [6.0, 0.5]
+    agent.close()
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from src.agents.retrieval.fusion import HybridFusionAgent, fuse, intern_ids, threshold_fuse, top_k_indices
+
+def legacy_rrf(results_map, rrf_k=60):
+    scores = {}
+    for items in results_map.values():
+        for rank, item in enumerate(items):
+            scores[item['id']] = scores.get(item['id'], 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+def random_results(seed, retrievers=4, candidates=200, pool=400):
+    rng = np.random.default_rng(seed)
+    # Retrievers broadly agree: ids are drawn around a shared relevance order
+    results = {}
+    for r in range(retrievers):
+        noisy = np.argsort(np.arange(pool) + rng.normal(0, pool / 8, size=pool))[:candidates]
+        results[f"r{r}"] = [{'id': f"d{i}", 'score': float(candidates - rank), 'text': f"doc {i}"}
+                            for rank, i in enumerate(noisy)]
+    return results
+
+@pytest.mark.asyncio
+async def test_rrf_matches_legacy_scores_and_keeps_first_metadata():
+    agent = HybridFusionAgent("fusion")
+    results = {
+        'vector': [{'id': 'a', 'text': 'A', 'source': 'vector'}, {'id': 'b', 'text': 'B'}],
+        'sparse': [{'id': 'b', 'text': 'B'}, {'id': 'c', 'text': 'C'}, {'id': 'a', 'source': 'sparse'}],
+    }
+    result = await agent.execute({'results': results, 'top_k': 2})
+    assert result['status'] == 'success'
+    assert [(d['id'], pytest.approx(d['score'])) for d in result['results']] == legacy_rrf(results)[:2]
+    assert result['results'][1]['source'] == 'vector' and result['results'][1]['fusion_rank'] == 2
+    assert 'score' not in results['vector'][0]
+
+def test_full_ranking_matches_legacy_on_random_lists():
+    results = random_results(0)
+    fused = HybridFusionAgent("fusion").reciprocal_rank_fusion(results)
+    expected = legacy_rrf(results)
+    assert [d['id'] for d in fused] == [doc_id for doc_id, _ in expected]
+    assert np.allclose([d['score'] for d in fused], [score for _, score in expected])
+
+def test_weights_and_comb_methods():
+    ids, ranked = intern_ids([['a', 'b'], ['b', 'c']])
+    assert ids == ['a', 'b', 'c'] and ranked[1].tolist() == [1, 2]
+    scores = [[10.0, 0.0], [4.0, 2.0]]
+    assert np.allclose(fuse(ranked, 3, "combsum", scores=scores), [1.0, 1.0, 0.0])
+    assert np.allclose(fuse(ranked, 3, "combmnz", scores=scores), [1.0, 2.0, 0.0])
+    assert np.allclose(fuse(ranked, 3, "rrf", weights=[2.0, 0.0], rrf_k=0), [2.0, 1.0, 0.0])
+    with pytest.raises(ValueError):
+        fuse(ranked, 3, "borda")
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("method", ["rrf", "combsum", "combmnz"])
+async def test_empty_retriever_list(method):
+    agent = HybridFusionAgent("fusion", method=method)
+    results = {'vector': [{'id': 'a', 'score': 0.9}, {'id': 'b', 'score': 0.4}], 'sparse': []}
+    result = await agent.execute({'results': results, 'top_k': 5})
+    assert result['status'] == 'success'
+    assert [d['id'] for d in result['results']] == ['a', 'b']
+    assert (await agent.execute({'results': {'vector': [], 'sparse': []}}))['results'] == []
+
+def test_top_k_indices_breaks_ties_by_first_occurrence():
+    assert top_k_indices(np.array([1.0, 3.0, 3.0, 2.0, 3.0]), 2).tolist() == [1, 2]
+    assert top_k_indices(np.array([1.0, 2.0]), 5).tolist() == [1, 0]
+
+def test_threshold_fusion_stops_early_with_the_full_scores():
+    results = random_results(1)
+    streams = [[(d['id'], d['score']) for d in items] for items in results.values()]
+    weights = [2.0, 1.0, 1.0, 0.5]
+    fused, depth = threshold_fuse([iter(stream) for stream in streams], 5, weights=weights)
+
+    ids, ranked = intern_ids([[doc_id for doc_id, _ in stream] for stream in streams])
+    exact = fuse(ranked, len(ids), weights=weights)
+    best = top_k_indices(exact, 5)
+    assert [doc_id for doc_id, _ in fused] == [ids[i] for i in best]
+    assert [score for _, score in fused] == pytest.approx(exact[best].tolist())
+    assert depth < 200
+    with pytest.raises(ValueError):
+        threshold_fuse(streams, 5, "combsum")
+
+@pytest.mark.asyncio
+async def test_agent_errors():
+    agent = HybridFusionAgent("fusion")
+    assert 'error' in await agent.execute({'results': {}})
+    assert (await agent.execute({'results': random_results(2), 'method': 'borda'}))['status'] == 'error'
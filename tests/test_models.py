@@ -0,0 +1,118 @@
+import os
+import sys
+import numpy as np
+import pytest
+from unittest.mock import MagicMock
+from src.agents.models import ModelRegistry, model_memory_bytes, model_registry
+from src.config import settings
+from src.agents.workflow.embedding import EmbeddingAgent
+
+class FakeParameter:
+    def __init__(self, *shape, itemsize=4):
+        self.array = np.zeros(shape, dtype=np.float32 if itemsize == 4 else np.float16)
+
+    def numel(self):
+        return self.array.size
+
+    def element_size(self):
+        return self.array.itemsize
+
+class FakeModel:
+    loads = 0
+
+    def __init__(self, model_name, device=None):
+        FakeModel.loads += 1
+        self.model_name = model_name
+        self.device = device
+
+    def parameters(self):
+        return [FakeParameter(10, 4), FakeParameter(4)]
+
+    def buffers(self):
+        return [FakeParameter(8, itemsize=2)]
+
+    def encode(self, texts):
+        return np.ones((len(texts), 2), dtype=np.float32)
+
+@pytest.fixture(autouse=True)
+def reset_loads():
+    FakeModel.loads = 0
+
+def test_registry_shares_and_counts_references():
+    registry = ModelRegistry()
+    a = registry.acquire(FakeModel, "mini")
+    b = registry.acquire(FakeModel, "mini")
+    c = registry.acquire(FakeModel, "mini", device="cuda")
+    assert a is b and a is not c
+    assert FakeModel.loads == 2
+    assert {(s["device"], s["refs"]) for s in registry.stats()} == {(None, 2), ("cuda", 1)}
+
+    assert registry.release(a) is False
+    assert registry.release(b) is True
+    assert len(registry) == 1
+    assert registry.acquire(FakeModel, "mini") is not a
+    assert FakeModel.loads == 3
+
+def test_memory_usage_reported_per_model():
+    registry = ModelRegistry()
+    registry.acquire(FakeModel, "mini")
+    assert model_memory_bytes(FakeModel("x")) == (40 + 4) * 4 + 8 * 2
+    assert registry.stats()[0]["memory_bytes"] == 192
+    assert registry.memory_bytes() == 192
+    # Models that are not torch modules are counted as 0 bytes
+    assert model_memory_bytes(object()) == 0
+
+@pytest.mark.asyncio
+async def test_embedding_agents_share_one_model(monkeypatch):
+    module = MagicMock(SentenceTransformer=FakeModel)
+    monkeypatch.setitem(sys.modules, "sentence_transformers", module)
+    first = EmbeddingAgent("embed_a")
+    second = EmbeddingAgent("embed_b")
+    assert first.model is second.model
+    assert FakeModel.loads == 1
+
+    result = await second.execute({"texts": ["a", "b"]})
+    assert result["count"] == 2
+
+    first.close()
+    second.close()
+    assert all(s["class"] != "FakeModel" for s in model_registry.stats())
+
+class FakeOnnxModel:
+    created = []
+
+    def __init__(self, model_name, backend="torch", model_kwargs=None):
+        FakeOnnxModel.created.append((model_name, backend, (model_kwargs or {}).get("file_name")))
+        self.model_name = model_name
+
+    def save_pretrained(self, path):
+        os.makedirs(os.path.join(path, "onnx"), exist_ok=True)
+        with open(os.path.join(path, "onnx", "model.onnx"), "wb") as f:
+            f.write(b"\0" * 400)
+
+def fake_quantize(model, config, path):
+    with open(os.path.join(path, "onnx", f"model_qint8_{config}.onnx"), "wb") as f:
+        f.write(b"\0" * 100)
+
+def test_onnx_int8_backend_exports_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ONNX_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "ONNX_QUANTIZATION", "avx2")
+    monkeypatch.setitem(sys.modules, "sentence_transformers",
+                        MagicMock(export_dynamic_quantized_onnx_model=fake_quantize))
+    FakeOnnxModel.created = []
+
+    model = ModelRegistry().acquire(FakeOnnxModel, "org/mini", backend="onnx-int8")
+    export_dir = str(tmp_path / "org--mini")
+    assert FakeOnnxModel.created == [("org/mini", "onnx", None),
+                                     (export_dir, "onnx", "onnx/model_qint8_avx2.onnx")]
+    assert model.model_name == export_dir
+
+    # Another process finds the cached export
+    registry = ModelRegistry()
+    registry.acquire(FakeOnnxModel, "org/mini", backend="onnx-int8")
+    assert len(FakeOnnxModel.created) == 3 and FakeOnnxModel.created[-1][0] == export_dir
+    assert registry.stats()[0]["backend"] == "onnx-int8"
+    assert registry.stats()[0]["memory_bytes"] == 100
+
+    with pytest.raises(ValueError):
+        registry.acquire(FakeOnnxModel, "org/mini", backend="tensorrt")
@@ -0,0 +1,92 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from src.agents.retrieval.reranker import RerankerAgent
+from src.agents.retrieval.score_cache import RerankScoreCache
+
+def fake_redis():
+    store = {}
+    client = MagicMock()
+    client.mget.side_effect = lambda keys: [store.get(key) for key in keys]
+    client.pipeline.return_value.set.side_effect = lambda key, value, px=None: store.__setitem__(key, value.encode())
+    return client
+
+def make_agent(redis_client=None, **kwargs):
+    with patch.object(RerankerAgent, "_load_model"):
+        agent = RerankerAgent("rerank", **kwargs)
+    if redis_client is not None:
+        agent.score_cache.redis = redis_client
+    agent.model = MagicMock(max_length=512, tokenizer=None)
+    # Score: number of query words found in the text
+    agent.model.predict.side_effect = lambda pairs, batch_size=None: [
+        float(sum(word in text for word in query.split())) for query, text in pairs]
+    return agent
+
+def docs(*texts):
+    return [{"id": str(i), "text": text} for i, text in enumerate(texts)]
+
+@pytest.mark.asyncio
+async def test_only_uncached_pairs_are_predicted():
+    agent = make_agent()
+    first = await agent.execute({"query": "graph rag", "documents": docs("graph rag", "rag", "other")})
+    assert [d["id"] for d in first["results"]] == ["0", "1", "2"]
+
+    second = await agent.execute({"query": "  graph   rag", "documents": docs("rag", "new graph doc", "graph rag")})
+    assert [d["text"] for d in second["results"]] == ["graph rag", "rag", "new graph doc"]
+    assert agent.model.predict.call_count == 2
+    assert agent.model.predict.call_args.args[0] == [("  graph   rag", "new graph doc")]
+    assert agent.score_cache.stats()["hits"] == 2
+
+@pytest.mark.asyncio
+async def test_redis_tier_is_shared_between_processes():
+    redis_client = fake_redis()
+    first = make_agent(redis_client)
+    await first.execute({"query": "q", "documents": docs("a", "b")})
+
+    second = make_agent(redis_client)
+    result = await second.execute({"query": "q", "documents": docs("b", "a")})
+    second.model.predict.assert_not_called()
+    assert second.score_cache.stats()["redis_hits"] == 2
+    assert len(result["results"]) == 2
+
+def test_redis_ttl_keeps_sub_second_precision():
+    redis_client = fake_redis()
+    RerankScoreCache("model", ttl=0.25, redis_client=redis_client).put_many({"k": 1.0})
+    assert redis_client.pipeline.return_value.set.call_args.kwargs["px"] == 250
+    RerankScoreCache("model", ttl=None, redis_client=redis_client).put_many({"k": 1.0})
+    assert redis_client.pipeline.return_value.set.call_args.kwargs["px"] is None
+
+@pytest.mark.asyncio
+async def test_documents_without_text_keep_their_own_score():
+    agent = make_agent(cache_size=0)
+    documents = [{"id": "no-text"}, {"id": "a", "text": "q"}, {"id": "b", "text": "x"}]
+    result = await agent.execute({"query": "q", "documents": documents})
+    assert [(d["id"], d["rerank_score"]) for d in result["results"]] == [("a", 1.0), ("b", 0.0), ("no-text", -1.0)]
+
+@pytest.mark.asyncio
+async def test_cascade_reranks_lexical_top_n():
+    agent = make_agent(first_stage="lexical", max_rerank=2, min_rerank=1)
+    documents = docs("unrelated", "graph", "nothing", "graph rag", "rag pipelines", "more noise")
+    result = await agent.execute({"query": "graph rag", "documents": documents})
+    assert result["reranked"] == 2
+    assert sorted(pair[1] for pair in agent.model.predict.call_args.args[0]) == ["graph", "graph rag"]
+    assert [d["text"] for d in result["results"][:3]] == ["graph rag", "graph", "rag pipelines"]
+    assert [d["rerank_score"] for d in result["results"][2:]] == [-1.0] * 4
+    assert len(result["results"]) == len(documents)
+
+@pytest.mark.asyncio
+async def test_latency_budget_counts_only_uncached_pairs():
+    agent = make_agent(min_rerank=1)
+    agent.executor.pair_ms = 10.0
+    agent.model.predict.side_effect = lambda pairs, batch_size=None: [0.0] * len(pairs)
+    documents = docs(*[f"doc {i}" for i in range(20)])
+
+    result = await agent.execute({"query": "q", "documents": documents, "max_rerank_ms": 35})
+    assert result["reranked"] == 3
+    # The cached pairs are free: the same budget now covers three more
+    agent.executor.pair_ms = 10.0
+    result = await agent.execute({"query": "q", "documents": docs(*[f"doc {i}" for i in range(20)]),
+                                  "max_rerank_ms": 35})
+    assert result["reranked"] == 6
+    assert len(agent.model.predict.call_args.args[0]) == 3
+    # Without a budget every candidate is reranked
+    assert (await agent.execute({"query": "q", "documents": documents}))["reranked"] == 20
@@ -0,0 +1,392 @@
+import pickle
+import random
+import numpy as np
+import pytest
+from src.agents.retrieval.analysis import Analyzer
+from src.agents.retrieval.bm25 import BM25Index
+from src.agents.retrieval.bm25_store import SegmentedBM25Index
+from src.agents.retrieval.postings import decode_varint, encode_varint
+from src.agents.retrieval.sparse import SparseRetrieverAgent
+
+WORDS = ["apple", "banana", "cherry", "delta", "echo", "fox", "golf", "hotel", "india", "juliet"] + [
+    f"filler{i}" for i in range(90)
+]
+
+def make_documents(n=200, seed=7):
+    rng = random.Random(seed)
+    return [
+        {"id": f"chunk-{i}", "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))}
+        for i in range(n)
+    ]
+
+@pytest.fixture
+def agent(tmp_path):
+    agent = SparseRetrieverAgent("test_sparse", index_path=str(tmp_path / "bm25_index"), background_merge=False)
+    agent.index_documents(make_documents())
+    return agent
+
+def test_scores_match_rank_bm25():
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    corpus = [doc["text"].split() for doc in make_documents()]
+    reference = rank_bm25.BM25Okapi(corpus)
+    index = BM25Index()
+    index.build(corpus)
+
+    query = ["apple", "golf", "golf", "unknown"]
+    expected = reference.get_scores(query)
+    docs, scores = index.score(query)
+    assert scores == pytest.approx(expected[docs])
+    # Documents without any query term are never scored
+    assert set(docs) == {i for i, doc in enumerate(corpus) if {"apple", "golf"} & set(doc)}
+
+@pytest.mark.asyncio
+async def test_sparse_retrieval(agent):
+    result = await agent.execute({"query": "Apple golf", "top_k": 5})
+
+    assert result["status"] == "success"
+    assert result["count"] == 5
+    scores = [r["score"] for r in result["results"]]
+    assert scores == sorted(scores, reverse=True)
+    assert all("golf" in r["text"] or "apple" in r["text"] for r in result["results"])
+
+@pytest.mark.asyncio
+async def test_sparse_retrieval_reloads_index(agent):
+    reloaded = SparseRetrieverAgent("test_sparse", index_path=agent.index_path)
+    task = {"query": "cherry hotel", "top_k": 3}
+    assert (await reloaded.execute(task))["results"] == (await agent.execute(task))["results"]
+
+def test_segment_is_memory_mapped(agent):
+    segment = agent.bm25.segments[0]
+    assert isinstance(segment.index.postings.doc_ids, np.memmap)
+    assert agent.bm25.num_docs == 200
+    assert segment.index.chunk_ids[5] == "chunk-5"
+
+@pytest.mark.asyncio
+async def test_legacy_pickle_is_migrated(tmp_path, agent):
+    documents = make_documents()
+    legacy_path = tmp_path / "legacy.pkl"
+    with open(legacy_path, "wb") as f:
+        pickle.dump({"bm25": None, "corpus": [d["text"] for d in documents],
+                     "chunk_ids": [d["id"] for d in documents]}, f)
+
+    SparseRetrieverAgent("legacy", index_path=str(legacy_path))
+    migrated = SparseRetrieverAgent("migrated", index_path=str(legacy_path))
+
+    assert legacy_path.is_dir()
+    task = {"query": "banana india", "top_k": 4}
+    assert (await migrated.execute(task))["results"] == (await agent.execute(task))["results"]
+
+@pytest.mark.asyncio
+async def test_legacy_default_pickle_is_migrated(tmp_path, agent):
+    documents = make_documents()
+    # The old default path, next to the new default directory
+    with open(tmp_path / "old_index.pkl", "wb") as f:
+        pickle.dump({"bm25": None, "corpus": [d["text"] for d in documents],
+                     "chunk_ids": [d["id"] for d in documents]}, f)
+
+    migrated = SparseRetrieverAgent("migrated", index_path=str(tmp_path / "old_index"))
+
+    assert migrated.bm25.num_docs == len(documents)
+    task = {"query": "banana india", "top_k": 4}
+    assert (await migrated.execute(task))["results"] == (await agent.execute(task))["results"]
+
+@pytest.mark.asyncio
+async def test_failed_migration_keeps_the_pickle(tmp_path, agent, monkeypatch):
+    documents = make_documents()
+    legacy_path = tmp_path / "legacy.pkl"
+    with open(legacy_path, "wb") as f:
+        pickle.dump({"bm25": None, "corpus": [d["text"] for d in documents],
+                     "chunk_ids": [d["id"] for d in documents]}, f)
+
+    def fail(self, documents, analyzer=None):
+        raise OSError("No space left on device")
+
+    with monkeypatch.context() as m:
+        m.setattr(SegmentedBM25Index, "rebuild", fail)
+        SparseRetrieverAgent("legacy", index_path=str(legacy_path))
+    assert (tmp_path / "legacy.pkl.bak").is_file()
+
+    migrated = SparseRetrieverAgent("migrated", index_path=str(legacy_path))
+    assert not (tmp_path / "legacy.pkl.bak").exists()
+    task = {"query": "banana india", "top_k": 4}
+    assert (await migrated.execute(task))["results"] == (await agent.execute(task))["results"]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("corrupt", ["manifest", "pickle"])
+async def test_unreadable_index_leaves_a_usable_agent(tmp_path, corrupt):
+    if corrupt == "manifest":
+        index_path = tmp_path / "index"
+        index_path.mkdir()
+        (index_path / "manifest.json").write_text("{not json")
+    else:
+        index_path = tmp_path / "legacy.pkl"
+        index_path.write_bytes(b"not a pickle")
+
+    agent = SparseRetrieverAgent("corrupt", index_path=str(index_path), background_merge=False)
+    assert agent.bm25 is not None and not agent.bm25.segments
+    # The unreadable data is kept, not deleted
+    kept = [path.name for path in tmp_path.iterdir() if path.name != "index" and path.name != "legacy.pkl"]
+    assert len(kept) == 1
+
+    agent.index_documents(make_documents(n=20))
+    result = await agent.execute({"query": "apple golf", "top_k": 3})
+    assert result["status"] == "success" and agent.bm25.num_docs == 20
+
+@pytest.mark.asyncio
+async def test_incremental_updates_match_rebuild(tmp_path, agent):
+    agent.bm25.max_segments, agent.bm25.merge_factor = 3, 2
+    documents = make_documents(260)
+    for start in range(200, 260, 10):
+        agent.add_documents(documents[start:start + 10])
+    updated = [{"id": "chunk-3", "text": "apple apple golf"}, {"id": "chunk-210", "text": "hotel india"}]
+    agent.update_documents(updated)
+    agent.delete_documents(["chunk-7", "chunk-250", "missing"])
+
+    expected = {doc["id"]: doc for doc in documents}
+    expected.update({doc["id"]: doc for doc in updated})
+    del expected["chunk-7"], expected["chunk-250"]
+    # Documents keep the order in which their current version was written
+    order = [d["id"] for d in documents if d["id"] not in ("chunk-3", "chunk-210")] + ["chunk-3", "chunk-210"]
+    rebuilt = SparseRetrieverAgent("rebuilt", index_path=str(tmp_path / "rebuilt"), background_merge=False)
+    rebuilt.index_documents([expected[i] for i in order if i in expected])
+
+    assert len(agent.bm25.segments) <= agent.bm25.max_segments
+    assert agent.bm25.num_docs == rebuilt.bm25.num_docs == 258
+    for query in ["apple golf", "hotel india", "filler3 cherry", "juliet"]:
+        task = {"query": query, "top_k": 10}
+        results = (await agent.execute(task))["results"]
+        expected_results = (await rebuilt.execute(task))["results"]
+        assert [r["id"] for r in results] == [r["id"] for r in expected_results]
+        assert [r["score"] for r in results] == pytest.approx([r["score"] for r in expected_results])
+
+    # Another process opening the index sees the same state
+    reopened = SparseRetrieverAgent("reopened", index_path=agent.index_path)
+    task = {"query": "apple golf", "top_k": 10}
+    assert (await reopened.execute(task))["results"] == (await agent.execute(task))["results"]
+
+def test_pruned_top_k_matches_exact():
+    rng = random.Random(3)
+    vocabulary = [f"w{i}" for i in range(400)]
+    # Zipf-like term distribution: a few very common terms, a long tail of rare ones
+    weights = [1.0 / (i + 1) for i in range(len(vocabulary))]
+    corpus = [rng.choices(vocabulary, weights, k=rng.randint(5, 60)) for _ in range(1000)]
+    index = BM25Index()
+    index.build(corpus)
+
+    for _ in range(50):
+        query = rng.choices(vocabulary, weights, k=rng.randint(2, 6))
+        exact = index.top_k(query, 10, pruned=False)
+        pruned = index.top_k(query, 10, pruned=True)
+        assert [doc for doc, _ in pruned] == [doc for doc, _ in exact]
+        assert [score for _, score in pruned] == pytest.approx([score for _, score in exact])
+
+@pytest.mark.asyncio
+async def test_search_modes_agree_across_segments(agent):
+    agent.add_documents(make_documents(260)[200:])
+    agent.delete_documents(["chunk-11", "chunk-230"])
+    for query in ["apple golf", "hotel india juliet", "filler3 cherry"]:
+        exact = await agent.execute({"query": query, "top_k": 8, "mode": "exact"})
+        pruned = await agent.execute({"query": query, "top_k": 8, "mode": "pruned"})
+        assert [r["id"] for r in pruned["results"]] == [r["id"] for r in exact["results"]]
+
+@pytest.mark.asyncio
+async def test_batch_matches_single_queries(agent):
+    agent.add_documents(make_documents(230)[200:])
+    agent.delete_documents(["chunk-4"])
+    queries = ["apple golf", "hotel india juliet", "apple golf", "nothing matches", "filler3 cherry"]
+
+    batch = await agent.execute({"queries": queries, "top_k": 6})
+
+    assert batch["status"] == "success"
+    assert batch["count"] == len(queries)
+    for query, results in zip(queries, batch["results"]):
+        single = (await agent.execute({"query": query, "top_k": 6, "mode": "exact"}))["results"]
+        assert [r["id"] for r in results] == [r["id"] for r in single]
+        assert [r["score"] for r in results] == pytest.approx([r["score"] for r in single])
+
+def test_analyzer_presets():
+    english = Analyzer.preset("english")
+    assert english.analyze("The Servers, and their Queries!") == ["server", "query"]
+    assert Analyzer.preset("whitespace").analyze("Error: disk-full") == ["error:", "disk-full"]
+    assert english.analyze_query("Caches") == ("cache",)
+    assert english.analyze_query("Caches") is english.analyze_query("Caches")
+
+@pytest.mark.asyncio
+async def test_index_keeps_its_analyzer(tmp_path):
+    path = str(tmp_path / "standard_index")
+    writer = SparseRetrieverAgent("writer", index_path=path, analyzer="standard", background_merge=False)
+    writer.index_documents([{"id": "1", "text": "The queries"}, {"id": "2", "text": "one query"},
+                            {"id": "3", "text": "something else"}, {"id": "4", "text": "and more"}])
+
+    reader = SparseRetrieverAgent("reader", index_path=path)  # configured for "english"
+    assert reader.bm25.analyzer.config() == Analyzer.preset("standard").config()
+    result = await reader.execute({"query": "queries", "top_k": 5})
+    assert [r["id"] for r in result["results"]] == ["1"]
+
+def test_varint_round_trip():
+    values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2**31 - 1], dtype=np.int64)
+    encoded, offsets = encode_varint(values)
+    assert np.diff(offsets).tolist() == [1, 1, 1, 2, 2, 2, 3, 5]
+    assert decode_varint(encoded).tolist() == values.tolist()
+
+def test_compressed_postings_match_plain(tmp_path):
+    documents = make_documents(n=2000, seed=5)
+    plain = BM25Index()
+    plain.build([d["text"].split() for d in documents])
+    compressed = BM25Index()
+    compressed.build([d["text"].split() for d in documents])
+    compressed.compress()
+    compressed.save(str(tmp_path / "seg"))
+    reopened = BM25Index.open(str(tmp_path / "seg"))
+
+    assert reopened.postings.nbytes < plain.postings.nbytes
+    docs, tfs = reopened.postings.all()
+    assert np.array_equal(docs, plain.postings.doc_ids) and np.array_equal(tfs, plain.postings.term_freqs)
+    for query in (["apple", "golf"], ["filler3", "echo", "echo"], ["juliet", "filler40", "filler41", "delta"]):
+        assert reopened.top_k(query, 10, pruned=True) == plain.top_k(query, 10, pruned=True)
+        assert reopened.top_k(query, 10, pruned=False) == plain.top_k(query, 10, pruned=False)
+
+@pytest.mark.asyncio
+async def test_compressed_index_survives_updates(tmp_path):
+    documents = make_documents()
+    agent = SparseRetrieverAgent("compressed", index_path=str(tmp_path / "compressed"), background_merge=False,
+                                 postings_format="compressed")
+    agent.bm25.max_segments, agent.bm25.merge_factor = 3, 2
+    for start in range(0, 200, 40):
+        agent.add_documents(documents[start:start + 40])
+    agent.delete_documents([f"chunk-{i}" for i in range(0, 200, 7)])
+    assert all(seg.index.postings.format == "varint" for seg in agent.bm25.segments)
+
+    reference = SparseRetrieverAgent("plain", index_path=str(tmp_path / "plain"), background_merge=False)
+    reference.index_documents([d for i, d in enumerate(documents) if i % 7])
+    for query in ("apple golf", "cherry hotel india"):
+        task = {"query": query, "top_k": 10}
+        assert (await agent.execute(task))["results"] == (await reference.execute(task))["results"]
+
+@pytest.mark.asyncio
+async def test_sharded_matches_single_index(tmp_path, agent):
+    sharded = SparseRetrieverAgent("sharded", index_path=str(tmp_path / "sharded"), background_merge=False,
+                                   num_shards=3)
+    try:
+        sharded.index_documents(make_documents())
+        sharded.delete_documents(["chunk-3", "chunk-10"])
+        agent.delete_documents(["chunk-3", "chunk-10"])
+        assert sharded.bm25.num_docs == agent.bm25.num_docs == 198
+        assert all(shard.num_docs for shard in sharded.bm25.shards)
+
+        for mode in ("pruned", "exact"):
+            for query in ("apple golf", "cherry hotel india", "filler7 juliet"):
+                task = {"query": query, "top_k": 8, "mode": mode}
+                expected = (await agent.execute(task))["results"]
+                actual = (await sharded.execute(task))["results"]
+                assert [r["id"] for r in actual] == [r["id"] for r in expected]
+                assert [r["score"] for r in actual] == pytest.approx([r["score"] for r in expected])
+
+        batch = await sharded.execute({"queries": ["apple golf", "delta"], "top_k": 5})
+        assert batch["results"][0] == (await sharded.execute({"query": "apple golf", "top_k": 5}))["results"]
+    finally:
+        sharded.close()
+
+@pytest.mark.asyncio
+async def test_sharded_ties_follow_write_order(tmp_path):
+    # Equal texts score equally; ids are spread over every shard
+    batches = [[{"id": f"tie-{i}", "text": "apple banana"} for i in range(start, start + 6)] for start in (0, 6)]
+    single = SparseRetrieverAgent("single", index_path=str(tmp_path / "single"), background_merge=False)
+    sharded = SparseRetrieverAgent("sharded", index_path=str(tmp_path / "sharded"), background_merge=False,
+                                   num_shards=3)
+    try:
+        for target in (single, sharded):
+            target.add_documents(batches[0] + [{"id": "tie-0", "text": "apple banana"}] +
+                                 [{"id": f"other-{i}", "text": f"cherry filler{i}"} for i in range(30)])
+            target.add_documents(batches[1])
+            target.update_documents([{"id": "tie-4", "text": "apple banana"}])
+        task = {"query": "apple", "top_k": 10}
+        expected = [r["id"] for r in (await single.execute(task))["results"]]
+        assert [r["id"] for r in (await sharded.execute(task))["results"]] == expected
+        assert expected[:3] == ["tie-0", "tie-1", "tie-2"]
+        assert all("seq" not in r for r in (await sharded.execute(task))["results"])
+    finally:
+        sharded.close()
+
+def test_parse_query_phrases():
+    analyzer = Analyzer.preset("english")
+    tokens, phrases = analyzer.parse_query('timeout "connection refused by the server" "golden apples"~3')
+    assert tokens == ("timeout", "connection", "refused", "server", "golden", "apple")
+    # Removed stopwords still count as positions
+    assert phrases == (((("connection", 0), ("refused", 1), ("server", 4)), 0), ((("golden", 0), ("apple", 1)), 3))
+
+PHRASE_DOCS = [
+    {"id": "exact", "text": "Error: connection refused by the server at startup"},
+    {"id": "reordered", "text": "the server refused the connection"},
+    {"id": "near", "text": "connection was eventually refused by server"},
+    {"id": "apart", "text": "connection " + "filler " * 20 + "refused by the server"},
+    {"id": "other", "text": "nothing to see here"},
+]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("positions", [True, False])
+async def test_phrase_and_proximity_queries(tmp_path, positions):
+    agent = SparseRetrieverAgent("phrases", index_path=str(tmp_path / "phrases"), background_merge=False,
+                                 positions=positions)
+    agent.index_documents(PHRASE_DOCS[:3])
+    agent.add_documents(PHRASE_DOCS[3:])
+    assert all(seg.index.has_positions == positions for seg in agent.bm25.segments)
+
+    async def ids(query, mode="pruned"):
+        result = await agent.execute({"query": query, "top_k": 10, "mode": mode})
+        return {r["id"] for r in result["results"]}
+
+    assert await ids("connection refused server") == {"exact", "reordered", "near", "apart"}
+    for mode in ("pruned", "exact"):
+        assert await ids('"connection refused by the server"', mode) == {"exact"}
+        assert await ids('"refused connection"~2', mode) == {"exact", "reordered", "near"}
+    assert await ids('"server connection"~2') == {"reordered"}
+    assert await ids('startup "unknown phrase"') == set()
+    batch = await agent.execute({"queries": ['"connection refused"', "connection"], "top_k": 10})
+    assert [len(results) for results in batch["results"]] == [1, 4]
+
+@pytest.mark.asyncio
+async def test_phrase_fallback_without_positions_is_bounded(tmp_path):
+    agent = SparseRetrieverAgent("fallback", index_path=str(tmp_path / "fallback"), background_merge=False)
+    agent.index_documents(PHRASE_DOCS * 20)
+    agent.bm25.phrase_fallback_limit = 10
+    analyzer = agent.bm25.analyzer
+    calls = 0
+    analyze = analyzer.analyze_with_positions
+
+    def counting(text):
+        # Stored documents only, not the query's phrases
+        nonlocal calls
+        calls += any(text == doc["text"] for doc in PHRASE_DOCS)
+        return analyze(text)
+
+    analyzer.analyze_with_positions = counting
+    result = await agent.execute({"query": '"connection refused by the server"', "top_k": 100})
+    # Too many candidates to re-analyse: the query fails rather than ignore the phrase
+    assert calls == 0
+    assert result["status"] == "error" and "positions=True" in result["message"]
+    assert (await agent.execute({"query": "connection refused server", "top_k": 100}))["status"] == "success"
+
+    agent.bm25.phrase_fallback_limit = 256
+    result = await agent.execute({"query": '"connection refused by the server"', "top_k": 100})
+    assert calls == 80 and {r["id"] for r in result["results"]} == {"exact"}
+
+def test_positions_survive_merges(tmp_path):
+    store_docs = make_documents(n=60)
+    agent = SparseRetrieverAgent("merged", index_path=str(tmp_path / "merged"), background_merge=False,
+                                 positions=True, postings_format="compressed")
+    agent.bm25.max_segments, agent.bm25.merge_factor = 2, 2
+    for start in range(0, 60, 10):
+        agent.add_documents(store_docs[start:start + 10])
+    agent.delete_documents(["chunk-1", "chunk-2"])
+    assert len(agent.bm25.segments) <= 2 and all(seg.index.has_positions for seg in agent.bm25.segments)
+
+    # Every adjacent word pair of a live document is a matching phrase
+    for doc in store_docs[3:8]:
+        words = doc["text"].split()
+        phrase = [(words[1], 0), (words[2], 1)]
+        matched = set()
+        for seg in agent.bm25.segments:
+            matched |= {seg.index.chunk_ids[int(d)] for d in seg.index.match_phrase(phrase) if not seg.deleted[d]}
+        assert doc["id"] in matched
+        assert all(f"{words[1]} {words[2]}" in d["text"] for d in store_docs if d["id"] in matched)
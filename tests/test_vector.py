@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from src.agents.retrieval.cache import TTLCache
+from src.agents.retrieval.fusion import HybridFusionAgent
+from src.agents.retrieval.vector import VectorRetrieverAgent
+from src.agents.retrieval.vector_backends import qdrant_point_id
+
+@pytest.fixture
+def agent():
+    with patch("src.agents.retrieval.vector.get_async_client", return_value=AsyncMock()), \
+            patch.object(VectorRetrieverAgent, "_load_embedding_model"):
+        agent = VectorRetrieverAgent("test_vector")
+    agent.model = MagicMock()
+    agent.model.encode.side_effect = lambda texts: np.array([[len(t), i] for i, t in enumerate(texts)], dtype=np.float32)
+    agent.client.query_points.return_value = MagicMock(points=[MagicMock(id="c1", score=0.9, payload={"text": "hit"})])
+    return agent
+
+@pytest.mark.asyncio
+async def test_repeated_queries_skip_encoding(agent):
+    for query in ("What is RAG?", "  What is   RAG? ", "What is RAG?"):
+        result = await agent.execute({"query": query, "top_k": 3})
+        assert result["status"] == "success"
+        assert result["results"][0]["id"] == "c1"
+
+    agent.model.encode.assert_called_once_with(["What is RAG?"])
+    assert agent.query_cache.stats()["hits"] == 2
+    assert agent.query_cache.stats()["misses"] == 1
+    assert agent.client.query_points.await_count == 3
+
+def test_ttl_cache_expiry_and_eviction():
+    cache = TTLCache("test", max_size=2, ttl=10)
+    with patch("src.agents.retrieval.cache.time.monotonic", return_value=100.0):
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)  # evicts "b", the least recently used
+        assert cache.get("b") is None
+    with patch("src.agents.retrieval.cache.time.monotonic", return_value=111.0):
+        assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+@pytest.mark.asyncio
+async def test_batch_encodes_once_and_searches_once(agent):
+    def point(id, score):
+        return MagicMock(id=id, score=score, payload={})
+
+    agent.client.query_batch_points.return_value = [
+        MagicMock(points=[point("a", 0.9), point("b", 0.5), point("a", 0.4)]),
+        MagicMock(points=[point("b", 0.8), point("c", 0.7)]),
+    ]
+    result = await agent.execute({"queries": ["apple pie", "apple tart", "apple  pie"], "top_k": 3})
+
+    assert result["status"] == "success"
+    agent.model.encode.assert_called_once_with(["apple pie", "apple tart"])
+    requests = agent.client.query_batch_points.call_args.kwargs["requests"]
+    assert len(requests) == 2 and requests[0].limit == 3
+    assert [[hit["id"] for hit in hits] for hits in result["results"]] == [["a", "b"], ["b", "c"], ["a", "b"]]
+    assert [(hit["id"], hit["score"]) for hit in result["merged"]] == [("a", 0.9), ("b", 0.8), ("c", 0.7)]
+
+@pytest.mark.asyncio
+async def test_encoding_runs_off_the_event_loop(agent):
+    loop_thread = threading.get_ident()
+    threads = []
+    agent.model.encode.side_effect = lambda texts: threads.append(threading.get_ident()) or np.ones((len(texts), 2))
+    await agent.execute({"query": "fresh query"})
+    assert threads and threads[0] != loop_thread
+
+def test_agents_share_one_client():
+    with patch("src.agents.retrieval.vector.AsyncQdrantClient") as client_cls, \
+            patch.object(VectorRetrieverAgent, "_load_embedding_model"), \
+            patch.dict("src.agents.retrieval.vector._clients", clear=True):
+        first = VectorRetrieverAgent("a", qdrant_url="http://qdrant:6333")
+        second = VectorRetrieverAgent("b", qdrant_url="http://qdrant:6333")
+    assert first.client is second.client
+    client_cls.assert_called_once_with(url="http://qdrant:6333")
+
+@pytest.mark.asyncio
+async def test_concurrent_queries_are_micro_batched(agent):
+    agent.batcher.max_wait = 0.05
+    results = await asyncio.gather(*(agent.execute({"query": f"query {i}"}) for i in range(4)))
+    assert all(result["status"] == "success" for result in results)
+    agent.model.encode.assert_called_once()
+    assert sorted(agent.model.encode.call_args.args[0]) == [f"query {i}" for i in range(4)]
+
+@pytest.mark.asyncio
+async def test_qdrant_hits_fuse_with_sparse_hits(agent):
+    def point(chunk_id, score):
+        return MagicMock(id=qdrant_point_id(chunk_id), score=score, payload={"chunk_id": chunk_id, "text": chunk_id})
+
+    agent.client.query_points.return_value = MagicMock(points=[point("chunk-1", 0.9), point("chunk-2", 0.8)])
+    vector = await agent.execute({"query": "fusion", "top_k": 2})
+    assert [hit["id"] for hit in vector["results"]] == ["chunk-1", "chunk-2"]
+
+    sparse = [{"id": "chunk-2", "text": "chunk-2", "score": 3.0}, {"id": "chunk-1", "text": "chunk-1", "score": 2.0}]
+    fused = await HybridFusionAgent("fusion").execute({"results": {"vector": vector["results"], "sparse": sparse}})
+    assert sorted(hit["id"] for hit in fused["results"]) == ["chunk-1", "chunk-2"]
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from src.agents.retrieval.vector import VectorRetrieverAgent
+from src.agents.retrieval.vector_index import LocalVectorIndex
+
+def make_vectors(n=1500, dim=32, seed=3):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(20, dim))
+    return (centers[rng.integers(0, 20, n)] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32)
+
+def brute_force(vectors, queries, k):
+    v = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.argsort(-(q @ v.T), axis=1)[:, :k]
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_exact_search_matches_brute_force(tmp_path, dtype):
+    vectors = make_vectors()
+    queries = make_vectors(n=20, seed=4)
+    index = LocalVectorIndex(32, dtype=dtype)
+    index.add([f"p{i}" for i in range(len(vectors))], vectors, [{"i": i} for i in range(len(vectors))])
+    index.save(str(tmp_path / "exact"))
+    opened = LocalVectorIndex.open(str(tmp_path / "exact"))
+    assert isinstance(opened.vectors, np.memmap) and opened.vectors.dtype == np.dtype(dtype)
+
+    expected = brute_force(vectors, queries, 10)
+    for hits, rows in zip(opened.search(queries, 10), expected):
+        overlap = len({row for row, _ in hits} & set(rows))
+        assert overlap == 10 if dtype == "float32" else overlap >= 9
+        scores = [score for _, score in hits]
+        assert scores == sorted(scores, reverse=True)
+
+def test_hnsw_recall_and_persistence(tmp_path):
+    vectors = make_vectors()
+    queries = make_vectors(n=50, seed=5)
+    index = LocalVectorIndex(32, mode="hnsw")
+    index.add(list(range(len(vectors))), vectors)
+    expected = brute_force(vectors, queries, 10)
+    results = index.search(queries, 10)
+    recall = np.mean([len({row for row, _ in hits} & set(rows)) / 10 for hits, rows in zip(results, expected)])
+    assert recall >= 0.95
+
+    index.save(str(tmp_path / "hnsw"))
+    opened = LocalVectorIndex.open(str(tmp_path / "hnsw"))
+    assert opened.search(queries, 10) == results
+
+    # Replacing a point hides its old vector; the graph keeps accepting inserts after reopening
+    opened.add([0], -vectors[:1])
+    hits = opened.search(vectors[:1], 3)[0]
+    assert all(opened.ids[row] != 0 for row, _ in hits)
+    assert opened.ids[opened.search(-vectors[:1], 1)[0][0][0]] == 0
+    assert len(opened) == len(vectors)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["exact", "hnsw"])
+async def test_agent_with_local_backend(tmp_path, backend):
+    with patch.object(VectorRetrieverAgent, "_load_embedding_model"):
+        agent = VectorRetrieverAgent("local", backend=backend, index_path=str(tmp_path / "vectors"))
+    assert agent.client is None
+    vectors = make_vectors(n=200)
+    result = await agent.upsert([f"c{i}" for i in range(200)], vectors.tolist(), [{"text": f"doc {i}"} for i in range(200)])
+    assert result == {"status": "success", "count": 200}
+
+    agent.model = MagicMock()
+    agent.model.encode.side_effect = lambda texts: vectors[[int(t) for t in texts]]
+    result = await agent.execute({"query": "17", "top_k": 3})
+    assert result["status"] == "success"
+    assert result["results"][0]["id"] == "c17"
+    assert result["results"][0]["payload"] == {"text": "doc 17"}
+    assert result["results"][0]["score"] == pytest.approx(1.0, abs=1e-5)
+
+    with patch.object(VectorRetrieverAgent, "_load_embedding_model"):
+        reopened = VectorRetrieverAgent("local", backend=backend, index_path=str(tmp_path / "vectors"))
+    reopened.model = agent.model
+    batch = await reopened.execute({"queries": ["5", "9"], "top_k": 1})
+    assert [hits[0]["id"] for hits in batch["results"]] == ["c5", "c9"]
@@ -0,0 +1,97 @@
+import asyncio
+import uuid
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock, patch
+from src.agents.retrieval.vector_backends import LocalVectorBackend, VectorBackend, qdrant_point_id
+from src.agents.retrieval.vector_index import LocalVectorIndex
+from src.agents.retrieval.vector_loader import BulkVectorLoader
+
+class RecordingBackend(VectorBackend):
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.active = 0
+        self.max_active = 0
+        self.fail_on = fail_on or set()
+
+    async def search(self, vectors, top_k):
+        return [[] for _ in vectors]
+
+    async def upsert(self, ids, vectors, payloads=None):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            # Later batches finish first
+            await asyncio.sleep(0.01 * (3 - len(self.batches) % 3))
+            if ids[0] in self.fail_on:
+                raise ConnectionError("qdrant unavailable")
+            self.batches.append(list(ids))
+        finally:
+            self.active -= 1
+
+def records(n, dim=4):
+    return [(f"c{i}", np.full(dim, i, dtype=np.float32), {"text": f"chunk {i}"}) for i in range(n)]
+
+@pytest.mark.asyncio
+async def test_parallel_batches_with_bounded_in_flight():
+    backend = RecordingBackend()
+    loader = BulkVectorLoader(backend, batch_size=10, max_in_flight=3)
+    result = await loader.load(records(95))
+    assert result["count"] == 95 and result["batches"] == 10 and result["offset"] == 95
+    assert backend.max_active == 3
+    assert sorted(i for batch in backend.batches for i in batch) == sorted(f"c{i}" for i in range(95))
+
+@pytest.mark.asyncio
+async def test_batches_are_capped_by_request_size():
+    backend = RecordingBackend()
+    loader = BulkVectorLoader(backend, batch_size=1000, max_batch_bytes=12 * 4 * 5 + 400)
+    await loader.load(records(20))
+    assert max(len(batch) for batch in backend.batches) < 20
+
+@pytest.mark.asyncio
+async def test_failed_load_resumes_from_checkpoint(tmp_path):
+    checkpoint = str(tmp_path / "load.json")
+    chunks = [{"id": f"c{i}", "text": f"chunk {i}", "doc_id": "d1"} for i in range(50)]
+    agent = AsyncMock()
+    agent.execute.side_effect = lambda task: {
+        "status": "success", "embeddings": np.ones((len(task["texts"]), 4), dtype=np.float32)}
+
+    failing = RecordingBackend(fail_on={"c30"})
+    loader = BulkVectorLoader(failing, batch_size=10, max_in_flight=2, checkpoint_path=checkpoint,
+                              retries=1, retry_delay=0)
+    with pytest.raises(ConnectionError):
+        await loader.load_chunks(agent, chunks, embed_batch=10)
+    offset = loader.resume_offset()
+    assert offset == 30
+
+    backend = RecordingBackend()
+    agent.execute.reset_mock()
+    loader = BulkVectorLoader(backend, batch_size=10, checkpoint_path=checkpoint)
+    result = await loader.load_chunks(agent, chunks, embed_batch=10)
+    assert result["offset"] == 50 and result["count"] == 20
+    # Chunks stored by the first run are not embedded again
+    embedded = [text for call in agent.execute.call_args_list for text in call.args[0]["texts"]]
+    assert embedded == [f"chunk {i}" for i in range(30, 50)]
+    assert loader.resume_offset() == 50
+
+def test_qdrant_point_ids():
+    assert qdrant_point_id(7) == 7
+    uid = str(uuid.uuid4())
+    assert qdrant_point_id(uid) == uid
+    assert qdrant_point_id("doc1_chunk_0") == qdrant_point_id("doc1_chunk_0") != qdrant_point_id("doc1_chunk_1")
+    uuid.UUID(qdrant_point_id("doc1_chunk_0"))
+
+@pytest.mark.asyncio
+async def test_local_backend_saves_once_per_load(tmp_path):
+    backend = LocalVectorBackend(str(tmp_path / "vectors"))
+    loader = BulkVectorLoader(backend, batch_size=10, checkpoint_path=str(tmp_path / "load.json"))
+    with patch.object(LocalVectorIndex, "save", autospec=True, side_effect=LocalVectorIndex.save) as save:
+        await loader.load(records(95))
+    assert save.call_count == 1
+    assert loader.resume_offset() == 95
+    assert len(LocalVectorBackend(str(tmp_path / "vectors")).index) == 95
+
+    # Outside a bulk load every write is still saved before it returns
+    with patch.object(LocalVectorIndex, "save", autospec=True, side_effect=LocalVectorIndex.save) as save:
+        await backend.upsert(["c200"], np.ones((1, 4), dtype=np.float32))
+    assert save.call_count == 1